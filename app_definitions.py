@@ -1,17 +1,74 @@
 import json
 import os
 
+# Кэш плагинов одним JSON-файлом: имя файла → [mtime_ns, size, содержимое].
+# Только данные, без pickle: кэш лежит в общей папке Plugins/, и подложенный файл
+# не должен выполнять код при загрузке
+CACHE_NAME = ".plugins.cache"
+CACHE_VERSION = 2
+
+def _read_cache(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("version") == CACHE_VERSION and isinstance(cache.get("files"), dict):
+            return cache["files"]
+    except Exception:
+        pass
+    return {}
+
+def _write_cache(path, files):
+    try:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "files": files}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"[ERROR] Не удалось сохранить кэш плагинов: {e}")
+
+def load_plugin_files(dir="Plugins", use_cache=True):
+    # Перечитываются только файлы, у которых изменились mtime или размер
+    if not os.path.exists(dir):
+        return {}
+    cache_path = os.path.join(dir, CACHE_NAME)
+    cached = _read_cache(cache_path) if use_cache else {}
+    files = {}
+    changed = False
+    with os.scandir(dir) as it:
+        entries = sorted((e for e in it if e.name.endswith(".json") and e.is_file()), key=lambda e: e.name)
+    for entry in entries:
+        st = entry.stat()
+        hit = cached.get(entry.name)
+        if hit and hit[0] == st.st_mtime_ns and hit[1] == st.st_size:
+            files[entry.name] = hit
+            continue
+        try:
+            with open(entry.path, "r", encoding="utf-8") as j:
+                files[entry.name] = (st.st_mtime_ns, st.st_size, json.load(j))
+            changed = True
+        except Exception as e:
+            print(f"[ERROR] Не удалось загрузить {entry.name}: {e}")
+    if use_cache and (changed or files.keys() != cached.keys()):
+        _write_cache(cache_path, files)
+    return {name: data for name, (_, _, data) in files.items()}
+
+def find_duplicate_plugins(dir="Plugins", files=None):
+    owners = {}
+    for fname, data in (files if files is not None else load_plugin_files(dir)).items():
+        for app in data:
+            owners.setdefault(app, []).append(fname)
+    return {app: names for app, names in owners.items() if len(names) > 1}
+
 def load_plugins(dir="Plugins"):
+    # При дубликатах имён приложений побеждает первый файл по алфавиту
     out = {}
-    if not os.path.exists(dir):
-        return out
-    for f in os.listdir(dir):
-        if f.endswith(".json"):
-            try:
-                with open(os.path.join(dir, f), "r", encoding="utf-8") as j:
-                    out.update(json.load(j))
-            except Exception as e:
-                print(f"[ERROR] Не удалось загрузить {f}: {e}")
+    files = load_plugin_files(dir)
+    for fname, data in files.items():
+        for app, definition in data.items():
+            if app not in out:
+                out[app] = definition
+    for app, names in find_duplicate_plugins(dir, files).items():
+        print(f"[WARN] Приложение {app} описано в нескольких плагинах: {', '.join(names)} — используется {names[0]}")
     return out
 
 def load_custom_rules(path="Config/custom_rules.json"):
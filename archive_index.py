@@ -0,0 +1,290 @@
+import io, mmap, time, zlib, struct, zipfile
+from collections import namedtuple
+from encryption import ArchiveKey, DecryptReader, PassphraseError, KEY_NAME, NONCE_SIZE, TAG_SIZE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Компактный индекс членов архива для выборочного восстановления без распаковки остального.
+# StreamingZip кладёт его последним членом архива (без сжатия), а смещение и длину данных
+# пишет в комментарий конца центрального каталога — читатель находит индекс по хвосту файла
+# и работает с ним через mmap, не разбирая центральный каталог целиком.
+#
+# Формат (little-endian): заголовок, записи фиксированной длины, хеш-таблица
+# с открытой адресацией (номер записи + 1, 0 — пусто) и пул имён в UTF-8.
+INDEX_NAME = ".backupapp-index"
+MAGIC = b"BAIX"
+VERSION = 1
+ZIP_ZSTANDARD = 93
+# Зашифрованный член (encryption) помечается собственным номером метода — как AE-x помечает
+# свои методом 99, — а настоящий метод сжатия лежит в поле extra ENCRYPTED_EXTRA. Бит 0x01 не
+# ставится: с ним unzip и 7-Zip принимают член за ZipCrypto и сообщают о неверном пароле, а
+# так честно пишут «неподдерживаемый метод». CRC у таких членов 0: CRC открытых данных выдавал
+# бы их содержимое, целостность проверяется тегом GCM.
+ZIP_ENCRYPTED = 0x4142
+ENCRYPTED_EXTRA = 0x4142
+BUF_SIZE = 1024 * 1024
+
+_HEADER = struct.Struct("<4sHHII")        # magic, версия, резерв, записей, слотов
+_RECORD = struct.Struct("<QQQqIIHH")      # смещение заголовка, сжатый размер, размер, mtime_ns, crc, смещение и длина имени, метод
+_SLOT = struct.Struct("<I")
+_COMMENT = struct.Struct("<4sQQ")         # magic, смещение данных индекса, длина
+_EOCD = struct.Struct("<IHHHHIIH")
+
+Entry = namedtuple("Entry", "name offset compressed size mtime_ns crc method")
+
+
+def pack_index(entries):
+    # entries — Entry в порядке архива → bytes
+    entries = list(entries)
+    slots = 2
+    while slots < 2 * len(entries):
+        slots *= 2
+    mask = slots - 1
+    table = [0] * slots
+    records, names = [], bytearray()
+    for i, e in enumerate(entries):
+        raw = e.name.encode("utf-8")
+        records.append(_RECORD.pack(e.offset, e.compressed, e.size, e.mtime_ns, e.crc, len(names), len(raw), e.method))
+        names += raw
+        j = zlib.crc32(raw) & mask
+        while table[j]:
+            j = (j + 1) & mask
+        table[j] = i + 1
+    return (_HEADER.pack(MAGIC, VERSION, 0, len(entries), slots) + b"".join(records)
+            + struct.pack(f"<{slots}I", *table) + bytes(names))
+
+
+def index_comment(offset, length):
+    return _COMMENT.pack(MAGIC, offset, length)
+
+
+def encrypted_extra(method):
+    return struct.pack("<HHH", ENCRYPTED_EXTRA, 2, method)
+
+
+def _method(info):
+    # Метод сжатия члена из центрального каталога; у зашифрованного — из поля ENCRYPTED_EXTRA
+    if info.compress_type == ZIP_ENCRYPTED:
+        pos = 0
+        while pos + 4 <= len(info.extra):
+            header, length = struct.unpack_from("<HH", info.extra, pos)
+            if header == ENCRYPTED_EXTRA and length >= 2:
+                return struct.unpack_from("<H", info.extra, pos + 4)[0]
+            pos += 4 + length
+    return info.compress_type
+
+
+def is_encrypted(zip_path):
+    with ArchiveIndex(zip_path) as index:
+        return index.encrypted
+
+
+class ArchiveIndex:
+    # Чтение из нескольких потоков безопасно: данные берутся срезами mmap, общей позиции нет.
+    # Архивы без индекса (старые или чужие) читаются через центральный каталог один раз.
+    # secret — пароль или ключевой файл (bytes) для зашифрованного архива; список членов доступен и без него.
+    def __init__(self, zip_path, secret=None):
+        self.zip_path = zip_path
+        self._f = open(zip_path, "rb")
+        try:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            located = self._locate()
+            if located:
+                self._buf, self._base = self._mm, located
+            else:
+                self._buf, self._base = self._from_central(), 0
+            magic, version, _, self.count, self.slots = _HEADER.unpack_from(self._buf, self._base)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"неизвестный формат индекса: {zip_path}")
+        except BaseException:
+            self.close()
+            raise
+        self._records = self._base + _HEADER.size
+        self._table = self._records + self.count * _RECORD.size
+        self._names = self._table + self.slots * _SLOT.size
+        self.indexed = located is not None
+        key_entry = self.lookup(KEY_NAME)
+        self.encrypted = key_entry is not None
+        self.key = None
+        if self.encrypted and secret is not None:
+            try:
+                self.key = ArchiveKey.open(secret, self._stored_data(key_entry))
+            except BaseException:
+                self.close()
+                raise
+
+    def _locate(self):
+        # Индекс есть, если в конце файла EOCD с нашим комментарием
+        pos = len(self._mm) - _EOCD.size - _COMMENT.size
+        if pos < 0:
+            return None
+        sig, *_, comment_len = _EOCD.unpack_from(self._mm, pos)
+        if sig != 0x06054b50 or comment_len != _COMMENT.size:
+            return None
+        magic, offset, length = _COMMENT.unpack_from(self._mm, pos + _EOCD.size)
+        if magic != MAGIC or offset + length > pos:
+            return None
+        return offset
+
+    def _from_central(self):
+        with zipfile.ZipFile(self._f) as zf:
+            return pack_index(
+                Entry(info.filename, info.header_offset, info.compress_size, info.file_size,
+                      int(time.mktime(info.date_time + (0, 0, -1))) * 1_000_000_000, info.CRC, _method(info))
+                for info in zf.infolist() if not info.is_dir() and info.filename != INDEX_NAME)
+
+    def _entry(self, i):
+        offset, compressed, size, mtime_ns, crc, name_off, name_len, method = \
+            _RECORD.unpack_from(self._buf, self._records + i * _RECORD.size)
+        start = self._names + name_off
+        return Entry(self._buf[start:start + name_len].decode("utf-8"), offset, compressed, size, mtime_ns, crc, method)
+
+    def lookup(self, name):
+        raw = name.encode("utf-8")
+        mask = self.slots - 1
+        j = zlib.crc32(raw) & mask
+        while True:
+            (n,) = _SLOT.unpack_from(self._buf, self._table + j * _SLOT.size)
+            if not n:
+                return None
+            entry = self._entry(n - 1)
+            if entry.name == name:
+                return entry
+            j = (j + 1) & mask
+
+    def entries(self, prefix=""):
+        for i in range(self.count):
+            entry = self._entry(i)
+            if entry.name.startswith(prefix) and entry.name != KEY_NAME:
+                yield entry
+
+    def select(self, name):
+        # Файл name или всё содержимое папки name/ → [(entry, путь внутри name)]
+        entry = self.lookup(name)
+        if entry is not None:
+            return [(entry, "")]
+        prefix = name.rstrip("/") + "/"
+        return [(e, e.name[len(prefix):]) for e in self.entries(prefix)]
+
+    def _data_range(self, entry):
+        if self._mm[entry.offset:entry.offset + 4] != b"PK\x03\x04":
+            raise OSError(f"повреждён заголовок члена архива: {entry.name}")
+        name_len, extra_len = struct.unpack_from("<HH", self._mm, entry.offset + 26)
+        start = entry.offset + 30 + name_len + extra_len
+        return start, start + entry.compressed
+
+    def _stored_data(self, entry):
+        start, end = self._data_range(entry)
+        return self._mm[start:end]
+
+    def open(self, entry):
+        # Поток распакованных данных члена; CRC (у зашифрованного — тег GCM) сверяется при дочитывании
+        start, end = self._data_range(entry)
+        if self.encrypted:
+            if self.key is None:
+                raise PassphraseError(f"архив зашифрован, нужен пароль или ключевой файл: {self.zip_path}")
+            name = entry.name.encode("utf-8")
+            nonce, tag = self._mm[start:start + NONCE_SIZE], self._mm[end - TAG_SIZE:end]
+            raw = DecryptReader(_SliceReader(self._mm, start + NONCE_SIZE, end - TAG_SIZE),
+                                self.key.decryptor(name, nonce, tag), entry.name)
+        else:
+            raw = _SliceReader(self._mm, start, end)
+        if entry.method == zipfile.ZIP_STORED:
+            stream = raw
+        elif entry.method == zipfile.ZIP_DEFLATED:
+            stream = _InflateReader(raw)
+        elif entry.method == ZIP_ZSTANDARD:
+            if zstandard is None:
+                raise RuntimeError("Для распаковки zstd нужен пакет zstandard")
+            stream = zstandard.ZstdDecompressor().stream_reader(io.BufferedReader(raw, BUF_SIZE),
+                                                                 read_across_frames=True)
+        else:
+            raise OSError(f"неподдерживаемый метод сжатия {entry.method}: {entry.name}")
+        return io.BufferedReader(_CheckedReader(stream, entry, not self.encrypted), BUF_SIZE)
+
+    def close(self):
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class _SliceReader(io.RawIOBase):
+    def __init__(self, mm, start, end):
+        self._mm = mm
+        self._pos = start
+        self._end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._end - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._mm[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+class _InflateReader(io.RawIOBase):
+    # Raw deflate порциями не больше BUF_SIZE: сильно сжатый член не раздувается в памяти
+    def __init__(self, raw):
+        self._raw = raw
+        self._z = zlib.decompressobj(-15)
+        self._buf = b""
+        self._off = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._off >= len(self._buf):
+            data = self._z.unconsumed_tail or self._raw.read(BUF_SIZE)
+            if not data:
+                self._buf, self._off = self._z.flush(), 0
+                if not self._buf:
+                    return 0
+                break
+            self._buf, self._off = self._z.decompress(data, BUF_SIZE), 0
+        n = min(len(b), len(self._buf) - self._off)
+        b[:n] = self._buf[self._off:self._off + n]
+        self._off += n
+        return n
+
+
+class _CheckedReader(io.RawIOBase):
+    # check_crc=False — только размер: у зашифрованных членов CRC не пишется
+    def __init__(self, stream, entry, check_crc=True):
+        self._stream = stream
+        self._entry = entry
+        self._check_crc = check_crc
+        self._crc = 0
+        self._size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self._stream.readinto(b)
+        if n:
+            if self._check_crc:
+                self._crc = zlib.crc32(memoryview(b)[:n], self._crc)
+            self._size += n
+        elif (self._check_crc and self._crc != self._entry.crc) or self._size != self._entry.size:
+            raise OSError(f"контрольная сумма не совпала: {self._entry.name}")
+        return n
+
+    def close(self):
+        self._stream.close()
+        super().close()
@@ -0,0 +1,410 @@
+import os, time, zlib, struct, threading, zipfile
+from manifest import new_hash, HASH_ALGO
+import metrics
+import progress
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tree_walk import iter_tree
+from archive_index import Entry, INDEX_NAME, ZIP_ZSTANDARD, ZIP_ENCRYPTED, pack_index, index_comment, encrypted_extra
+from encryption import ArchiveKey, KEY_NAME
+from storage_targets import LocalTarget
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Уже сжатые форматы кладутся в архив без сжатия
+STORED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".ico",
+    ".zip", ".7z", ".rar", ".gz", ".bz2", ".xz", ".zst", ".cab", ".jar",
+    ".mp3", ".mp4", ".mkv", ".avi", ".ogg", ".webm", ".m4a",
+    ".woff", ".woff2", ".pdf",
+    ".ldb", ".sqlite-wal", ".pak", ".crx",
+}
+
+# Уровень deflate по типу файла, если уровень не задан явно
+LEVEL_BY_EXT = {
+    ".json": 9, ".ini": 9, ".cfg": 9, ".xml": 9, ".txt": 9, ".reg": 9,
+    ".log": 3, ".sqlite": 4, ".db": 4,
+}
+DEFAULT_LEVEL = 6
+
+# Именованные уровни в духе zstd: для deflate 0–9, для zstd 1–19
+LEVEL_PRESETS = {
+    "deflate": {"store": 0, "fast": 1, "default": DEFAULT_LEVEL, "max": 9},
+    "zstd": {"store": 0, "fast": 3, "default": 9, "max": 19},
+}
+CODECS = ["deflate", "zstd"] if zstandard else ["deflate"]
+
+# Крупные файлы режутся на блоки, блоки сжимаются независимо (как pigz) и склеиваются
+BLOCK_SIZE = 1024 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+# Файлы больше этого порога сразу пишутся с ZIP64-полями
+_ZIP64_THRESHOLD = 0xF0000000
+
+# zlib и zstandard отпускают GIL, поэтому общий пул потоков загружает все ядра
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def compression_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="compress")
+        return _pool
+
+
+def parse_level(value, codec="deflate"):
+    if value is None or isinstance(value, int):
+        return value
+    if value in LEVEL_PRESETS[codec]:
+        return LEVEL_PRESETS[codec][value]
+    return int(value)
+
+
+def _dos_time(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def _compress(data, method, level, last):
+    if method == zipfile.ZIP_STORED:
+        return data
+    if method == ZIP_ZSTANDARD:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return c.compress(data) + c.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+# Задачи пула возвращают (crc, размер, сжатые данные, хеш, время чтения, время сжатия);
+# время учитывается в метриках уже в основном потоке.
+def _compress_block(data, method, level, last):
+    t = time.perf_counter()
+    out = _compress(data, method, level, last)
+    return None, len(data), out, None, 0.0, time.perf_counter() - t
+
+
+def _read_and_compress(f, method, level, algo):
+    t0 = time.perf_counter()
+    with f:
+        data = f.read()
+    t1 = time.perf_counter()
+    digest = new_hash(algo)
+    digest.update(data)
+    t2 = time.perf_counter()
+    out = _compress(data, method, level, True)
+    return zlib.crc32(data), len(data), out, digest.hexdigest(), t1 - t0, time.perf_counter() - t2
+
+
+class _Member:
+    def __init__(self, name, mtime_ns, method, zip64):
+        self.arcname = name
+        self.name = name.encode("utf-8")
+        self.mtime_ns = mtime_ns
+        self.mtime = mtime_ns / 1e9
+        self.method = method
+        self.zip64 = zip64
+        self.blocks = deque()
+        self.complete = False
+        self.header_written = False
+        self.crc = 0
+        self.size = 0
+        self.compressed = 0
+        self.offset = 0
+        self.digest = None
+        self.error = None
+        self.cipher = None
+        self.encrypted = False
+        self.flags = 0x08 | 0x800
+        self.started = time.perf_counter()
+
+
+class StreamingZip:
+    # Читает исходные файлы один раз и пишет их сразу в архив; сжатие идёт параллельно
+    # в общем пуле, члены архива записываются строго по порядку. Архив пишется
+    # последовательно (с дескрипторами данных) в писателя цели хранения: локально — во
+    # временный .part, который переименовывается только при успешном закрытии, удалённо —
+    # частями на сервер по ходу записи. index — дописать индекс членов (archive_index);
+    # secret — пароль или ключевой файл (bytes): члены шифруются (encryption);
+    # target — цель хранения (storage_targets), zip_path тогда — имя внутри неё.
+    def __init__(self, zip_path, level=None, codec="deflate", level_by_ext=None, stored_extensions=None,
+                 max_pending=None, manifest=None, index=True, secret=None, target=None):
+        if codec not in CODECS:
+            raise ValueError(f"Кодек недоступен: {codec}")
+        self.target = target or LocalTarget("")
+        self.zip_path = self.target.path(zip_path)
+        self.codec = codec
+        self.level = parse_level(level, codec)
+        self.level_by_ext = LEVEL_BY_EXT if level_by_ext is None else level_by_ext
+        self.stored = STORED_EXTENSIONS if stored_extensions is None else stored_extensions
+        self.max_pending = max_pending or 4 * (os.cpu_count() or 2)
+        self.manifest = manifest
+        self.index = index
+        self._index_at = None
+        self.algo = manifest.algo if manifest else HASH_ALGO
+        self.metrics = metrics.current()
+        self.progress = progress.current()
+        self.count = 0
+        self.bytes_in = 0
+        # Члены, которые не удалось прочитать: [(имя, ошибка)]; в архив они не попадают
+        self.failed = []
+        self._pool = compression_pool()
+        self._queue = deque()
+        self._outstanding = 0
+        self._central = []
+        self.key = ArchiveKey.create(secret) if secret is not None else None
+        self._out = self.target.open_write(zip_path)
+        if self.key is not None:
+            self._write_stored(KEY_NAME, self.key.header())
+
+    def compression_for(self, name):
+        ext = os.path.splitext(name)[1].lower()
+        if ext in self.stored or self.level == 0:
+            return zipfile.ZIP_STORED, None
+        if self.codec == "zstd":
+            return ZIP_ZSTANDARD, self.level or LEVEL_PRESETS["zstd"]["default"]
+        if self.level is None:
+            return zipfile.ZIP_DEFLATED, self.level_by_ext.get(ext, DEFAULT_LEVEL)
+        return zipfile.ZIP_DEFLATED, self.level
+
+    def add_file(self, path, arcname):
+        self._add(path, arcname, os.stat(path))
+
+    def add_tree(self, src, name, tree_filter=None, live=None):
+        # Нечитаемый каталог пропускается, как нечитаемый файл: остальное дерево пишется в архив
+        for path, key, st in iter_tree(src, name, tree_filter, live,
+                                       on_error=lambda folder, key, e: self.failed.append((key + "/", e))):
+            self._add(path, key, st)
+
+    def _add(self, path, arcname, st):
+        # Источник открывается до постановки в очередь: пропавший или заблокированный файл
+        # пропускается, не оставляя в очереди члена без данных
+        try:
+            f = open(path, "rb")
+        except OSError as e:
+            self.failed.append((arcname, e))
+            return
+        method, level = self.compression_for(arcname)
+        member = _Member(arcname, st.st_mtime_ns, method, st.st_size > _ZIP64_THRESHOLD)
+        self._queue.append(member)
+        if st.st_size <= BLOCK_SIZE:
+            member.blocks.append(self._pool.submit(_read_and_compress, f, method, level, self.algo))
+            member.complete = True
+            self._outstanding += 1
+        else:
+            hasher = new_hash(self.algo)
+            with f:
+                while True:
+                    try:
+                        with metrics.phase("read", self.metrics):
+                            data = f.read(BLOCK_SIZE)
+                    except OSError as e:
+                        member.error = e
+                        member.complete = True
+                        break
+                    last = len(data) < BLOCK_SIZE
+                    member.crc = zlib.crc32(data, member.crc)
+                    hasher.update(data)
+                    if last:
+                        member.digest = hasher.hexdigest()
+                    member.blocks.append(self._pool.submit(_compress_block, data, method, level, last))
+                    self._outstanding += 1
+                    if last:
+                        member.complete = True
+                    else:
+                        self._drain(self.max_pending)
+                    if last:
+                        break
+        self._drain(self.max_pending)
+
+    def flush(self):
+        # Дописать все поставленные члены: после этого их исходные файлы можно удалять
+        self._drain(0)
+
+    def _drain(self, limit):
+        while self._queue and self._outstanding > limit:
+            member = self._queue[0]
+            while member.blocks and self._outstanding > limit:
+                future = member.blocks.popleft()
+                self._outstanding -= 1
+                try:
+                    crc, size, data, digest, read_s, compress_s = future.result()
+                except OSError as e:
+                    # Малый файл читается в пуле целиком: заголовок ещё не записан, член просто выпадает
+                    member.error = e
+                    continue
+                if not member.header_written:
+                    self._write_header(member)
+                if crc is not None:
+                    member.crc = crc
+                    member.digest = digest
+                if self.metrics is not None:
+                    self.metrics.add_phase("read", read_s)
+                    self.metrics.add_phase("compress", compress_s)
+                member.size += size
+                if member.cipher is not None:
+                    with metrics.phase("encrypt", self.metrics):
+                        data = member.cipher.update(data)
+                with metrics.phase("write", self.metrics):
+                    self._out.write(data)
+                member.compressed += len(data)
+                progress.advance(size, progress=self.progress)
+            if member.blocks or not member.complete:
+                return
+            if member.error is not None:
+                self._drop(member)
+            else:
+                self._write_descriptor(member)
+            self._queue.popleft()
+
+    def _write_header(self, member):
+        member.offset = self._out.tell()
+        member.header_written = True
+        t, d = _dos_time(member.mtime)
+        extra = struct.pack("<HHQQ", 1, 16, 0, 0) if member.zip64 else b""
+        if self.key is not None and member.arcname not in (KEY_NAME, INDEX_NAME):
+            member.encrypted = True
+            extra += encrypted_extra(member.method)
+            nonce, member.cipher = self.key.encryptor(member.name)
+        size_field = ZIP64_LIMIT if member.zip64 else 0
+        self._out.write(struct.pack("<IHHHHHIIIHH", 0x04034b50, self._version(member), member.flags,
+                                    self._zip_method(member), t, d, 0, size_field, size_field,
+                                    len(member.name), len(extra)))
+        self._out.write(member.name)
+        self._out.write(extra)
+        if member.cipher is not None:
+            self._out.write(nonce)
+            member.compressed += len(nonce)
+
+    def _write_descriptor(self, member):
+        if member.cipher is not None:
+            with metrics.phase("encrypt", self.metrics):
+                tail = member.cipher.finalize() + member.cipher.tag
+            self._out.write(tail)
+            member.compressed += len(tail)
+            # CRC открытых данных в дескрипторе, каталоге и индексе выдавал бы содержимое (см. ZIP_ENCRYPTED)
+            member.crc = 0
+        if member.zip64:
+            self._out.write(struct.pack("<IIQQ", 0x08074b50, member.crc, member.compressed, member.size))
+        else:
+            if member.compressed > ZIP64_LIMIT or member.size > ZIP64_LIMIT:
+                raise OSError(f"Файл вырос больше 4 ГБ во время чтения: {member.name.decode('utf-8')}")
+            self._out.write(struct.pack("<IIII", 0x08074b50, member.crc, member.compressed, member.size))
+        self._central.append(member)
+        self.count += 1
+        self.bytes_in += member.size
+        metrics.record_file(member.arcname, member.size, time.perf_counter() - member.started, self.metrics)
+        progress.advance(0, 1, self.progress)
+        if self.manifest is not None:
+            # Хеш открытого содержимого рядом с зашифрованным архивом выдавал бы его — не пишем
+            self.manifest.add(member.arcname, member.size, member.mtime_ns, None if self.key else member.digest)
+
+    def _drop(self, member):
+        # Крупный файл перестал читаться на середине: записанные блоки остаются в архиве мёртвыми
+        # байтами (поток не перемотать), но член не попадает ни в каталог, ни в индекс, ни в манифест
+        if member.header_written:
+            if member.cipher is not None:
+                self._out.write(member.cipher.finalize() + member.cipher.tag)
+            self._out.write(struct.pack("<IIQQ" if member.zip64 else "<IIII", 0x08074b50, 0, 0, 0))
+        self.failed.append((member.arcname, member.error))
+
+    @staticmethod
+    def _zip_method(member):
+        return ZIP_ENCRYPTED if member.encrypted else member.method
+
+    @staticmethod
+    def _version(member):
+        if member.method == ZIP_ZSTANDARD:
+            return 63
+        return 45 if member.zip64 else 20
+
+    def _write_stored(self, name, data):
+        # Служебный член без сжатия и шифрования → смещение его данных
+        member = _Member(name, time.time_ns(), zipfile.ZIP_STORED, False)
+        self._write_header(member)
+        offset = self._out.tell()
+        self._out.write(data)
+        member.crc = zlib.crc32(data)
+        member.size = member.compressed = len(data)
+        self._out.write(struct.pack("<IIII", 0x08074b50, member.crc, member.compressed, member.size))
+        self._central.append(member)
+        return offset
+
+    def _write_index(self):
+        data = pack_index(Entry(m.arcname, m.offset, m.compressed, m.size, m.mtime_ns, m.crc, m.method)
+                          for m in self._central)
+        self._index_at = (self._write_stored(INDEX_NAME, data), len(data))
+
+    def _write_central(self):
+        start = self._out.tell()
+        for m in self._central:
+            extra_vals = []
+            size = m.size
+            compressed = m.compressed
+            offset = m.offset
+            if m.zip64 or size >= ZIP64_LIMIT or compressed >= ZIP64_LIMIT:
+                extra_vals += [size, compressed]
+                size = compressed = ZIP64_LIMIT
+            if offset >= ZIP64_LIMIT:
+                extra_vals.append(offset)
+                offset = ZIP64_LIMIT
+            extra = struct.pack(f"<HH{len(extra_vals)}Q", 1, 8 * len(extra_vals), *extra_vals) if extra_vals else b""
+            t, d = _dos_time(m.mtime)
+            version = max(self._version(m), 45 if extra else 20)
+            if m.encrypted:
+                extra += encrypted_extra(m.method)
+            self._out.write(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, version, version, m.flags,
+                                        self._zip_method(m), t, d, m.crc, compressed, size, len(m.name),
+                                        len(extra), 0, 0, 0, 0, offset))
+            self._out.write(m.name)
+            self._out.write(extra)
+        end = self._out.tell()
+        count, cd_size = len(self._central), end - start
+        comment = index_comment(*self._index_at) if self._index_at else b""
+        if count >= 0xFFFF or start >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+            self._out.write(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, start))
+            self._out.write(struct.pack("<IIQI", 0x07064b50, 0, end, 1))
+            self._out.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, 0xFFFF, 0xFFFF,
+                                        ZIP64_LIMIT, ZIP64_LIMIT, len(comment)))
+        else:
+            self._out.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, cd_size, start, len(comment)))
+        self._out.write(comment)
+
+    def close(self):
+        try:
+            self._drain(0)
+            if self.index and self.count:
+                self._write_index()
+            self._write_central()
+        except BaseException:
+            self._out.abort()
+            raise
+        if self.count:
+            self._out.commit()
+        else:
+            self._out.abort()
+
+    def abort(self):
+        for member in self._queue:
+            for future in member.blocks:
+                future.cancel()
+        self._queue.clear()
+        self._out.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                self.close()
+            except BaseException:
+                # Ошибка или отмена при дозаписи — недописанный .part не остаётся
+                self.abort()
+                raise
+        else:
+            self.abort()
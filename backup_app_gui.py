@@ -1,62 +1,152 @@
-import sys, os, subprocess
+import sys, os, subprocess, time
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QTabWidget, QVBoxLayout,
     QLabel, QPushButton, QListWidget, QCheckBox, QProgressBar,
     QTextEdit, QMessageBox, QFileDialog, QInputDialog, QHBoxLayout,
-    QDialog, QListWidgetItem, QDialogButtonBox
+    QDialog, QListWidgetItem, QDialogButtonBox, QComboBox, QTableWidget, QTableWidgetItem,
+    QTreeWidget, QTreeWidgetItem, QLineEdit
 )
-from PyQt6.QtCore import QThread, pyqtSignal
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
 
 from app_definitions import load_plugins, load_custom_rules
-from detect_installed_apps import get_installed_display_names
+from detect_installed_apps import get_installed_index
 from backup_engine import *
-from scan_user_configs import scan_user_configs
+from chunk_store import ChunkStore
+from scheduler import IOLimiter, run_jobs
+from installed_apps import InstalledAppIndex
+from restore_engine import restore_app, browse_app, needs_secret
+from encryption import load_secret, AVAILABLE as ENCRYPTION
+from storage_targets import open_target
+from scan_user_configs import DiscoveryIndex
+from snapshot_diff import diff_app, LIVE
+from metrics import RunReport, PHASES
+from progress import Progress, CancelToken, Cancelled, format_progress
+
+def emit_report(worker, report):
+    try:
+        report.save()
+    except OSError as e:
+        worker.log_text.emit(f"[ERROR] Отчёт: {e}")
+    worker.report.emit(report.as_dict())
 
 class BackupWorker(QThread):
     progress = pyqtSignal(int)
+    status = pyqtSignal(str)
     log_text = pyqtSignal(str)
+    report = pyqtSignal(dict)
     finished = pyqtSignal()
 
-    def __init__(self, selected_apps, plugins, zip_enabled):
+    def __init__(self, selected_apps, plugins, zip_enabled, dedup=False, zip_level=None, secret=None, target=None):
         super().__init__()
         self.apps = selected_apps
         self.plugins = plugins
         self.zip = zip_enabled
+        self.zip_options = {"level": zip_level, "secret": secret}
+        self.target = target
+        self.store = ChunkStore() if dedup else None
+        self.token = CancelToken()
+
+    def cancel(self):
+        self.token.cancel()
+
+    def on_progress(self, tracker):
+        # Вызывается из потоков заданий не чаще раза в progress.INTERVAL
+        self.progress.emit(tracker.percent())
+        self.status.emit(format_progress(tracker))
+
+    def run(self):
+        limiter = IOLimiter()
+        report = RunReport("backup")
+        tracker = Progress(self.on_progress, self.token)
+
+        self.status.emit("Подсчёт объёма данных…")
+        try:
+            prescan(tracker, [self.plugins.get(app, {}) for app in self.apps])
+        except Cancelled:
+            pass
+
+        def job(app):
+            return tracker.call(report.call, app, backup_app, app, self.plugins.get(app, {}), self.zip, self.store,
+                                True, limiter.slot, self.zip_options, self.target)
+
+        def done(i, app, any_data, lines):
+            for line in lines:
+                self.log_text.emit(line)
+
+        run_jobs(self.apps, job, on_done=done, cancel=self.token)
+        if self.token.cancelled:
+            self.status.emit("Отменено")
+        else:
+            self.progress.emit(100)
+            self.status.emit(format_progress(tracker))
+        emit_report(self, report)
+        self.finished.emit()
+
+class RestoreWorker(QThread):
+    progress = pyqtSignal(int)
+    log_text = pyqtSignal(str)
+    report = pyqtSignal(dict)
+    finished = pyqtSignal()
+
+    def __init__(self, selected_apps, plugins, dedup=False, target_dir=None, paths=None, secret=None):
+        super().__init__()
+        self.apps = selected_apps
+        self.plugins = plugins
+        self.store = ChunkStore() if dedup else None
+        self.target_dir = target_dir
+        self.paths = paths
+        self.secret = secret
 
     def run(self):
         total = len(self.apps)
-        for i, app in enumerate(self.apps):
-            paths = self.plugins.get(app, {})
-            out = os.path.join("Backup", app)
-            os.makedirs(out, exist_ok=True)
-
-            any_data = False
-            for f in paths.get("files", []):
-                if path_exists(f):
-                    backup_file(f, out)
-                    self.log_text.emit(f"[BACKUP] Файл: {f}")
-                    any_data = True
-            for d in paths.get("folders", []):
-                if path_exists(d):
-                    backup_folder(d, out)
-                    self.log_text.emit(f"[BACKUP] Папка: {d}")
-                    any_data = True
-            for r in paths.get("registry", []):
-                if registry_key_exists(r):
-                    reg_path = os.path.join(out, f"{app}_reg.reg")
-                    backup_registry_key(r, reg_path)
-                    self.log_text.emit(f"[BACKUP] Реестр: {r}")
-                    any_data = True
-
-            if not any_data:
-                self.log_text.emit(f"[INFO] Нет данных для: {app}")
-            if self.zip and any_data:
-                compress_folder(out, os.path.join("Backup", f"{app}_backup"))
-                self.log_text.emit(f"[ZIP] Архив создан: {app}")
 
+        report = RunReport("restore")
+
+        def job(app):
+            return report.call(app, restore_app, app, self.plugins.get(app, {}), self.store, self.target_dir,
+                               paths=self.paths, secret=self.secret)
+
+        def done(i, app, ok, lines):
+            for line in lines:
+                self.log_text.emit(line)
             self.progress.emit(int((i + 1) / total * 100))
+
+        # Приложения по одному: внутри каждого файлы и так восстанавливаются параллельно
+        run_jobs(self.apps, job, workers=1, on_done=done)
+        emit_report(self, report)
         self.finished.emit()
 
+class TaskWorker(QThread):
+    result = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+
+    def run(self):
+        try:
+            self.result.emit(self.fn())
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class ConfigScanWorker(QThread):
+    found = pyqtSignal(list)
+    done = pyqtSignal(list)
+
+    def run(self):
+        # Результаты отдаются пачками, не чаще раза в 200 мс, чтобы не заваливать UI сигналами
+        index = DiscoveryIndex()
+        batch, last = [], time.monotonic()
+        for path in index.scan():
+            batch.append(path)
+            if time.monotonic() - last > 0.2:
+                self.found.emit(batch)
+                batch, last = [], time.monotonic()
+        if batch:
+            self.found.emit(batch)
+        self.done.emit(index.new_since_last_scan())
+
 class PluginEditDialog(QWidget):
     def __init__(self, name, data):
         super().__init__()
@@ -107,7 +197,9 @@ class PluginEditDialog(QWidget):
 
     def save(self):
         from json import dump
+        # Остальные ключи плагина (preset, exclude, include, max_file_size) сохраняются как были
         out = {
+            **self.data,
             "files": [self.files.item(i).text() for i in range(self.files.count())],
             "folders": [self.folders.item(i).text() for i in range(self.folders.count())],
             "registry": [self.registry.item(i).text() for i in range(self.registry.count())]
@@ -116,23 +208,178 @@ class PluginEditDialog(QWidget):
             dump({self.name: out}, f, indent=2, ensure_ascii=False)
         QMessageBox.information(self, "OK", "Сохранено")
 
+class DiffDialog(QWidget):
+    def __init__(self, app, data, dedup):
+        super().__init__()
+        self.setWindowTitle(f"Сравнение: {app}")
+        self.app = app
+        self.data = data
+        self.store = ChunkStore() if dedup else None
+        self.worker = None
+        layout = QVBoxLayout()
+
+        # В хранилище — любые два снимка; для обычной копии — только копия против текущих данных
+        snapshots = self.store.list_snapshots(app) if self.store else []
+        self.old = QComboBox()
+        self.new = QComboBox()
+        if self.store:
+            for sid in reversed(snapshots):
+                self.old.addItem(sid, sid)
+                self.new.addItem(sid, sid)
+        else:
+            self.old.addItem("Последняя копия", None)
+        self.new.insertItem(0, "Текущие данные", LIVE)
+        self.new.setCurrentIndex(0)
+        run = QPushButton("🔍 Сравнить")
+        run.clicked.connect(self.run_diff)
+        self.summary = QLabel()
+        self.result = QListWidget()
+
+        row = QHBoxLayout()
+        row.addWidget(QLabel("Было:"))
+        row.addWidget(self.old)
+        row.addWidget(QLabel("Стало:"))
+        row.addWidget(self.new)
+        row.addWidget(run)
+        layout.addLayout(row)
+        layout.addWidget(self.summary)
+        layout.addWidget(self.result)
+        self.setLayout(layout)
+        self.resize(700, 500)
+
+    def run_diff(self):
+        if self.worker is not None and self.worker.isRunning():
+            return
+        old, new = self.old.currentData(), self.new.currentData()
+        self.summary.setText("Сравнение…")
+        self.result.clear()
+        self.worker = TaskWorker(lambda: diff_app(self.app, self.data, self.store, old, new))
+        self.worker.result.connect(self.show_diff)
+        self.worker.failed.connect(lambda e: self.summary.setText(f"Ошибка: {e}"))
+        self.worker.start()
+
+    def show_diff(self, result):
+        self.summary.setText(f"Добавлено {len(result.added)}, удалено {len(result.removed)}, "
+                             f"изменено {len(result.modified)} (по содержимому проверено {result.hashed})")
+        for mark, keys in (("+", result.added), ("−", result.removed), ("~", result.modified)):
+            for key in keys:
+                self.result.addItem(f"{mark} {key}")
+
+class BrowseDialog(QWidget):
+    # Выбор отдельных файлов и папок копии; у архива список берётся из его индекса без распаковки
+    def __init__(self, app, dedup, on_restore):
+        super().__init__()
+        self.setWindowTitle(f"Файлы копии: {app}")
+        self.app = app
+        self.store = ChunkStore() if dedup else None
+        self.on_restore = on_restore
+        layout = QVBoxLayout()
+
+        self.summary = QLabel("Чтение списка файлов…")
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(["Путь", "Размер", "Изменён"])
+        restore = QPushButton("♻ Восстановить выбранное")
+        restore.clicked.connect(self.restore_selected)
+
+        layout.addWidget(self.summary)
+        layout.addWidget(self.tree)
+        layout.addWidget(restore)
+        self.setLayout(layout)
+        self.resize(700, 500)
+
+        self.worker = TaskWorker(lambda: browse_app(app, self.store))
+        self.worker.result.connect(self.fill)
+        self.worker.failed.connect(lambda e: self.summary.setText(f"Ошибка: {e}"))
+        self.worker.start()
+
+    @staticmethod
+    def _checkable(item, key):
+        item.setData(0, Qt.ItemDataRole.UserRole, key)
+        item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable | Qt.ItemFlag.ItemIsAutoTristate)
+        item.setCheckState(0, Qt.CheckState.Unchecked)
+        return item
+
+    def fill(self, items):
+        self.summary.setText(f"Файлов: {len(items)}" if items else "Копия не найдена")
+        folders = {}
+        for key, size, mtime_ns in sorted(items):
+            parent = self.tree.invisibleRootItem()
+            parts = key.split("/")
+            for i in range(1, len(parts)):
+                folder = "/".join(parts[:i])
+                if folder not in folders:
+                    folders[folder] = self._checkable(QTreeWidgetItem(parent, [parts[i - 1]]), folder)
+                parent = folders[folder]
+            self._checkable(QTreeWidgetItem(parent, [parts[-1], f"{size / 1e3:.1f} KB",
+                            time.strftime("%Y-%m-%d %H:%M", time.localtime(mtime_ns / 1e9))]), key)
+
+    def checked(self, root=None):
+        # Полностью отмеченная папка передаётся одним путём
+        root = self.tree.invisibleRootItem() if root is None else root
+        paths = []
+        for i in range(root.childCount()):
+            child = root.child(i)
+            state = child.checkState(0)
+            if state == Qt.CheckState.Checked:
+                paths.append(child.data(0, Qt.ItemDataRole.UserRole))
+            elif state == Qt.CheckState.PartiallyChecked:
+                paths += self.checked(child)
+        return paths
+
+    def restore_selected(self):
+        paths = self.checked()
+        if not paths:
+            QMessageBox.warning(self, "Нет выбора", "Отметьте файлы для восстановления")
+            return
+        self.on_restore([self.app], paths)
+        self.close()
+
 class BackupApp(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("BackupApp")
         self.plugins = {}
+        self.installed = None
+        self.workers = []
+        self.configs_scanned = False
         self.tabs = QTabWidget()
         self.setCentralWidget(self.tabs)
 
-        self.load_definitions()
+        # Окно показывается сразу; плагины, список установленных программ
+        # и конфиги загружаются в фоне и заполняют списки по мере готовности
         self.init_main_tab()
         self.init_logs_tab()
         self.init_plugin_tab()
-        self.refresh_app_list()
+        self.tabs.currentChanged.connect(self.on_tab_changed)
+        self.start_task(self.read_definitions, self.on_definitions_loaded)
+        self.refresh_app_list(redetect=True)
+
+    def start_task(self, fn, on_result, on_failed=None):
+        worker = TaskWorker(fn)
+        worker.result.connect(on_result)
+        worker.failed.connect(lambda e: self.append_log(f"[ERROR] {e}"))
+        if on_failed:
+            worker.failed.connect(on_failed)
+        worker.finished.connect(lambda: self.workers.remove(worker))
+        self.workers.append(worker)
+        worker.start()
+        return worker
+
+    @staticmethod
+    def read_definitions():
+        plugins = load_plugins()
+        plugins.update(load_custom_rules())
+        return plugins
 
     def load_definitions(self):
-        self.plugins = load_plugins()
-        self.plugins.update(load_custom_rules())
+        self.on_definitions_loaded(self.read_definitions())
+
+    def on_definitions_loaded(self, plugins):
+        self.plugins = plugins
+        self.plugin_list.clear()
+        self.plugin_list.addItems(sorted(self.plugins.keys()))
+        if self.installed is not None:
+            self.refresh_app_list()
 
     def init_main_tab(self):
         tab = QWidget()
@@ -140,6 +387,21 @@ class BackupApp(QMainWindow):
 
         self.app_list = QListWidget()
         self.zip_cb = QCheckBox("Сжать в ZIP")
+        self.zip_level = QComboBox()
+        for label, level in (("Сжатие: по типу файла", None), ("Быстрое", "fast"), ("Обычное", "default"),
+                             ("Максимальное", "max"), ("Без сжатия", "store")):
+            self.zip_level.addItem(label, level)
+        self.zip_level.setEnabled(False)
+        self.zip_cb.toggled.connect(self.zip_level.setEnabled)
+        self.encrypt_cb = QCheckBox("🔐 Шифровать архив")
+        self.encrypt_cb.setEnabled(False)
+        self.encrypt_cb.setToolTip("AES-256-GCM, нужен пакет cryptography" if ENCRYPTION else "Нужен пакет cryptography")
+        self.zip_cb.toggled.connect(lambda v: self.encrypt_cb.setEnabled(v and ENCRYPTION))
+        self.target_edit = QLineEdit()
+        self.target_edit.setPlaceholderText("Куда писать архив: Backup/, каталог, http://nas:8765/backups, sftp://user@nas/backups")
+        self.target_edit.setEnabled(False)
+        self.zip_cb.toggled.connect(self.target_edit.setEnabled)
+        self.dedup_cb = QCheckBox("Дедупликация (хранилище чанков)")
         self.restore_cb = QCheckBox("Режим восстановления")
         self.restore_original = QCheckBox("Восстановить в оригинальные места")
         self.restore_original.setChecked(True)
@@ -149,18 +411,37 @@ class BackupApp(QMainWindow):
         self.restore_original.toggled.connect(lambda v: self.choose_dir_btn.setEnabled(not v))
 
         self.restore_target_dir = None
+        self.redetect_btn = QPushButton("🔄 Обновить список установленных")
+        self.redetect_btn.clicked.connect(lambda: self.refresh_app_list(redetect=True))
         self.run_btn = QPushButton("▶ Выполнить")
         self.run_btn.clicked.connect(self.run_task)
+        self.diff_btn = QPushButton("🔍 Сравнить с копией")
+        self.diff_btn.clicked.connect(self.show_diff)
+        self.browse_btn = QPushButton("📂 Восстановить отдельные файлы…")
+        self.browse_btn.clicked.connect(self.show_browse)
         self.progress = QProgressBar()
+        self.progress_label = QLabel("")
+        self.cancel_btn = QPushButton("⏹ Отменить")
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_task)
 
         layout.addWidget(QLabel("Приложения:"))
         layout.addWidget(self.app_list)
+        layout.addWidget(self.redetect_btn)
         layout.addWidget(self.zip_cb)
+        layout.addWidget(self.zip_level)
+        layout.addWidget(self.encrypt_cb)
+        layout.addWidget(self.target_edit)
+        layout.addWidget(self.dedup_cb)
         layout.addWidget(self.restore_cb)
         layout.addWidget(self.restore_original)
         layout.addWidget(self.choose_dir_btn)
         layout.addWidget(self.run_btn)
+        layout.addWidget(self.diff_btn)
+        layout.addWidget(self.browse_btn)
         layout.addWidget(self.progress)
+        layout.addWidget(self.progress_label)
+        layout.addWidget(self.cancel_btn)
 
         tab.setLayout(layout)
         self.tabs.addTab(tab, "Главная")
@@ -170,6 +451,17 @@ class BackupApp(QMainWindow):
         self.logs = QTextEdit()
         self.logs.setReadOnly(True)
         layout.addWidget(self.logs)
+
+        # Метрики последнего запуска: по строке на приложение и самые медленные файлы
+        self.stats_table = QTableWidget(0, 5 + len(PHASES))
+        self.stats_table.setHorizontalHeaderLabels(["Приложение", "Файлов", "MB", "Время, s", "MB/s"]
+                                                   + [f"{p}, s" for p in PHASES])
+        self.stats_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.slowest_list = QListWidget()
+        layout.addWidget(QLabel("Статистика последнего запуска:"))
+        layout.addWidget(self.stats_table)
+        layout.addWidget(QLabel("Самые медленные файлы:"))
+        layout.addWidget(self.slowest_list)
         tab.setLayout(layout)
         self.tabs.addTab(tab, "Логи")
 
@@ -178,7 +470,6 @@ class BackupApp(QMainWindow):
         layout = QVBoxLayout()
 
         self.found_configs = QListWidget()
-        self.found_configs.addItems(scan_user_configs())
         self.found_configs.setSelectionMode(QListWidget.SelectionMode.MultiSelection)
 
         self.app_name = QTextEdit()
@@ -188,7 +479,6 @@ class BackupApp(QMainWindow):
         btn_add.clicked.connect(self.save_plugin)
 
         self.plugin_list = QListWidget()
-        self.plugin_list.addItems(sorted(self.plugins.keys()))
 
         btn_edit = QPushButton("Редактировать выбранный")
         btn_edit.clicked.connect(self.edit_plugin)
@@ -199,8 +489,12 @@ class BackupApp(QMainWindow):
         btn_check_all = QPushButton("🧪 Проверить все плагины")
         btn_check_all.clicked.connect(self.check_all_plugins)
 
-        layout.addWidget(QLabel("Найденные конфиги:"))
+        btn_rescan = QPushButton("🔍 Пересканировать")
+        btn_rescan.clicked.connect(self.fill_found_configs)
+
+        layout.addWidget(QLabel("Найденные конфиги (новые с прошлого сканирования выделены):"))
         layout.addWidget(self.found_configs)
+        layout.addWidget(btn_rescan)
         layout.addWidget(self.app_name)
         layout.addWidget(btn_add)
         layout.addWidget(QLabel("Существующие плагины:"))
@@ -210,7 +504,37 @@ class BackupApp(QMainWindow):
         layout.addWidget(btn_check_all)
 
         tab.setLayout(layout)
+        self.plugin_tab = tab
         self.tabs.addTab(tab, "Плагины")
+
+    def on_tab_changed(self, i):
+        # Сканирование конфигов нужно только во вкладке плагинов — запускаем при первом открытии
+        if self.tabs.widget(i) is self.plugin_tab and not self.configs_scanned:
+            self.fill_found_configs()
+    def fill_found_configs(self):
+        if any(isinstance(w, ConfigScanWorker) for w in self.workers):
+            return
+        self.configs_scanned = True
+        self.found_configs.clear()
+        worker = ConfigScanWorker()
+        worker.found.connect(self.found_configs.addItems)
+        worker.done.connect(self.mark_new_configs)
+        worker.finished.connect(lambda: self.workers.remove(worker))
+        self.workers.append(worker)
+        worker.start()
+
+    def mark_new_configs(self, new):
+        new = set(new)
+        for i in range(self.found_configs.count()):
+            item = self.found_configs.item(i)
+            if item.text() in new:
+                font = item.font()
+                font.setBold(True)
+                item.setFont(font)
+                item.setToolTip("Новый с прошлого сканирования")
+        if new:
+            self.append_log(f"[GUI] Новых конфигов с прошлого сканирования: {len(new)}")
+
     def save_plugin(self):
         from json import dump
         selected = self.found_configs.selectedItems()
@@ -346,17 +670,42 @@ class BackupApp(QMainWindow):
         layout.addWidget(result)
         dlg.setLayout(layout)
         dlg.exec()
-    def refresh_app_list(self):
+    def refresh_app_list(self, redetect=False):
+        # Список установленных программ кэшируется; реестр перечитывается только по кнопке
+        if redetect or self.installed is None:
+            self.redetect_btn.setEnabled(False)
+            self.start_task(get_installed_index, self.on_installed_detected,
+                            lambda e: self.on_installed_detected(None))
+            return
         self.app_list.clear()
-        installed = get_installed_display_names()
+        installed = self.installed.match(self.plugins) if self.installed else set()
         visible = [name for name in self.plugins if name in installed or name.startswith("My")]
         self.app_list.addItems(visible)
         self.progress.setValue(0)
         self.append_log(f"[GUI] Обновлён список приложений ({len(visible)})")
 
+    def on_installed_detected(self, index):
+        self.installed = index or InstalledAppIndex()
+        self.redetect_btn.setEnabled(True)
+        self.refresh_app_list()
+
     def append_log(self, msg):
         self.logs.append(msg)
 
+    def show_stats(self, report):
+        ops = report["ops"]
+        self.stats_table.setRowCount(len(ops))
+        slowest = []
+        for row, op in enumerate(ops):
+            values = [op["name"], op["files"], f"{op['bytes'] / 1e6:.1f}", f"{op['wall_s']:.2f}",
+                      f"{op['throughput_mb_s']:.1f}"] + [f"{op['phases_s'].get(p, 0):.2f}" for p in PHASES]
+            for col, value in enumerate(values):
+                self.stats_table.setItem(row, col, QTableWidgetItem(str(value)))
+            slowest += [(item["seconds"], op["name"], item) for item in op["slowest"]]
+        self.slowest_list.clear()
+        for seconds, app, item in sorted(slowest, key=lambda x: x[0], reverse=True)[:10]:
+            self.slowest_list.addItem(f"{seconds:.2f} s — {app}: {item['path']} ({item['size'] / 1e6:.1f} MB)")
+
     def run_task(self):
         selected = [i.text() for i in self.app_list.selectedItems()]
         if not selected:
@@ -368,43 +717,98 @@ class BackupApp(QMainWindow):
         else:
             self.run_backup(selected)
 
+    def ask_secret(self, confirm=False):
+        # Пароль архива → bytes; None — пользователь отказался
+        text, ok = QInputDialog.getText(self, "Пароль", "Пароль архива:", QLineEdit.EchoMode.Password)
+        if not ok or not text:
+            return None
+        if confirm:
+            again, ok = QInputDialog.getText(self, "Пароль", "Повторите пароль:", QLineEdit.EchoMode.Password)
+            if not ok:
+                return None
+            if again != text:
+                QMessageBox.warning(self, "Пароль", "Пароли не совпадают")
+                return None
+        return load_secret(text)
+
     def run_backup(self, selected):
+        target = None
+        if self.zip_cb.isChecked() and not self.dedup_cb.isChecked() and self.target_edit.text().strip():
+            try:
+                target = open_target(self.target_edit.text().strip())
+            except RuntimeError as e:
+                QMessageBox.warning(self, "Хранилище", str(e))
+                return
+        secret = None
+        if self.encrypt_cb.isChecked() and self.zip_cb.isChecked() and not self.dedup_cb.isChecked():
+            secret = self.ask_secret(confirm=True)
+            if secret is None:
+                return
         self.run_btn.setEnabled(False)
         self.logs.clear()
         self.progress.setValue(0)
 
-        self.worker = BackupWorker(selected, self.plugins, self.zip_cb.isChecked())
+        self.worker = BackupWorker(selected, self.plugins, self.zip_cb.isChecked(), self.dedup_cb.isChecked(),
+                                   self.zip_level.currentData(), secret, target)
         self.worker.progress.connect(self.progress.setValue)
+        self.worker.status.connect(self.progress_label.setText)
         self.worker.log_text.connect(self.append_log)
+        self.worker.report.connect(self.show_stats)
         self.worker.finished.connect(self.on_worker_done)
+        self.cancel_btn.setEnabled(True)
         self.worker.start()
 
-    def run_restore(self, selected):
-        for app in selected:
-            paths = self.plugins.get(app, {})
-            out = os.path.join("Backup", app)
-
-            for f in paths.get("files", []):
-                src = os.path.join(out, os.path.basename(f))
-                if os.path.exists(src):
-                    dst = expand(f) if self.restore_original.isChecked() else os.path.join(self.restore_target_dir, os.path.basename(f))
-                    restore_file(src, dst)
-
-            for d in paths.get("folders", []):
-                src = os.path.join(out, os.path.basename(d))
-                if os.path.exists(src):
-                    dst = expand(d) if self.restore_original.isChecked() else os.path.join(self.restore_target_dir, os.path.basename(d))
-                    restore_folder(src, dst)
-
-            for r in paths.get("registry", []):
-                if self.restore_original.isChecked():
-                    reg_file = os.path.join(out, f"{app}_reg.reg")
-                    if os.path.exists(reg_file):
-                        restore_registry_key(reg_file)
+    def cancel_task(self):
+        # Задания останавливаются в ближайшей точке проверки, недописанный архив удаляется
+        self.cancel_btn.setEnabled(False)
+        self.progress_label.setText("Отмена…")
+        self.worker.cancel()
+
+    def run_restore(self, selected, paths=None):
+        if not self.run_btn.isEnabled():
+            QMessageBox.warning(self, "Занято", "Дождитесь завершения текущей операции")
+            return
+        if not self.restore_original.isChecked() and not self.restore_target_dir:
+            QMessageBox.warning(self, "Нет каталога", "Выберите каталог восстановления")
+            return
+        secret = None
+        if not self.dedup_cb.isChecked() and any(needs_secret(app) for app in selected):
+            secret = self.ask_secret()
+            if secret is None:
+                return
+        self.run_btn.setEnabled(False)
+        self.logs.clear()
+        self.progress.setValue(0)
 
+        target = None if self.restore_original.isChecked() else self.restore_target_dir
+        self.worker = RestoreWorker(selected, self.plugins, self.dedup_cb.isChecked(), target, paths, secret)
+        self.worker.progress.connect(self.progress.setValue)
+        self.worker.log_text.connect(self.append_log)
+        self.worker.report.connect(self.show_stats)
+        self.worker.finished.connect(self.on_restore_done)
+        self.worker.start()
+
+    def on_restore_done(self):
+        self.run_btn.setEnabled(True)
         self.append_log("✅ Восстановление завершено.")
         self.refresh_app_list()
 
+    def show_diff(self):
+        selected = [i.text() for i in self.app_list.selectedItems()]
+        if len(selected) != 1:
+            QMessageBox.warning(self, "Нет выбора", "Выберите одно приложение")
+            return
+        self.diff_dialog = DiffDialog(selected[0], self.plugins[selected[0]], self.dedup_cb.isChecked())
+        self.diff_dialog.show()
+
+    def show_browse(self):
+        selected = [i.text() for i in self.app_list.selectedItems()]
+        if len(selected) != 1:
+            QMessageBox.warning(self, "Нет выбора", "Выберите одно приложение")
+            return
+        self.browse_dialog = BrowseDialog(selected[0], self.dedup_cb.isChecked(), self.run_restore)
+        self.browse_dialog.show()
+
     def pick_restore_dir(self):
         dir = QFileDialog.getExistingDirectory(self, "Выбор папки")
         if dir:
@@ -413,7 +817,11 @@ class BackupApp(QMainWindow):
 
     def on_worker_done(self):
         self.run_btn.setEnabled(True)
-        self.append_log("✅ Резервное копирование завершено.")
+        self.cancel_btn.setEnabled(False)
+        if self.worker.token.cancelled:
+            self.append_log("⏹ Резервное копирование отменено.")
+        else:
+            self.append_log("✅ Резервное копирование завершено.")
         self.refresh_app_list()
 
 if __name__ == "__main__":
@@ -1,64 +1,254 @@
-import argparse, os
+import argparse, os, sys, time, signal, getpass, shutil, atexit, tempfile
 from backup_engine import *
 from app_definitions import *
-from detect_installed_apps import get_installed_display_names
+from chunk_store import ChunkStore
+from retention import has_policy
+from metrics import RunReport, format_op
+from progress import Progress, CancelToken, Cancelled, format_progress
+from scheduler import IOLimiter, run_jobs, DEFAULT_WORKERS
+from archive_writer import CODECS
+from restore_engine import restore_app, browse_app, needs_secret, fetch_archive
+from storage_targets import open_target
+from daemon import BackupDaemon, SWEEP
+from archive_index import is_encrypted
+from encryption import load_secret, PassphraseError, AVAILABLE as ENCRYPTION
+from verify_backup import verify_app
+from snapshot_diff import diff_app, format_diff, LIVE
+from detect_installed_apps import get_installed_index
+
+def prune_app(store, app, policy):
+    try:
+        keep, drop, freed = store.prune(app, **policy)
+        log(f"[PRUNE] {app}: оставлено {len(keep)}, удалено снимков {len(drop)}, освобождено чанков {freed}")
+    except Exception as e:
+        log(f"[ERROR] Prune: {app} — {e}")
+
+def save_report(report, show):
+    if not report.ops:
+        return
+    try:
+        path = report.save()
+    except OSError as e:
+        log(f"[ERROR] Отчёт: {e}")
+        return
+    if show:
+        for op in report.ops:
+            for line in format_op(op):
+                log(line)
+        log(f"[STATS] Отчёт: {path}")
+
+def handle_interrupt(token):
+    # Первый Ctrl+C — мягкая отмена: задания останавливаются, недописанные архивы удаляются; второй — выход сразу
+    def handler(signum, frame):
+        if token.cancelled:
+            raise KeyboardInterrupt
+        token.cancel()
+        log("[CANCEL] Остановка… Повторный Ctrl+C — прервать немедленно")
+    signal.signal(signal.SIGINT, handler)
+
+def print_progress(tracker):
+    # Курсор возвращается в начало строки, чтобы очередная строка лога легла поверх прогресса
+    sys.stderr.write("\r" + format_progress(tracker) + "\033[K\r")
+    sys.stderr.flush()
+
+def read_secret(args, confirm=False):
+    # Ключевой файл, переменная окружения BACKUPAPP_PASSPHRASE или запрос пароля
+    if args.keyfile or os.environ.get("BACKUPAPP_PASSPHRASE"):
+        return load_secret(os.environ.get("BACKUPAPP_PASSPHRASE"), args.keyfile)
+    passphrase = getpass.getpass("Пароль архива: ")
+    if confirm and getpass.getpass("Повторите пароль: ") != passphrase:
+        raise PassphraseError("пароли не совпадают")
+    return load_secret(passphrase)
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--mode", choices=["backup", "restore"], required=True)
+    parser.add_argument("--mode", choices=["backup", "restore", "verify", "history", "prune", "diff", "browse", "upload", "daemon"], required=True)
     parser.add_argument("--apps", required=True)
     parser.add_argument("--zip", action="store_true")
+    parser.add_argument("--level", help="уровень сжатия: 0–9 (zstd: 1–19) или store/fast/default/max")
+    parser.add_argument("--codec", choices=CODECS, default="deflate")
+    parser.add_argument("--dedup", action="store_true", help="хранилище чанков с дедупликацией вместо копии папок")
+    parser.add_argument("--encrypt", action="store_true", help="шифровать архив (AES-256-GCM, нужен --zip и пакет cryptography)")
+    parser.add_argument("--keyfile", help="ключевой файл вместо пароля для зашифрованного архива")
+    parser.add_argument("--target", help="куда писать архивы: каталог, http://хост:порт/префикс или sftp://пользователь@хост/путь "
+                                         "(restore/verify скачивают архив оттуда, upload отправляет готовые из Backup/)")
+    parser.add_argument("--full", action="store_true", help="полная копия без учёта индекса прошлого запуска")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="сколько приложений обрабатывать параллельно")
+    parser.add_argument("--stats", action="store_true", help="вывести метрики по приложениям (отчёт JSON пишется в Logs/ всегда)")
+    parser.add_argument("--progress", action="store_true", help="показывать прогресс копирования в байтах и оставшееся время")
+    parser.add_argument("--sweep", type=int, default=SWEEP, help="daemon: период обхода в секундах, где нет inotify")
+    parser.add_argument("--snapshot", help="идентификатор снимка для восстановления (по умолчанию последний)")
+    parser.add_argument("--paths", help="restore/browse: только эти файлы и папки копии через запятую, например \"User/settings.json\"")
+    parser.add_argument("--from", dest="diff_from", help="diff: старый снимок (по умолчанию последний)")
+    parser.add_argument("--to", dest="diff_to", default=LIVE, help=f"diff: новый снимок или {LIVE} — текущие данные")
+    parser.add_argument("--keep-last", type=int, default=0, help="сколько последних снимков хранить")
+    parser.add_argument("--keep-daily", type=int, default=0, help="по одному снимку за N последних дней")
+    parser.add_argument("--keep-weekly", type=int, default=0, help="по одному снимку за N последних недель")
+    parser.add_argument("--keep-monthly", type=int, default=0, help="по одному снимку за N последних месяцев")
     args = parser.parse_args()
+    if args.encrypt and (not args.zip or args.dedup):
+        parser.error("--encrypt работает только с --zip без --dedup")
+    if args.encrypt and not ENCRYPTION:
+        parser.error("для --encrypt нужен пакет cryptography")
+    if args.target and args.mode in ("backup", "daemon") and (not args.zip or args.dedup):
+        parser.error("--target принимает только архивы: нужен --zip без --dedup")
+    try:
+        target = open_target(args.target)
+    except RuntimeError as e:
+        parser.error(str(e))
+    policy = {"keep_last": args.keep_last, "keep_daily": args.keep_daily,
+              "keep_weekly": args.keep_weekly, "keep_monthly": args.keep_monthly}
 
     defs = load_plugins()
     defs.update(load_custom_rules())
-    installed = get_installed_display_names()
+    installed = get_installed_index().match(defs)
     apps = args.apps.split(",")
+    # История снимков есть только в хранилище чанков
+    store = ChunkStore() if args.dedup or args.mode in ("history", "prune") else None
+    jobs = []
 
     for app in apps:
         app = app.strip()
         if app not in defs:
             log(f"[SKIP] Неизвестное приложение: {app}")
             continue
-        if app not in installed and not app.startswith("My"):
+        if args.mode in ("backup", "restore", "daemon") and app not in installed and not app.startswith("My"):
             log(f"[SKIP] Программа не установлена: {app}")
             continue
 
-        data = defs[app]
-        out_dir = os.path.join("Backup", app)
-        os.makedirs(out_dir, exist_ok=True)
-
-        if args.mode == "backup":
-            any_data = False
-            for f in data.get("files", []):
-                if path_exists(f):
-                    backup_file(f, out_dir)
-                    any_data = True
-            for d in data.get("folders", []):
-                if path_exists(d):
-                    backup_folder(d, out_dir)
-                    any_data = True
-            for r in data.get("registry", []):
-                if registry_key_exists(r):
-                    regfile = os.path.join(out_dir, f"{app}_reg.reg")
-                    backup_registry_key(r, regfile)
-                    any_data = True
-            if args.zip and any_data:
-                zipname = os.path.join("Backup", f"{app}_backup")
-                compress_folder(out_dir, zipname)
-        elif args.mode == "restore":
-            for f in data.get("files", []):
-                src = os.path.join(out_dir, os.path.basename(f))
-                if os.path.exists(src):
-                    restore_file(src, f)
-            for d in data.get("folders", []):
-                src = os.path.join(out_dir, os.path.basename(d))
-                if os.path.exists(src):
-                    restore_folder(src, d)
-            for r in data.get("registry", []):
-                regfile = os.path.join(out_dir, f"{app}_reg.reg")
-                if os.path.exists(regfile):
-                    restore_registry_key(regfile)
+        if app not in jobs:
+            jobs.append(app)
+
+    paths = [p.strip() for p in args.paths.split(",") if p.strip()] if args.paths else None
+    report = RunReport(args.mode)
+    root = "Backup"
+    if args.target and args.mode in ("restore", "verify") and jobs:
+        # Архивы из цели хранения скачиваются во временный каталог: локальные копии в Backup/
+        # и их манифесты остаются как были
+        os.makedirs("Backup", exist_ok=True)
+        root = tempfile.mkdtemp(prefix=".fetch-", dir="Backup")
+        atexit.register(shutil.rmtree, root, True)
+        jobs = [app for app in jobs if fetch_archive(app, target, root)]
+    if args.mode in ("backup", "daemon") and jobs:
+        limiter = IOLimiter()
+        zip_options = {"level": args.level, "codec": args.codec}
+        if args.encrypt:
+            try:
+                zip_options["secret"] = read_secret(args, confirm=True)
+            except (PassphraseError, OSError) as e:
+                parser.error(str(e))
+    if args.mode == "daemon" and jobs:
+        # Копии по изменениям до Ctrl+C; каждый запуск — свой отчёт в Logs/
+        token = CancelToken()
+        handle_interrupt(token)
+
+        def run(todo):
+            # Трекер с общим токеном: Ctrl+C прерывает и текущую копию, а не только следующие
+            cycle = RunReport("backup")
+            tracker = Progress(None, token)
+            failed = set()
+
+            def done(i, app, result, lines):
+                # backup_app ошибки файлов логирует, а не бросает: такая копия удачной не считается
+                if any(line.startswith("[ERROR]") for line in lines):
+                    failed.add(app)
+
+            results = run_jobs(todo, lambda app: tracker.call(cycle.call, app, backup_app, app, defs[app], args.zip,
+                                                              store, not args.full, limiter.slot, zip_options,
+                                                              target),
+                               workers=args.workers, on_done=done, cancel=token)
+            save_report(cycle, args.stats)
+            if store and has_policy(**policy) and not token.cancelled:
+                for app in todo:
+                    prune_app(store, app, policy)
+            return [None if app in failed else result for app, result in zip(todo, results)]
+
+        BackupDaemon({app: defs[app] for app in jobs}, run, token, args.sweep).serve()
+        log("[DAEMON] Остановлено")
+    elif args.mode == "backup" and jobs:
+        tracker = Progress(print_progress if args.progress else None)
+        handle_interrupt(tracker.token)
+        try:
+            prescan(tracker, [defs[app] for app in jobs])
+        except Cancelled:
+            pass
+        run_jobs(jobs, lambda app: tracker.call(report.call, app, backup_app, app, defs[app], args.zip, store,
+                                                not args.full, limiter.slot, zip_options, target),
+                 workers=args.workers, cancel=tracker.token)
+        if args.progress:
+            tracker.update(force=True)
+            sys.stderr.write("\n")
+        if tracker.token.cancelled:
+            save_report(report, args.stats)
+            sys.exit(130)
+        # Чистка после всех копий: параллельно с записью снимков она могла бы удалить чанк, который только что переиспользован
+        if store and has_policy(**policy):
+            for app in jobs:
+                prune_app(store, app, policy)
+    elif args.mode == "restore" and jobs:
+        secret = None
+        if any(needs_secret(app, store, root) for app in jobs):
+            try:
+                secret = read_secret(args)
+            except (PassphraseError, OSError) as e:
+                parser.error(str(e))
+        run_jobs(jobs, lambda app: report.call(app, restore_app, app, defs[app], store, snapshot_id=args.snapshot,
+                                               paths=paths, secret=secret, root=root),
+                 workers=args.workers)
+    elif args.mode == "browse":
+        for app in jobs:
+            try:
+                items = [i for i in browse_app(app, store, args.snapshot)
+                         if paths is None or any(i[0] == p or i[0].startswith(p.rstrip("/") + "/") for p in paths)]
+            except Exception as e:
+                log(f"[ERROR] Browse: {app} — {e}")
+                continue
+            log(f"[BROWSE] {app}: {len(items)} файлов")
+            for key, size, mtime_ns in items:
+                log(f"  {key}  {size} B  {time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime_ns / 1e9))}")
+    elif args.mode == "upload":
+        # Готовые архивы из Backup/; прерванная загрузка продолжается с места остановки
+        for app in jobs:
+            zip_path = os.path.join("Backup", f"{app}_backup.zip")
+            if not os.path.exists(zip_path):
+                log(f"[SKIP] Нет архива: {zip_path}")
+                continue
+            if upload_file(target, zip_path) and upload_file(target, zip_path + ".manifest.json"):
+                log(f"[UPLOAD] {target.path(os.path.basename(zip_path))}")
+    elif args.mode == "diff":
+        for app in jobs:
+            try:
+                for line in format_diff(app, diff_app(app, defs[app], store, args.diff_from, args.diff_to, args.workers)):
+                    log(line)
+            except Exception as e:
+                log(f"[ERROR] Diff: {app} — {e}")
+    elif args.mode == "history":
+        for app in jobs:
+            ids = store.list_snapshots(app)
+            incomplete = set(store.list_incomplete(app))
+            log(f"[HISTORY] {app}: {len(ids)} снимков")
+            for sid in ids:
+                log(f"  {sid}" + (" (неполный: часть файлов не прочитана)" if sid in incomplete else ""))
+    elif args.mode == "prune":
+        if not has_policy(**policy):
+            parser.error("для --mode prune нужен хотя бы один из --keep-last/--keep-daily/--keep-weekly/--keep-monthly")
+        for app in jobs:
+            prune_app(store, app, policy)
+    elif args.mode == "verify" and jobs:
+        # Приложения проверяются по очереди, файлы внутри — параллельно
+        secret = None
+        zips = [os.path.join(root, f"{app}_backup.zip") for app in jobs]
+        if any(os.path.exists(z) and is_encrypted(z) for z in zips):
+            try:
+                secret = read_secret(args)
+            except (PassphraseError, OSError) as e:
+                parser.error(str(e))
+        results = run_jobs(jobs, lambda app: report.call(app, verify_app, app, store, args.workers, secret, root), workers=1)
+        save_report(report, args.stats)
+        if not all(results):
+            sys.exit(1)
+        return
+    save_report(report, args.stats)
 
 if __name__ == "__main__":
     main()
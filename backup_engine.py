@@ -1,13 +1,42 @@
-import os, shutil, zipfile, logging, subprocess
+import os, time, shutil, logging, subprocess, threading, tempfile
+from contextlib import contextmanager, nullcontext
+from tree_walk import iter_tree, TreeFilter
+from snapshot_index import SnapshotIndex
+from archive_writer import StreamingZip
+from archive_index import ArchiveIndex
+from storage_targets import LocalTarget
+from manifest import BackupManifest, new_hash, hash_file
+from live_copy import LiveStaging
+from progress import Cancelled
+import copy_engine
+import metrics
+import pipeline
+import progress
 
 LOG_PATH = os.path.join("Logs", "backup.log")
 os.makedirs("Logs", exist_ok=True)
 logging.basicConfig(filename=LOG_PATH, level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
+_capture = threading.local()
+
 def log(msg):
+    lines = getattr(_capture, "lines", None)
+    if lines is not None:
+        lines.append(msg)
+        return
     print(msg)
     logging.info(msg)
 
+@contextmanager
+def capture_log():
+    # Сообщения потока буферизуются, чтобы параллельные задания выводились по порядку
+    lines = []
+    _capture.lines = lines
+    try:
+        yield lines
+    finally:
+        _capture.lines = None
+
 def expand(path): return os.path.expandvars(path)
 
 def path_exists(path):
@@ -24,47 +53,334 @@ def registry_key_exists(key_path):
         with winreg.OpenKey(hive_map[hive], subkey): return True
     except: return False
 
-def backup_file(src, dst_dir):
+def _copy_one(src, dst, key, st, manifest, stats=None):
+    t = time.perf_counter()
+    before = _stat_key(dst)
+    try:
+        if manifest is None:
+            strategy = copy_engine.copy2(src, dst, stats)
+        else:
+            h = new_hash(manifest.algo)
+            strategy = copy_engine.copy2_hashed(src, dst, h, stats)
+            manifest.add(key, st.st_size, st.st_mtime_ns, h.hexdigest())
+    except BaseException:
+        # Недописанный файл в копии хуже отсутствующего; нетронутая прошлая версия остаётся
+        if before != _stat_key(dst) and os.path.exists(dst):
+            os.remove(dst)
+        raise
+    metrics.record_file(key, st.st_size, time.perf_counter() - t)
+    progress.advance(0, 1)
+    return strategy
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+def _skip_one(st):
+    progress.advance(st.st_size, 1)
+
+def _up_to_date(dst, st):
+    # Индекс говорит, что источник не менялся; копия в Backup/<app> должна быть той же версией
+    try:
+        d = os.stat(dst)
+    except OSError:
+        return False
+    return d.st_size == st.st_size and d.st_mtime_ns == st.st_mtime_ns
+
+def scan_app_size(data):
+    # Предварительный обход для прогресса: (байты, файлы) с учётом фильтра плагина
+    size = files = 0
+    tree_filter = TreeFilter.from_plugin(data)
+    for f in data.get("files", []):
+        try:
+            size += os.stat(expand(f)).st_size
+            files += 1
+        except OSError:
+            pass
+    for d in data.get("folders", []):
+        src = expand(d)
+        if os.path.isdir(src):
+            for _, _, st in iter_tree(src, os.path.basename(src), tree_filter):
+                size += st.st_size
+                files += 1
+    return size, files
+
+def prescan(tracker, datas):
+    # Общий объём всех заданий до начала копирования; прерывается отменой
+    with progress.track(tracker):
+        for data in datas:
+            tracker.add_total(*scan_app_size(data))
+    tracker.start()
+
+def _mirror_unchanged(index, dst_dir):
+    # Для LiveStaging: база не копируется заново, если копия в Backup/<app> совпадает с прошлой согласованной
+    if index is None:
+        return None
+
+    def unchanged(key, source_st):
+        st = index.staged(key, source_st)
+        return st if st is not None and _up_to_date(os.path.join(dst_dir, *key.split("/")), st) else None
+    return unchanged
+
+def backup_file(src, dst_dir, snapshot=None, index=None, manifest=None, live=None):
     try:
         src = expand(src)
-        dst = os.path.join(dst_dir, os.path.basename(src))
-        os.makedirs(dst_dir, exist_ok=True)
-        shutil.copy2(src, dst)
+        name = os.path.basename(src)
+        st = os.stat(src)
+        if live:
+            unchanged = snapshot.staged if snapshot is not None else _mirror_unchanged(index, dst_dir)
+            path, st = live.prepare_file(src, st, name, unchanged)
+        else:
+            path = src
+        if snapshot is not None:
+            snapshot.add_file(path, name, src, st)
+        else:
+            dst = os.path.join(dst_dir, name)
+            if index is not None and index.unchanged(name, st) and _up_to_date(dst, st):
+                index.keep(name, st)
+                if manifest is not None:
+                    manifest.carry(name, st, dst)
+                _skip_one(st)
+                log(f"[SKIP] File unchanged: {src}")
+                return
+            os.makedirs(dst_dir, exist_ok=True)
+            strategy = _copy_one(path, dst, name, st, manifest)
+            if index is not None:
+                index.keep(name, st)
+            log(f"[BACKUP] File: {src} ({strategy})")
+            return
         log(f"[BACKUP] File: {src}")
     except Exception as e:
         log(f"[ERROR] File: {src} — {e}")
 
-def backup_folder(src, dst_dir):
+async def copy_tree_async(src, dst_dir, name, index, stats, manifest, tree_filter=None, live=None):
+    # Обход, копирование и хеширование идут конвейером (pipeline); счётчики — в потоке цикла
+    counts = {"copied": 0, "skipped": 0, "failed": 0}
+    dir_errors = []
+
+    def stage(batch):
+        strategies = []
+        for path, key, st in batch:
+            dst = os.path.join(dst_dir, *key.split("/"))
+            if index is not None and index.unchanged(key, st) and _up_to_date(dst, st):
+                if manifest is not None:
+                    manifest.carry(key, st, dst)
+                _skip_one(st)
+                strategies.append(None)
+            else:
+                try:
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    strategies.append(_copy_one(path, dst, key, st, manifest))
+                except OSError as e:
+                    # Нечитаемый файл не прерывает папку; уцелевшая прошлая копия остаётся в индексе и манифесте
+                    if os.path.exists(dst):
+                        if index is not None:
+                            index.retain(key)
+                        if manifest is not None:
+                            manifest.retain(key)
+                    strategies.append(e)
+                    continue
+            if index is not None:
+                index.keep(key, st)
+        return strategies
+
+    def sink(batch, strategies):
+        # Лог пишется здесь, в потоке цикла: там же собирается вывод задания
+        for (path, key, st), strategy in zip(batch, strategies):
+            if strategy is None:
+                counts["skipped"] += 1
+            elif isinstance(strategy, OSError):
+                counts["failed"] += 1
+                log(f"[ERROR] File: {os.path.join(src, *key.split('/')[1:])} — {strategy}")
+            else:
+                counts["copied"] += 1
+                if stats is not None:
+                    stats[strategy] += 1
+
+    files = iter_tree(src, name, tree_filter, live, _mirror_unchanged(index, dst_dir),
+                      lambda *err: dir_errors.append(err))
+    await pipeline.run_files(files, stage, sink)
+    for folder, key, e in dir_errors:
+        # Нечитаемый каталог — как нечитаемый файл: прошлые копии всего поддерева остаются
+        if os.path.exists(os.path.join(dst_dir, *key.split("/"))):
+            if index is not None:
+                index.retain(key)
+            if manifest is not None:
+                manifest.retain(key)
+        counts["failed"] += 1
+        log(f"[ERROR] Folder: {folder} — {e}")
+    copied, skipped, failed = counts["copied"], counts["skipped"], counts["failed"]
+    if index is None:
+        return copied, skipped, 0, failed
+    removed = index.deleted(name)
+    for key in removed:
+        try:
+            os.remove(os.path.join(dst_dir, *key.split("/")))
+        except OSError:
+            pass
+    return copied, skipped, len(removed), failed
+
+def backup_folder(src, dst_dir, snapshot=None, index=None, manifest=None, tree_filter=None, live=None):
     try:
         src = expand(src)
-        dst = os.path.join(dst_dir, os.path.basename(src))
-        shutil.copytree(src, dst, dirs_exist_ok=True)
+        name = os.path.basename(src)
+        if snapshot is not None:
+            errors = snapshot.add_tree(src, name, tree_filter, live)
+            for path, e in errors:
+                log(f"[ERROR] {'Folder' if os.path.isdir(path) else 'File'}: {path} — {e}")
+            if errors:
+                log(f"[BACKUP] Folder: {src} (ошибок {len(errors)})")
+                return
+        elif index is not None or manifest is not None or tree_filter is not None or live is not None:
+            stats = copy_engine.new_stats()
+            copied, skipped, removed, failed = pipeline.run(
+                copy_tree_async(src, dst_dir, name, index, stats, manifest, tree_filter, live))
+            log(f"[BACKUP] Folder: {src} (скопировано {copied}, без изменений {skipped}, удалено {removed}"
+                + (f", ошибок {failed}" if failed else "")
+                + (f"; {copy_engine.format_stats(stats)})" if stats else ")"))
+            return
+        else:
+            stats = copy_engine.new_stats()
+            copy_engine.copytree(src, os.path.join(dst_dir, name), stats)
+            log(f"[BACKUP] Folder: {src} ({copy_engine.format_stats(stats)})")
+            return
         log(f"[BACKUP] Folder: {src}")
     except Exception as e:
         log(f"[ERROR] Folder: {src} — {e}")
 
-def backup_registry_key(key, outfile):
+def backup_registry_key(key, outfile, snapshot=None, manifest=None):
     try:
         subprocess.run(["reg", "export", key, outfile, "/y"], check=True)
+        if snapshot is not None:
+            snapshot.add_file(outfile, os.path.basename(outfile))
+        elif manifest is not None:
+            st = os.stat(outfile)
+            manifest.add(os.path.basename(outfile), st.st_size, st.st_mtime_ns, hash_file(outfile, manifest.algo))
         log(f"[BACKUP] Registry: {key}")
     except Exception as e:
         log(f"[ERROR] Registry: {key} — {e}")
 
+def archive_file(src, archive, live=None):
+    try:
+        src = expand(src)
+        path = live.prepare_file(src, os.stat(src))[0] if live else src
+        archive.add_file(path, os.path.basename(src))
+        log(f"[ZIP] File: {src}")
+    except Exception as e:
+        log(f"[ERROR] ZIP file: {src} — {e}")
+
+def archive_folder(src, archive, tree_filter=None, live=None):
+    try:
+        src = expand(src)
+        archive.add_tree(src, os.path.basename(src), tree_filter, live)
+        log(f"[ZIP] Folder: {src}")
+    except Exception as e:
+        log(f"[ERROR] ZIP folder: {src} — {e}")
+
+def archive_registry_key(key, archive, name):
+    # Экспорт во временный каталог: Backup/ при записи архива в цель хранения может не существовать
+    with tempfile.TemporaryDirectory(prefix=".reg-") as folder:
+        tmp = os.path.join(folder, name)
+        try:
+            subprocess.run(["reg", "export", key, tmp, "/y"], check=True)
+            archive.add_file(tmp, name)
+            archive.flush()
+            log(f"[ZIP] Registry: {key}")
+        except Exception as e:
+            log(f"[ERROR] ZIP registry: {key} — {e}")
+
 def restore_file(src_file, dst_path):
     try:
         os.makedirs(os.path.dirname(expand(dst_path)), exist_ok=True)
-        shutil.copy2(src_file, expand(dst_path))
-        log(f"[RESTORE] File restored: {src_file} → {dst_path}")
+        strategy = copy_engine.copy2(src_file, expand(dst_path))
+        log(f"[RESTORE] File restored: {src_file} → {dst_path} ({strategy})")
     except Exception as e:
         log(f"[ERROR] Restore file: {e}")
 
 def restore_folder(src_folder, dst_folder):
     try:
-        shutil.copytree(src_folder, expand(dst_folder), dirs_exist_ok=True)
-        log(f"[RESTORE] Folder restored: {src_folder} → {dst_folder}")
+        stats = copy_engine.new_stats()
+        copy_engine.copytree(src_folder, expand(dst_folder), stats)
+        log(f"[RESTORE] Folder restored: {src_folder} → {dst_folder} ({copy_engine.format_stats(stats)})")
     except Exception as e:
         log(f"[ERROR] Restore folder: {e}")
 
+def restore_from_snapshot(store, manifest, name, dst):
+    try:
+        count = store.restore(manifest, name, expand(dst))
+        if count:
+            log(f"[RESTORE] Snapshot restored: {name} → {dst} ({count})")
+        return count
+    except Exception as e:
+        log(f"[ERROR] Restore snapshot: {e}")
+        return 0
+
+def commit_snapshot(snapshot):
+    try:
+        path = snapshot.commit()
+        log(f"[SNAPSHOT] {path}: {snapshot.total_bytes} B, новых {snapshot.new_bytes} B, "
+            f"без изменений {snapshot.reused} файлов, удалено {len(snapshot.deleted)}"
+            + (f", не прочитано {len(snapshot.failed)} (снимок неполный)" if snapshot.failed else ""))
+        return True
+    except Exception as e:
+        log(f"[ERROR] Snapshot: {e}")
+        return False
+
+def log_filter(app, tree_filter):
+    if tree_filter is not None and (tree_filter.skipped_files or tree_filter.skipped_dirs):
+        log(f"[FILTER] {app}: {tree_filter.summary()}")
+
+def log_live(app, live):
+    if live is None:
+        return
+    for msg in live.warnings:
+        log(msg)
+    if live.sqlite or live.leveldb or live.unchanged:
+        log(f"[LIVE] {app}: согласованные копии баз — {live.summary()}")
+
+def save_manifest(manifest):
+    try:
+        manifest.save()
+    except Exception as e:
+        log(f"[ERROR] Manifest: {e}")
+
+def save_index(index):
+    try:
+        index.save()
+    except Exception as e:
+        log(f"[ERROR] Index: {e}")
+
+def restore_from_archive(zip_path, name, dst, secret=None):
+    # Извлекает из архива файл name или всё содержимое папки name/ в dst. Член пишется во временный
+    # файл и заменяет цель только после проверки CRC/тега GCM: при ошибке цель остаётся прежней
+    try:
+        dst = expand(dst)
+        count = 0
+        with ArchiveIndex(zip_path, secret) as index:
+            for entry, rel in index.select(name):
+                target = os.path.join(dst, *rel.split("/")) if rel else dst
+                os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+                tmp = os.path.join(os.path.dirname(target), "." + os.path.basename(target) + ".restore-tmp")
+                try:
+                    with index.open(entry) as src, open(tmp, "wb") as out:
+                        shutil.copyfileobj(src, out, 1024 * 1024)
+                        out.flush()
+                        os.fsync(out.fileno())
+                    os.replace(tmp, target)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                count += 1
+        if count:
+            log(f"[RESTORE] Archive restored: {zip_path}:{name} → {dst} ({count})")
+        return count
+    except Exception as e:
+        log(f"[ERROR] Restore archive: {e}")
+        return 0
+
 def restore_registry_key(reg_file):
     try:
         subprocess.run(["reg", "import", reg_file], check=True)
@@ -72,9 +388,126 @@ def restore_registry_key(reg_file):
     except Exception as e:
         log(f"[ERROR] Import registry: {e}")
 
-def compress_folder(folder, zip_path):
+def compress_folder(folder, zip_path, **zip_options):
     try:
-        shutil.make_archive(zip_path, "zip", folder)
+        with StreamingZip(zip_path + ".zip", **zip_options) as archive:
+            for entry in sorted(os.listdir(folder)):
+                path = os.path.join(folder, entry)
+                if os.path.isdir(path):
+                    archive.add_tree(path, entry)
+                else:
+                    archive.add_file(path, entry)
+        log_failed(archive)
         log(f"[ZIP] {zip_path}.zip")
     except Exception as e:
         log(f"[ERROR] ZIP: {e}")
+
+def backup_app_archive(app, data, slot, zip_options=None, live=None, target=None):
+    # Один проход: источники читаются и сразу пишутся в <app>_backup.zip цели хранения
+    # (по умолчанию Backup/) без промежуточной копии. Манифест ложится рядом с архивом:
+    # для другой цели он собирается во временном каталоге и отправляется туда, чтобы манифест
+    # в Backup/ всегда описывал архив из Backup/
+    target = target or LocalTarget()
+    if is_backup_dir(target):
+        return _backup_app_archive(app, data, slot, zip_options, live, target, "Backup")
+    with tempfile.TemporaryDirectory(prefix="backupapp-") as staging:
+        return _backup_app_archive(app, data, slot, zip_options, live, target, staging)
+
+def is_backup_dir(target):
+    return isinstance(target, LocalTarget) and os.path.abspath(target.root) == os.path.abspath("Backup")
+
+def _backup_app_archive(app, data, slot, zip_options, live, target, manifest_dir):
+    any_data = False
+    name = f"{app}_backup.zip"
+    manifest = BackupManifest(os.path.join(manifest_dir, name))
+    tree_filter = TreeFilter.from_plugin(data)
+    with StreamingZip(name, manifest=manifest, target=target, **(zip_options or {})) as archive:
+        for f in data.get("files", []):
+            if path_exists(f):
+                with slot(f):
+                    archive_file(f, archive, live)
+                any_data = True
+        for d in data.get("folders", []):
+            if path_exists(d):
+                with slot(d):
+                    archive_folder(d, archive, tree_filter, live)
+                any_data = True
+        for r in data.get("registry", []):
+            if registry_key_exists(r):
+                archive_registry_key(r, archive, f"{app}_reg.reg")
+                any_data = True
+    log_failed(archive)
+    if not any_data:
+        log(f"[INFO] Нет данных для: {app}")
+    elif archive.count:
+        save_manifest(manifest)
+        upload_file(target, manifest.path)
+        log(f"[ZIP] {archive.zip_path}: {archive.count} файлов, {archive.bytes_in} B")
+    log_filter(app, tree_filter)
+    log_live(app, live)
+    return any_data
+
+def log_failed(archive):
+    # Файлы, пропавшие или не прочитанные во время записи архива, в него не попали
+    for name, e in archive.failed:
+        log(f"[ERROR] ZIP file: {name} — {e}")
+
+def upload_file(target, path):
+    # Готовый файл → цель хранения под тем же именем; файл, уже лежащий в цели, не копируется
+    try:
+        target.put_file(path, os.path.basename(path))
+    except Exception as e:
+        log(f"[ERROR] Upload: {path} — {e}")
+        return False
+    return True
+
+def backup_app(app, data, zip_enabled=False, store=None, incremental=True, io_slot=None, zip_options=None,
+               target=None):
+    slot = io_slot or (lambda path: nullcontext())
+    # Базы SQLite и LevelDB копируются согласованно во временный каталог, который живёт до конца задания
+    with LiveStaging(app) as live:
+        if zip_enabled and not store:
+            return backup_app_archive(app, data, slot, zip_options, live, target)
+        return backup_app_copy(app, data, store, incremental, slot, live)
+
+def backup_app_copy(app, data, store, incremental, slot, live=None):
+    out_dir = os.path.join("Backup", app)
+    os.makedirs(out_dir, exist_ok=True)
+    index = None
+    if incremental:
+        # У снимков и у Backup/<app> свои индексы: файл, уже учтённый снимком, копия пропускать не должна
+        index = SnapshotIndex(app, os.path.join(store.root, "index")) if store else SnapshotIndex(app)
+    snapshot = store.snapshot(app, index) if store else None
+    # Снимки в хранилище чанков адресуются хешами сами; манифест нужен только копии в Backup/<app>
+    manifest = None if snapshot else BackupManifest(out_dir)
+    tree_filter = TreeFilter.from_plugin(data)
+
+    any_data = False
+    for f in data.get("files", []):
+        if path_exists(f):
+            with slot(f):
+                backup_file(f, out_dir, snapshot, index, manifest, live)
+            any_data = True
+    for d in data.get("folders", []):
+        if path_exists(d):
+            with slot(d):
+                backup_folder(d, out_dir, snapshot, index, manifest, tree_filter, live)
+            any_data = True
+    for r in data.get("registry", []):
+        if registry_key_exists(r):
+            regfile = os.path.join(out_dir, f"{app}_reg.reg")
+            backup_registry_key(r, regfile, snapshot, manifest)
+            any_data = True
+
+    if not any_data:
+        log(f"[INFO] Нет данных для: {app}")
+        return False
+    log_filter(app, tree_filter)
+    log_live(app, live)
+    # Индекс снимка без самого снимка сохранять нельзя: следующий запуск счёл бы файлы учтёнными
+    committed = commit_snapshot(snapshot) if snapshot else True
+    if manifest is not None:
+        save_manifest(manifest)
+    if index is not None and committed:
+        save_index(index)
+    return True
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# bench.py — воспроизводимые замеры движка на синтетических профилях приложений.
+# Работает на обычном Linux без реестра Windows; результаты дописываются в историю
+# и сравниваются с прошлым запуском на том же масштабе.
+import os, sys, json, time, random, shutil, sqlite3, argparse, platform, tempfile, subprocess, statistics
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from backup_engine import backup_folder, compress_folder, restore_folder, capture_log
+from snapshot_index import SnapshotIndex
+from manifest import BackupManifest
+from scan_user_configs import scan_user_configs, DiscoveryIndex
+from app_definitions import load_plugins, CACHE_NAME
+
+HISTORY_PATH = os.path.join(ROOT, "Logs", "bench_history.jsonl")
+PROFILES = ("chrome", "steam", "vscode")
+SEED = 1234
+
+
+def _write(path, size, rng):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(rng.randbytes(size))
+
+
+def _sqlite(path, rows, rng):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with sqlite3.connect(path) as db:
+        db.execute("CREATE TABLE urls (id INTEGER PRIMARY KEY, url TEXT, title TEXT, visits INTEGER)")
+        db.executemany("INSERT INTO urls (url, title, visits) VALUES (?, ?, ?)",
+                       ((f"https://example.com/{rng.getrandbits(48):x}", "x" * rng.randint(10, 80), rng.randint(1, 99))
+                        for _ in range(rows)))
+    db.close()
+
+
+def make_chrome(root, scale, rng):
+    # Много мелких файлов (LevelDB, IndexedDB, расширения, кэш) и несколько баз SQLite
+    base = os.path.join(root, "Default")
+    for name in ("History", "Cookies", "Web Data", "Favicons"):
+        _sqlite(os.path.join(base, name), int(4000 * scale), rng)
+    for i in range(int(2000 * scale)):
+        _write(os.path.join(base, "Cache", "Cache_Data", f"f_{i:06x}"), rng.randint(200, 40_000), rng)
+    for i in range(int(600 * scale)):
+        ext = rng.choice(["js", "json", "png", "html"])
+        _write(os.path.join(base, "Extensions", f"ext{i % 40:02d}", "1.0", f"file{i}.{ext}"), rng.randint(100, 20_000), rng)
+    for i in range(int(200 * scale)):
+        _write(os.path.join(base, "IndexedDB", f"https_site{i % 20}.indexeddb.leveldb", f"{i:06d}.ldb"),
+               rng.randint(1_000, 200_000), rng)
+    for name in ("CURRENT", "MANIFEST-000001", "000003.log"):
+        _write(os.path.join(base, "Local Storage", "leveldb", name), rng.randint(16, 50_000), rng)
+    _write(os.path.join(base, "Preferences"), 30_000, rng)
+    return base
+
+
+def make_steam(root, scale, rng):
+    # Глубокие деревья userdata/<id>/<appid>/remote/...
+    base = os.path.join(root, "userdata")
+    for user in range(2):
+        for app in range(int(60 * scale)):
+            path = os.path.join(base, str(10_000_000 + user), str(200 + app * 10), "remote")
+            for depth in range(rng.randint(2, 6)):
+                path = os.path.join(path, f"d{depth}_{rng.randint(0, 3)}")
+            for i in range(rng.randint(2, 12)):
+                _write(os.path.join(path, f"save{i}.vdf"), rng.randint(50, 60_000), rng)
+    return base
+
+
+def make_vscode(root, scale, rng):
+    # Несколько небольших JSON
+    base = os.path.join(root, "User")
+    for name in ("settings.json", "keybindings.json", "tasks.json"):
+        _write(os.path.join(base, name), rng.randint(500, 8_000), rng)
+    for i in range(12):
+        _write(os.path.join(base, "snippets", f"lang{i}.json"), rng.randint(200, 4_000), rng)
+    return base
+
+
+MAKERS = {"chrome": make_chrome, "steam": make_steam, "vscode": make_vscode}
+
+
+def make_plugins(folder, count, rng):
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(folder, f"bench_{i:04d}.json"), "w", encoding="utf-8") as f:
+            json.dump({f"App {i}": {"files": [f"%APPDATA%\\App{i}\\config.ini"],
+                                    "folders": [f"%APPDATA%\\App{i}\\Profile{j}" for j in range(rng.randint(1, 4))],
+                                    "registry": [f"HKEY_CURRENT_USER\\Software\\App{i}"]}}, f)
+
+
+def _timed(fn):
+    # Движок пишет ошибки в лог и не бросает исключений — здесь они должны валить замер
+    with capture_log() as lines:
+        t = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t
+    errors = [line for line in lines if line.startswith("[ERROR]")]
+    if errors:
+        raise RuntimeError(errors[0])
+    return elapsed
+
+
+def _drop_caches():
+    # Настоящий холодный кэш ОС доступен только root; иначе «холодный» — без состояния движка
+    try:
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        return True
+    except OSError:
+        return False
+
+
+def bench_profile(profile, src, work, repeat, drop):
+    # cold — без индекса/кэшей и с пустым каталогом назначения, warm — повтор поверх готового состояния
+    results = {}
+    name = os.path.basename(src)
+
+    def measure(op, prepare, run):
+        cold, warm = [], []
+        for _ in range(repeat):
+            prepare()
+            if drop:
+                _drop_caches()
+            cold.append(_timed(run))
+            warm.append(_timed(run))
+        results[f"{profile}/{op}/cold"] = statistics.median(cold)
+        results[f"{profile}/{op}/warm"] = statistics.median(warm)
+
+    mirror = os.path.join(work, "Backup", profile)
+
+    def reset_mirror():
+        shutil.rmtree(os.path.join(work, "Backup"), ignore_errors=True)
+
+    def run_backup():
+        index = SnapshotIndex(profile)
+        manifest = BackupManifest(mirror)
+        backup_folder(src, mirror, index=index, manifest=manifest)
+        index.save()
+        manifest.save()
+
+    measure("backup_folder", reset_mirror, run_backup)
+
+    zip_base = os.path.join(work, f"{profile}_bench")
+    measure("compress_folder", lambda: os.path.exists(zip_base + ".zip") and os.remove(zip_base + ".zip"),
+            lambda: compress_folder(mirror, zip_base))
+
+    restored = os.path.join(work, "restored", profile)
+    measure("restore_folder", lambda: shutil.rmtree(restored, ignore_errors=True),
+            lambda: restore_folder(os.path.join(mirror, name), restored))
+
+    measure("scan_user_configs", lambda: None, lambda: scan_user_configs([src]))
+
+    index_path = os.path.join(work, f"{profile}_discovery.idx")
+    measure("discovery_index", lambda: os.path.exists(index_path) and os.remove(index_path),
+            lambda: list(DiscoveryIndex(index_path).scan([src])))
+    return results
+
+
+def bench_plugins(work, count, repeat, rng):
+    folder = os.path.join(work, "Plugins")
+    make_plugins(folder, count, rng)
+    cache = os.path.join(folder, CACHE_NAME)
+    cold, warm = [], []
+    for _ in range(repeat):
+        if os.path.exists(cache):
+            os.remove(cache)
+        cold.append(_timed(lambda: load_plugins(folder)))
+        warm.append(_timed(lambda: load_plugins(folder)))
+    return {"plugins/load_plugins/cold": statistics.median(cold), "plugins/load_plugins/warm": statistics.median(warm)}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except OSError:
+        return []
+
+
+def append_history(path, entry):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def print_table(results, previous):
+    print(f"{'операция':<40} {'сек':>10} {'прошлый':>10} {'Δ':>8}")
+    for key in sorted(results):
+        now = results[key]
+        before = previous["results"].get(key) if previous else None
+        if before:
+            print(f"{key:<40} {now:>10.4f} {before:>10.4f} {(now - before) / before * 100:>+7.0f}%")
+        else:
+            print(f"{key:<40} {now:>10.4f} {'—':>10} {'':>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк движка резервного копирования")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help="chrome,steam,vscode")
+    parser.add_argument("--scale", type=float, default=1.0, help="множитель размера синтетических деревьев")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов каждого замера (берётся медиана)")
+    parser.add_argument("--plugins", type=int, default=300, help="сколько синтетических плагинов загружать")
+    parser.add_argument("--label", default="", help="метка запуска в истории")
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--workdir", help="каталог для данных (по умолчанию временный, удаляется)")
+    parser.add_argument("--drop-caches", action="store_true", help="сбрасывать кэш ОС перед холодным замером (root)")
+    args = parser.parse_args()
+
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    for p in profiles:
+        if p not in MAKERS:
+            parser.error(f"неизвестный профиль: {p}")
+    work = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="backupapp-bench-")
+    os.makedirs(work, exist_ok=True)
+    cwd = os.getcwd()
+    # Движок пишет Backup/.index относительно текущего каталога
+    os.chdir(work)
+    results = {}
+    try:
+        for profile in profiles:
+            rng = random.Random(f"{SEED}-{profile}")
+            src = MAKERS[profile](os.path.join(work, "src", profile), args.scale, rng)
+            results.update(bench_profile(profile, src, work, args.repeat, args.drop_caches))
+        results.update(bench_plugins(work, args.plugins, args.repeat, random.Random(SEED)))
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(work, ignore_errors=True)
+
+    # Сравнивать имеет смысл только с запуском на тех же параметрах
+    params = {"profiles": profiles, "scale": args.scale, "plugins": args.plugins, "repeat": args.repeat}
+    previous = next((e for e in reversed(load_history(args.history)) if e.get("params") == params), None)
+    print_table(results, previous)
+    append_history(args.history, {
+        "created": time.time(),
+        "label": args.label,
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "results": {k: round(v, 6) for k, v in results.items()},
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+import os, json, time, sqlite3, hashlib, threading
+from tree_walk import iter_tree
+from manifest import new_hash, HASH_ALGO
+from retention import select_snapshots
+import metrics
+import pipeline
+import progress
+
+STORE_DIR = os.path.join("Backup", ".store")
+
+# Content-defined chunking, нормализованный как в FastCDC: граница там, где скользящий хеш
+# последних WINDOW байт даёт два нулевых байта и малый третий; до AVG_CHUNK условие строже.
+# Хеш считается целиком в C, без цикла по байтам в Python: байты перемешиваются таблицей
+# (translate), а буфер как одно большое число умножается на WINDOW-байтовую константу —
+# байт i произведения зависит от байтов i-WINDOW+1..i (плюс перенос). Файлы меньше MIN_CHUNK
+# хранятся одним чанком.
+MIN_CHUNK = 256 * 1024
+AVG_CHUNK = 1024 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+READ_SIZE = 8 * 1024 * 1024
+WINDOW = 16
+
+_TABLE = bytes(hashlib.blake2b(bytes([i]), digest_size=1).digest()[0] for i in range(256))
+_MUL = int.from_bytes(hashlib.blake2b(b"chunk", digest_size=WINDOW).digest(), "little") | 1
+# Порог третьего байта: 2^-22 на позицию до AVG_CHUNK, 2^-18 после
+_LIMIT_S = 4
+_LIMIT_L = 64
+
+
+def _rolling(buf):
+    n = len(buf)
+    return (int.from_bytes(buf.translate(_TABLE), "little") * _MUL).to_bytes(n + WINDOW, "little")[:n]
+
+
+def _cut(h, start, end):
+    n = end - start
+    if n <= MIN_CHUNK:
+        return end
+    limit = start + min(n, MAX_CHUNK)
+    normal = min(start + AVG_CHUNK, limit)
+    i = start + MIN_CHUNK
+    while True:
+        i = h.find(b"\0\0", i, limit - 1)
+        if i < 0:
+            return limit
+        if h[i + 2] < (_LIMIT_S if i < normal else _LIMIT_L):
+            return i + 3
+        i += 1
+
+
+def iter_chunks(f):
+    buf, h, pos, eof = b"", b"", 0, False
+    while True:
+        if not eof and len(buf) - pos < MAX_CHUNK:
+            data = f.read(READ_SIZE)
+            if data:
+                buf = buf[pos:] + data
+                h = _rolling(buf)
+                pos = 0
+                continue
+            eof = True
+        if pos >= len(buf):
+            return
+        cut = _cut(h, pos, len(buf))
+        yield buf[pos:cut]
+        pos = cut
+
+
+def chunk_digest(data):
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+
+# Счётчики ссылок: чанк → число снимков, которые на него ссылаются.
+# Удаление снимка уменьшает счётчики только его чанков и удаляет обнулившиеся,
+# поэтому стоит пропорционально удаляемому снимку, а не всей истории.
+REFS_NAME = "refs.db"
+REFS_VERSION = 1
+# Пустой файл <снимок>.incomplete рядом с манифестом: часть файлов не прочиталась.
+# Хранение и история узнают об этом по списку файлов каталога, не читая манифесты
+INCOMPLETE = ".incomplete"
+
+
+class ChunkStore:
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self.chunks_dir = os.path.join(root, "chunks")
+        self.manifests_dir = os.path.join(root, "manifests")
+        self.refs_path = os.path.join(root, REFS_NAME)
+        self._refs_lock = threading.Lock()
+
+    def _connect(self):
+        os.makedirs(self.root, exist_ok=True)
+        db = sqlite3.connect(self.refs_path, timeout=30)
+        if db.execute("PRAGMA user_version").fetchone()[0] != REFS_VERSION:
+            # Новая база или хранилище из версии без счётчиков — считаем один раз по всем манифестам
+            with db:
+                db.execute("DROP TABLE IF EXISTS chunks")
+                db.execute("CREATE TABLE chunks (digest TEXT PRIMARY KEY, refs INTEGER NOT NULL) WITHOUT ROWID")
+                for app in self.list_apps():
+                    for sid in self.list_snapshots(app):
+                        self._add_refs(db, self._manifest_chunks(self.load_manifest(app, sid)))
+                db.execute(f"PRAGMA user_version = {REFS_VERSION}")
+        return db
+
+    @staticmethod
+    def _manifest_chunks(manifest):
+        return {d for entry in manifest["files"] for d in entry["chunks"]}
+
+    @staticmethod
+    def _add_refs(db, digests):
+        db.executemany("INSERT INTO chunks VALUES (?, 1) ON CONFLICT(digest) DO UPDATE SET refs = refs + 1",
+                       ((d,) for d in digests))
+
+    def add_refs(self, digests):
+        with self._refs_lock:
+            db = self._connect()
+            try:
+                with db:
+                    self._add_refs(db, digests)
+            finally:
+                db.close()
+
+    def release_refs(self, digests):
+        # → список чанков, на которые больше никто не ссылается (уже удалены с диска)
+        freed = []
+        with self._refs_lock:
+            db = self._connect()
+            try:
+                with db:
+                    for d in digests:
+                        db.execute("UPDATE chunks SET refs = refs - 1 WHERE digest = ?", (d,))
+                        row = db.execute("SELECT refs FROM chunks WHERE digest = ?", (d,)).fetchone()
+                        if row is None or row[0] <= 0:
+                            db.execute("DELETE FROM chunks WHERE digest = ?", (d,))
+                            freed.append(d)
+            finally:
+                db.close()
+        for d in freed:
+            try:
+                os.remove(self.chunk_path(d))
+            except FileNotFoundError:
+                pass
+        return freed
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.exists(self.chunk_path(digest))
+
+    def put(self, data):
+        digest = chunk_digest(data)
+        return digest, self._put(digest, data)
+
+    def _put(self, digest, data):
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return True
+
+    def get(self, digest):
+        with open(self.chunk_path(digest), "rb") as f:
+            return f.read()
+
+    def put_file(self, path):
+        # read — чтение вместе с поиском границ чанков, hash — BLAKE2b, write — запись новых чанков.
+        # → (чанки, новых байт, хеш всего файла): по хешу восстановление и diff сверяют файл, не нарезая его
+        chunks, new_bytes = [], 0
+        whole = new_hash()
+        op = metrics.current()
+        with open(path, "rb") as f:
+            it = iter_chunks(f)
+            while True:
+                with metrics.phase("read", op):
+                    data = next(it, None)
+                if data is None:
+                    break
+                with metrics.phase("hash", op):
+                    digest = chunk_digest(data)
+                    whole.update(data)
+                with metrics.phase("write", op):
+                    is_new = self._put(digest, data)
+                chunks.append(digest)
+                if is_new:
+                    new_bytes += len(data)
+                progress.advance(len(data))
+        return chunks, new_bytes, whole.hexdigest()
+
+    def write_file(self, chunks, dst):
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        with open(dst, "wb") as out:
+            for digest in chunks:
+                out.write(self.get(digest))
+
+    def snapshot(self, app, index=None):
+        return SnapshotWriter(self, app, index)
+
+    def list_apps(self):
+        if not os.path.isdir(self.manifests_dir):
+            return []
+        return sorted(e.name for e in os.scandir(self.manifests_dir) if e.is_dir())
+
+    def _names(self, app, suffix):
+        folder = os.path.join(self.manifests_dir, app)
+        if not os.path.isdir(folder):
+            return set()
+        return {f[:-len(suffix)] for f in os.listdir(folder) if f.endswith(suffix)}
+
+    def list_snapshots(self, app):
+        return sorted(self._names(app, ".json"))
+
+    def list_incomplete(self, app):
+        # Метка без манифеста (сбой при записи снимка) не считается
+        return sorted(self._names(app, INCOMPLETE) & self._names(app, ".json"))
+
+    def load_manifest(self, app, snapshot_id=None):
+        if snapshot_id is None:
+            ids = self.list_snapshots(app)
+            if not ids:
+                return None
+            snapshot_id = ids[-1]
+        with open(os.path.join(self.manifests_dir, app, f"{snapshot_id}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def delete_snapshot(self, app, snapshot_id):
+        # Сначала удаляется манифест: при сбое посередине чанки только утекут, но не пропадут у живых снимков
+        manifest = self.load_manifest(app, snapshot_id)
+        os.remove(os.path.join(self.manifests_dir, app, f"{snapshot_id}.json"))
+        try:
+            os.remove(os.path.join(self.manifests_dir, app, snapshot_id + INCOMPLETE))
+        except FileNotFoundError:
+            pass
+        freed = self.release_refs(self._manifest_chunks(manifest))
+        return len(freed)
+
+    def prune(self, app, **policy):
+        # policy: keep_last, keep_daily, keep_weekly, keep_monthly (см. retention.select_snapshots).
+        # Не запускать одновременно с резервным копированием того же хранилища.
+        # Неполные снимки (часть файлов не прочиталась) в политике не участвуют: живут, пока новее
+        # последнего полного, и удаляются, как только появится полный поновее
+        ids = self.list_snapshots(app)
+        incomplete = set(self.list_incomplete(app))
+        complete = [sid for sid in ids if sid not in incomplete]
+        keep, drop = select_snapshots(complete, **policy)
+        latest = complete[-1] if complete else ""
+        for sid in sorted(set(ids) - set(complete)):
+            (drop if sid < latest else keep).append(sid)
+        freed = sum(self.delete_snapshot(app, sid) for sid in drop)
+        return sorted(keep), sorted(drop), freed
+
+    def restore(self, manifest, name, dst):
+        # name — путь внутри снимка (basename исходного файла или папки)
+        restored = 0
+        prefix = name + "/"
+        for entry in manifest["files"]:
+            path = entry["path"]
+            if path == name:
+                target = dst
+            elif path.startswith(prefix):
+                target = os.path.join(dst, *path[len(prefix):].split("/"))
+            else:
+                continue
+            self.write_file(entry["chunks"], target)
+            os.utime(target, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            restored += 1
+        return restored
+
+
+class SnapshotWriter:
+    def __init__(self, store, app, index=None):
+        self.store = store
+        self.app = app
+        self.index = index
+        self.files = []
+        self.sources = {}
+        self.deleted = []
+        self.failed = []
+        self.aborted = []
+        self.new_bytes = 0
+        self.total_bytes = 0
+        self.reused = 0
+        self._previous = None
+
+    def _previous_entry(self, name):
+        if self._previous is None:
+            manifest = self.store.load_manifest(self.app)
+            self._previous = {e["path"]: e for e in manifest["files"]} if manifest else {}
+        return self._previous.get(name)
+
+    def add_file(self, src, name, source=None, st=None):
+        # source — исходный путь, если src — согласованная копия из LiveStaging; st — её stat
+        self.sources[name] = source or src
+        try:
+            self._add(src, name, st or os.stat(src))
+        except OSError:
+            self.fail(name)
+            raise
+        if self.index is not None:
+            self.deleted += self.index.deleted(name)
+
+    def _chunks(self, src, name, st):
+        # Может выполняться в потоках конвейера → (чанки, новых байт или None, если файл взят
+        # из прошлого снимка, хеш файла или None, если его нет в прошлом снимке)
+        chunks = new_bytes = digest = None
+        if self.index is not None and self.index.unchanged(name, st):
+            prev = self._previous_entry(name)
+            if prev and prev["size"] == st.st_size and prev["mtime_ns"] == st.st_mtime_ns:
+                chunks, digest = prev["chunks"], prev.get("digest")
+                progress.advance(st.st_size)
+        if chunks is None:
+            t = time.perf_counter()
+            chunks, new_bytes, digest = self.store.put_file(src)
+            metrics.record_file(name, st.st_size, time.perf_counter() - t)
+        if self.index is not None:
+            self.index.keep(name, st)
+        progress.advance(0, 1)
+        return chunks, new_bytes, digest
+
+    def staged(self, key, source_st):
+        # Для LiveStaging: база не копируется, если снимок возьмёт её чанки из прошлого
+        st = self.index.staged(key, source_st) if self.index is not None else None
+        prev = self._previous_entry(key) if st is not None else None
+        if prev and prev["size"] == st.st_size and prev["mtime_ns"] == st.st_mtime_ns:
+            return st
+        return None
+
+    def _try_chunks(self, src, name, st):
+        try:
+            return self._chunks(src, name, st)
+        except OSError as e:
+            return e
+
+    def fail(self, name):
+        # Файл (или каталог — тогда всё под ним) не прочитан: в снимок идут версии из прошлого снимка
+        # (если есть), снимок помечается неполным
+        self.failed.append(name)
+        self._previous_entry(name)
+        prefix = name + "/"
+        for path, prev in self._previous.items():
+            if path == name or path.startswith(prefix):
+                self.files.append(prev)
+                self.total_bytes += prev["size"]
+                self.reused += 1
+        if self.index is not None:
+            self.index.retain(name)
+
+    def _record(self, name, st, chunks, new_bytes, digest):
+        if new_bytes is None:
+            self.reused += 1
+        else:
+            self.new_bytes += new_bytes
+        entry = {"path": name, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "chunks": chunks}
+        if digest is not None:
+            entry["digest"] = digest
+        self.files.append(entry)
+        self.total_bytes += st.st_size
+
+    def _add(self, src, name, st):
+        self._record(name, st, *self._chunks(src, name, st))
+
+    async def add_tree_async(self, src, name, tree_filter=None, live=None):
+        self.sources[name] = src
+        if self.index is not None:
+            self._previous_entry(name)  # прошлый манифест читается до запуска потоков
+
+        errors, dir_errors = [], []
+
+        def sink(batch, results):
+            for (_, key, st), result in zip(batch, results):
+                if isinstance(result, OSError):
+                    errors.append((os.path.join(src, *key.split("/")[1:]), result))
+                    self.fail(key)
+                else:
+                    self._record(key, st, *result)
+
+        try:
+            # Нечитаемый каталог не обрывает обход: ошибка копится в потоке обхода, а поддерево
+            # помечается здесь, в потоке цикла, как и нечитаемые файлы
+            await pipeline.run_files(iter_tree(src, name, tree_filter, live, self.staged,
+                                               lambda *err: dir_errors.append(err)),
+                                     lambda batch: [self._try_chunks(path, key, st) for path, key, st in batch], sink)
+            for folder, key, e in dir_errors:
+                errors.append((folder, e))
+                self.fail(key)
+        except Exception:
+            # Прерванный обход не должен стать последним снимком: commit() откажется его сохранять
+            self.aborted.append(name)
+            raise
+        if self.index is not None:
+            self.deleted += self.index.deleted(name)
+        return errors
+
+    def add_tree(self, src, name, tree_filter=None, live=None):
+        # → [(путь, ошибка)] для файлов и каталогов, которые не удалось прочитать
+        return pipeline.run(self.add_tree_async(src, name, tree_filter, live))
+
+    def commit(self):
+        if self.aborted:
+            raise RuntimeError(f"обход прерван ({', '.join(self.aborted)}), снимок не сохранён")
+        folder = os.path.join(self.store.manifests_dir, self.app)
+        os.makedirs(folder, exist_ok=True)
+        snapshot_id = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(folder, f"{snapshot_id}.json")
+        n = 1
+        while os.path.exists(path):
+            n += 1
+            path = os.path.join(folder, f"{snapshot_id}-{n}.json")
+        if self.failed:
+            # Метка пишется до манифеста: после сбоя между шагами остаётся только ничейная метка
+            with open(path[:-5] + INCOMPLETE, "wb"):
+                pass
+        manifest = {
+            "app": self.app,
+            "algo": HASH_ALGO,
+            "created": time.time(),
+            "sources": self.sources,
+            "files": self.files,
+            "deleted": self.deleted,
+        }
+        if self.failed:
+            manifest["failed"] = self.failed
+        # Счётчики увеличиваются до появления манифеста: сбой между шагами даёт лишнюю ссылку, а не потерю данных
+        self.store.add_refs(self.store._manifest_chunks(manifest))
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        return path
@@ -0,0 +1,214 @@
+import os, sys, time, errno, shutil, threading
+from collections import Counter
+import metrics
+import progress
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl FICLONE: клонирование экстентов на CoW-файловых системах (btrfs, xfs с reflink)
+FICLONE = 0x40049409
+# Копирование в ядре идёт порциями, чтобы прогресс и отмена работали и на больших файлах
+KERNEL_CHUNK = 64 * 1024 * 1024
+# Порция копирования в ядре с хешем: перечитывается из копии, пока она в кеше страниц
+HASHED_CHUNK = 8 * 1024 * 1024
+
+# Ошибки, после которых стратегия считается неподдерживаемой для пары устройств
+_UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY,
+                errno.EBADF, errno.EPERM, getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)}
+_unsupported = set()
+_lock = threading.Lock()
+
+
+def _reflink(fin, fout):
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "FICLONE недоступен")
+    fcntl.ioctl(fout, FICLONE, fin)
+
+
+def _copy_file_range(fin, fout):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range недоступен")
+    while True:
+        n = os.copy_file_range(fin, fout, KERNEL_CHUNK)
+        if not n:
+            break
+        progress.advance(n)
+
+
+def _sendfile(fin, fout):
+    if not hasattr(os, "sendfile") or not sys.platform.startswith("linux"):
+        raise OSError(errno.ENOSYS, "sendfile недоступен")
+    offset = 0
+    while True:
+        sent = os.sendfile(fout, fin, offset, KERNEL_CHUNK)
+        if not sent:
+            break
+        offset += sent
+        progress.advance(sent)
+
+
+_STRATEGIES = [("reflink", _reflink), ("copy_file_range", _copy_file_range), ("sendfile", _sendfile)]
+
+
+def copy_file(src, dst):
+    # Копирует содержимое и возвращает использованную стратегию
+    if os.name != "nt":
+        with open(src, "rb") as fin, open(dst, "wb") as fout:
+            src_dev = os.fstat(fin.fileno()).st_dev
+            dst_dev = os.fstat(fout.fileno()).st_dev
+            for name, fn in _STRATEGIES:
+                key = (name, src_dev, dst_dev)
+                if key in _unsupported:
+                    continue
+                try:
+                    fn(fin.fileno(), fout.fileno())
+                    if name == "reflink":
+                        progress.advance(os.fstat(fin.fileno()).st_size)
+                    return name
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED:
+                        raise
+                    with _lock:
+                        _unsupported.add(key)
+                    os.lseek(fin.fileno(), 0, os.SEEK_SET)
+                    os.ftruncate(fout.fileno(), 0)
+                    os.lseek(fout.fileno(), 0, os.SEEK_SET)
+    shutil.copyfile(src, dst)
+    progress.advance(os.path.getsize(dst))
+    return "copy"
+
+
+def copy2(src, dst, stats=None):
+    # Аналог shutil.copy2, но через быстрые стратегии; stats — Counter по стратегиям
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    with metrics.phase("copy"):
+        strategy = copy_file(src, dst)
+    shutil.copystat(src, dst)
+    if stats is not None:
+        stats[strategy] += 1
+    return strategy
+
+
+def _hash_loop(fin, hasher, timings, fout=None):
+    # Время чтения, хеширования и записи копится локально и попадает в метрики одним вызовом
+    clock = time.perf_counter
+    while True:
+        t0 = clock()
+        block = fin.read(1024 * 1024)
+        t1 = clock()
+        if not block:
+            timings["read"] += t1 - t0
+            return
+        hasher.update(block)
+        t2 = clock()
+        if fout is not None:
+            fout.write(block)
+        t3 = clock()
+        timings["read"] += t1 - t0
+        timings["hash"] += t2 - t1
+        timings["write"] += t3 - t2
+        progress.advance(len(block))
+
+
+def _kernel_hashed(copy, fin, fout, hasher, timings):
+    # copy(fin, fout, смещение, n) → скопировано байт. Каждая порция сразу перечитывается из копии
+    # (она ещё в кеше страниц) и хешируется: хеш описывает ровно записанные данные, даже если
+    # источник меняется во время копирования, а данные не проходят через пользовательскую запись
+    clock = time.perf_counter
+    offset = 0
+    while True:
+        t0 = clock()
+        n = copy(fin, fout, offset, HASHED_CHUNK)
+        t1 = clock()
+        timings["copy"] += t1 - t0
+        if not n:
+            return
+        data = os.pread(fout, n, offset)
+        t2 = clock()
+        hasher.update(data)
+        timings["read"] += t2 - t1
+        timings["hash"] += clock() - t2
+        offset += n
+        progress.advance(n)
+
+
+_HASHED_STRATEGIES = []
+if hasattr(os, "copy_file_range"):
+    _HASHED_STRATEGIES.append(("copy_file_range", lambda fin, fout, offset, n: os.copy_file_range(fin, fout, n)))
+if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+    _HASHED_STRATEGIES.append(("sendfile", lambda fin, fout, offset, n: os.sendfile(fout, fin, offset, n)))
+
+
+def copy2_hashed(src, dst, hasher, stats=None):
+    # Копирование с подсчётом хеша за один проход чтения источника. Reflink не пишет данные,
+    # поэтому после клонирования источник читается один раз только ради хеша; copy_file_range
+    # и sendfile копируют в ядре, а хеш считается по копии (см. _kernel_hashed); иначе —
+    # обычный цикл чтения/записи.
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    strategy = None
+    timings = Counter()
+    clock = time.perf_counter
+    with open(src, "rb") as fin:
+        with open(dst, "w+b") as fout:
+            devs = (os.fstat(fin.fileno()).st_dev, os.fstat(fout.fileno()).st_dev)
+            if fcntl is not None:
+                key = ("reflink",) + devs
+                if key not in _unsupported:
+                    try:
+                        t = clock()
+                        _reflink(fin.fileno(), fout.fileno())
+                        timings["copy"] += clock() - t
+                        strategy = "reflink+hash"
+                    except OSError as e:
+                        if e.errno not in _UNSUPPORTED:
+                            raise
+                        with _lock:
+                            _unsupported.add(key)
+            for name, copy in _HASHED_STRATEGIES if strategy is None else ():
+                key = (name,) + devs
+                if key in _unsupported:
+                    continue
+                try:
+                    _kernel_hashed(copy, fin.fileno(), fout.fileno(), hasher, timings)
+                    strategy = name + "+hash"
+                    break
+                except OSError as e:
+                    # Откат возможен, только пока ничего не записано (и не попало в хеш)
+                    if e.errno not in _UNSUPPORTED or os.lseek(fout.fileno(), 0, os.SEEK_CUR):
+                        raise
+                    with _lock:
+                        _unsupported.add(key)
+                    os.lseek(fin.fileno(), 0, os.SEEK_SET)
+            if strategy is None:
+                _hash_loop(fin, hasher, timings, fout)
+                strategy = "copy+hash"
+        if strategy == "reflink+hash":
+            _hash_loop(fin, hasher, timings)
+    shutil.copystat(src, dst)
+    op = metrics.current()
+    if op is not None:
+        for phase, seconds in timings.items():
+            op.add_phase(phase, seconds)
+    if stats is not None:
+        stats[strategy] += 1
+    return strategy
+
+
+def copytree(src, dst, stats=None):
+    def copy_function(s, d):
+        copy2(s, d, stats)
+        return d
+    return shutil.copytree(src, dst, dirs_exist_ok=True, copy_function=copy_function)
+
+
+def format_stats(stats):
+    return ", ".join(f"{name}: {n}" for name, n in stats.most_common())
+
+
+def new_stats():
+    return Counter()
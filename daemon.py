@@ -0,0 +1,330 @@
+import os, json, time, errno, select, struct, ctypes, ctypes.util, hashlib
+from backup_engine import log, expand
+from tree_walk import iter_tree, TreeFilter
+from progress import CancelToken
+
+# Фоновый режим: копии по изменениям. Изменения в папках и файлах плагинов отслеживаются
+# через inotify (Linux), а где его нет или не хватило лимита наблюдений — периодическим
+# обходом со сравнением отпечатков. События одного приложения склеиваются: копия начинается,
+# когда данные QUIET секунд не менялись, но не позже MAX_DELAY с первого изменения (профиль
+# браузера пишет постоянно) и не чаще раза в INTERVAL. Перед запуском отпечаток сверяется
+# с последней копией, так что временные файлы, созданные и удалённые, копию не вызывают.
+# Плагин может переопределить сроки: "schedule": {"quiet": 30, "max_delay": 600, "interval": 900}.
+QUIET = 120
+MAX_DELAY = 1800
+INTERVAL = 1800
+SWEEP = 300
+TICK = 1.0
+STATE_PATH = os.path.join("Backup", ".daemon.json")
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF)
+_EVENT = struct.Struct("iIII")   # wd, mask, cookie, длина имени
+
+
+def _roots(data):
+    # (путь, папка ли) для существующих источников плагина
+    out = []
+    for f in data.get("files", []):
+        if os.path.isfile(expand(f)):
+            out.append((os.path.abspath(expand(f)), False))
+    for d in data.get("folders", []):
+        if os.path.isdir(expand(d)):
+            out.append((os.path.abspath(expand(d)), True))
+    return out
+
+
+def fingerprint(data):
+    # Отпечаток данных приложения: пути, размеры и mtime_ns с учётом фильтров плагина
+    h = hashlib.blake2b(digest_size=16)
+    tree_filter = TreeFilter.from_plugin(data)
+    for root, is_dir in _roots(data):
+        if not is_dir:
+            st = os.stat(root)
+            h.update(f"{root}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8", "surrogateescape"))
+            continue
+        try:
+            items = sorted((key, st.st_size, st.st_mtime_ns) for _, key, st in iter_tree(root, root, tree_filter))
+        except OSError:
+            continue
+        for key, size, mtime_ns in items:
+            h.update(f"{key}\0{size}\0{mtime_ns}\n".encode("utf-8", "surrogateescape"))
+    return h.hexdigest()
+
+
+def _ignored(tree_filter, rel):
+    # Событие внутри исключённого каталога или в неподходящем файле (кэш браузера и т.п.)
+    if tree_filter is None:
+        return False
+    parts = rel.split("/")
+    for i in range(1, len(parts)):
+        if tree_filter.exclude and tree_filter.exclude("/".join(parts[:i])):
+            return True
+    return ((tree_filter.exclude and tree_filter.exclude(rel))
+            or (tree_filter.include and not tree_filter.include(rel)))
+
+
+def _libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class InotifyWatcher:
+    # Наблюдение за каталогами через inotify; исключённые каталоги не наблюдаются вовсе.
+    # Приложения, которые не удалось поставить на наблюдение, возвращаются в failed.
+    def __init__(self, apps):
+        self._libc = _libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, "inotify недоступен")
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._dirs = {}
+        self._wds = {}
+        self._targets = []
+        self.failed = set()
+        for app, data in apps.items():
+            tree_filter = TreeFilter.from_plugin(data)
+            try:
+                for root, is_dir in _roots(data):
+                    self._targets.append((app, root, is_dir, tree_filter))
+                    if is_dir:
+                        self._watch_tree(root, root, tree_filter)
+                    else:
+                        self._watch(os.path.dirname(root))
+            except OSError as e:
+                log(f"[DAEMON] {app}: наблюдение недоступно ({e}), будет периодический обход")
+                self.failed.add(app)
+
+    def _watch(self, path):
+        if path in self._wds:
+            return
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return
+            # ENOSPC — исчерпан fs.inotify.max_user_watches
+            raise OSError(err, os.strerror(err), path)
+        self._dirs[wd] = path
+        self._wds[path] = wd
+
+    def _watch_tree(self, path, root, tree_filter):
+        stack = [path]
+        while stack:
+            folder = stack.pop()
+            self._watch(folder)
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            rel = os.path.relpath(entry.path, root).replace(os.sep, "/")
+                            if tree_filter is None or not (tree_filter.exclude and tree_filter.exclude(rel)):
+                                stack.append(entry.path)
+            except OSError:
+                continue
+
+    def _apps_for(self, path):
+        out = set()
+        for app, root, is_dir, tree_filter in self._targets:
+            if not is_dir:
+                if path == root:
+                    out.add(app)
+            elif path == root or path.startswith(root + os.sep):
+                if path == root or not _ignored(tree_filter, os.path.relpath(path, root).replace(os.sep, "/")):
+                    out.add(app)
+        return out
+
+    def poll(self, timeout):
+        # → множество приложений с изменениями за время ожидания
+        readable, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+        if not readable:
+            return set()
+        changed = set()
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(buf):
+                wd, mask, _, length = _EVENT.unpack_from(buf, pos)
+                name = buf[pos + _EVENT.size:pos + _EVENT.size + length].rstrip(b"\0")
+                pos += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # Очередь переполнена — что изменилось, неизвестно
+                    changed.update(app for app, *_ in self._targets)
+                    continue
+                folder = self._dirs.get(wd)
+                if folder is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self._dirs[wd]
+                    self._wds.pop(folder, None)
+                    continue
+                path = os.path.join(folder, os.fsdecode(name)) if name else folder
+                apps = self._apps_for(path)
+                changed |= apps
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    for app, root, is_dir, tree_filter in self._targets:
+                        if app in apps and is_dir:
+                            try:
+                                self._watch_tree(path, root, tree_filter)
+                            except OSError as e:
+                                log(f"[DAEMON] {app}: наблюдение недоступно ({e}), будет периодический обход")
+                                self.failed.add(app)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class BackupDaemon:
+    # apps — {имя: данные плагина}; run(список имён) выполняет копии и возвращает результаты по
+    # именам: None — копия не удалась или отменена, отпечаток не сохраняется и копия повторится
+    def __init__(self, apps, run, token=None, sweep=SWEEP, state_path=STATE_PATH, watch=True):
+        self.apps = apps
+        self.run_backup = run
+        self.token = token or CancelToken()
+        self.sweep_every = sweep
+        self.state_path = state_path
+        self.use_watch = watch
+        self.state = self._load()
+        self.pending = {}
+        self.watcher = None
+        self.swept = set()
+        self._fingerprints = {}
+        self._next_sweep = 0.0
+
+    def _load(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.state_path)
+
+    def _schedule(self, app):
+        schedule = self.apps[app].get("schedule", {})
+        return (schedule.get("quiet", QUIET), schedule.get("max_delay", MAX_DELAY),
+                schedule.get("interval", INTERVAL))
+
+    def mark(self, app, now):
+        first, _ = self.pending.get(app, (now, now))
+        self.pending[app] = (first, now)
+
+    def due(self, app, now):
+        # Время ближайшего запуска для приложения с изменениями
+        first, last = self.pending[app]
+        quiet, max_delay, interval = self._schedule(app)
+        ready = min(last + quiet, first + max_delay)
+        return max(ready, self.state.get(app, {}).get("last_run", 0) + interval)
+
+    def start(self):
+        # Изменения, накопившиеся пока фоновый режим не работал, — по отпечатку прошлой копии
+        now = time.time()
+        if self.use_watch:
+            try:
+                self.watcher = InotifyWatcher(self.apps)
+                self.swept = set(self.watcher.failed)
+            except OSError as e:
+                log(f"[DAEMON] inotify недоступен ({e}), изменения ищутся обходом раз в {self.sweep_every} с")
+        if self.watcher is None:
+            self.swept = set(self.apps)
+        for app in self.apps:
+            self._fingerprints[app] = fingerprint(self.apps[app])
+            if self._fingerprints[app] != self.state.get(app, {}).get("fingerprint"):
+                self.pending[app] = (now - MAX_DELAY, now - MAX_DELAY)
+        self._next_sweep = now + self.sweep_every
+        log(f"[DAEMON] Наблюдение за {len(self.apps)} приложениями"
+            f"{f', обходом: {len(self.swept)}' if self.swept and self.watcher else ''}; изменено: {len(self.pending)}")
+
+    def sweep(self):
+        changed = set()
+        for app in self.swept:
+            fp = fingerprint(self.apps[app])
+            if fp != self._fingerprints.get(app):
+                self._fingerprints[app] = fp
+                changed.add(app)
+        return changed
+
+    def step(self):
+        # Одна итерация: ждём события не дольше, чем до ближайшего запуска, и запускаем готовые
+        now = time.time()
+        wake = min([self.due(app, now) for app in self.pending] + [self._next_sweep if self.swept else now + TICK])
+        timeout = min(TICK, max(0.0, wake - now))
+        if self.watcher is not None:
+            changed = self.watcher.poll(timeout)
+            self.swept |= self.watcher.failed
+        else:
+            self.token.wait(timeout)
+            changed = set()
+        now = time.time()
+        if self.swept and now >= self._next_sweep:
+            changed |= self.sweep()
+            self._next_sweep = now + self.sweep_every
+        for app in changed:
+            self.mark(app, now)
+        ready = sorted(app for app in self.pending if self.due(app, now) <= now)
+        if ready:
+            self.run(ready)
+
+    def run(self, ready):
+        # Отпечаток снимается до копии: изменения во время копирования вызовут следующую
+        now = time.time()
+        todo, fps = [], {}
+        for app in ready:
+            fps[app] = fingerprint(self.apps[app])
+            if fps[app] == self.state.get(app, {}).get("fingerprint"):
+                del self.pending[app]
+            else:
+                todo.append(app)
+        if not todo:
+            return
+        log(f"[DAEMON] Изменения: {', '.join(todo)}")
+        results = self.run_backup(todo)
+        for app, result in zip(todo, results):
+            entry = self.state.setdefault(app, {})
+            entry["last_run"] = now
+            if result is None:
+                # Задание упало или отменено — повтор не раньше чем через interval
+                continue
+            del self.pending[app]
+            entry["fingerprint"] = fps[app]
+            self._fingerprints[app] = fps[app]
+        self._save()
+
+    def serve(self):
+        self.start()
+        try:
+            while not self.token.cancelled:
+                self.step()
+        finally:
+            if self.watcher is not None:
+                self.watcher.close()
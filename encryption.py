@@ -0,0 +1,114 @@
+import io, os, hmac, json, hashlib
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.exceptions import InvalidTag
+except ImportError:
+    Cipher = None
+
+# Шифрование членов архива: AES-256-GCM, свой случайный nonce на каждый член, имя члена —
+# дополнительные аутентифицируемые данные (члены нельзя подменить местами). Ключ один на
+# архив: scrypt от пароля или содержимого ключевого файла с солью архива; параметры и соль
+# лежат открыто в первом члене KEY_NAME. Данные члена: nonce + шифротекст + тег.
+# Шифруются уже сжатые блоки в том же проходе, где они пишутся, поэтому лишнего чтения
+# нет, а каждый член по-прежнему читается отдельно. Имена файлов остаются открытыми, как в ZIP.
+# В ZIP такие члены помечены своим методом archive_index.ZIP_ENCRYPTED (не битом ZipCrypto)
+# с CRC 0 — целостность проверяет только тег GCM.
+KEY_NAME = ".backupapp-key"
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+NONCE_SIZE = 12
+TAG_SIZE = 16
+AVAILABLE = Cipher is not None
+
+
+class PassphraseError(ValueError):
+    pass
+
+
+def load_secret(passphrase=None, keyfile=None):
+    if keyfile:
+        with open(keyfile, "rb") as f:
+            return f.read()
+    if passphrase:
+        return passphrase.encode("utf-8")
+    raise PassphraseError("не задан пароль или ключевой файл")
+
+
+def _derive(secret, params):
+    return hashlib.scrypt(secret, salt=bytes.fromhex(params["salt"]), n=params["n"], r=params["r"], p=params["p"],
+                          maxmem=256 * 1024 * 1024, dklen=32)
+
+
+def _check(key):
+    return hmac.new(key, b"backupapp-key-check", hashlib.sha256).hexdigest()[:16]
+
+
+class ArchiveKey:
+    def __init__(self, key, params):
+        if not AVAILABLE:
+            raise RuntimeError("Для шифрования нужен пакет cryptography")
+        self.key = key
+        self.params = params
+
+    @classmethod
+    def create(cls, secret):
+        params = {"cipher": "aes-256-gcm", "kdf": "scrypt", "n": SCRYPT_N, "r": SCRYPT_R, "p": SCRYPT_P,
+                  "salt": os.urandom(16).hex()}
+        key = _derive(secret, params)
+        params["check"] = _check(key)
+        return cls(key, params)
+
+    @classmethod
+    def open(cls, secret, header):
+        params = json.loads(header)
+        key = _derive(secret, params)
+        if not hmac.compare_digest(_check(key), params["check"]):
+            raise PassphraseError("неверный пароль или ключевой файл")
+        return cls(key, params)
+
+    def header(self):
+        return json.dumps(self.params).encode("utf-8")
+
+    def encryptor(self, name):
+        # → (nonce, encryptor); после данных: encryptor.finalize() + encryptor.tag
+        nonce = os.urandom(NONCE_SIZE)
+        enc = Cipher(algorithms.AES(self.key), modes.GCM(nonce)).encryptor()
+        enc.authenticate_additional_data(name)
+        return nonce, enc
+
+    def decryptor(self, name, nonce, tag):
+        dec = Cipher(algorithms.AES(self.key), modes.GCM(nonce, tag)).decryptor()
+        dec.authenticate_additional_data(name)
+        return dec
+
+
+class DecryptReader(io.RawIOBase):
+    # Тег проверяется при дочитывании: до этого данные не считаются подлинными,
+    # поэтому восстановление пишет их во временный файл и заменяет цель только в конце
+    def __init__(self, raw, decryptor, name):
+        self._raw = raw
+        self._dec = decryptor
+        self._name = name
+        self._buf = b""
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf and not self._done:
+            data = self._raw.read(len(b))
+            if data:
+                self._buf = self._dec.update(data)
+                continue
+            try:
+                self._buf = self._dec.finalize()
+            except InvalidTag:
+                raise OSError(f"данные повреждены или ключ не подходит: {self._name}") from None
+            self._done = True
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
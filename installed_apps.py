@@ -0,0 +1,199 @@
+import os, re, json
+
+CACHE_PATH = os.path.join("Config", "installed_apps.cache")
+
+UNINSTALL_KEYS = [
+    ("HKEY_LOCAL_MACHINE", r"SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall"),
+    ("HKEY_CURRENT_USER", r"SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall"),
+    ("HKEY_LOCAL_MACHINE", r"SOFTWARE\WOW6432Node\Microsoft\Windows\CurrentVersion\Uninstall"),
+]
+APP_PATHS_KEY = ("HKEY_CURRENT_USER", r"SOFTWARE\Microsoft\Windows\CurrentVersion\App Paths")
+
+# Синонимы: нормализованное имя плагина → другие варианты DisplayName / App Paths.
+# Группа работает в обе стороны: плагин "Chrome" найдёт установленный "Google Chrome"
+ALIASES = {
+    "google chrome": ["chrome"],
+    "mozilla firefox": ["firefox"],
+    "microsoft edge": ["msedge", "edge"],
+    "brave": ["brave browser", "brave-browser"],
+    "opera": ["opera stable", "opera browser"],
+    "visual studio code": ["microsoft visual studio code", "vscode", "code"],
+    "telegram": ["telegram desktop"],
+    "whatsapp desktop": ["whatsapp"],
+    "notepad++": ["notepad++ 64-bit", "notepad++ 32-bit"],
+    "sublime text 3": ["sublime text", "sublime_text"],
+    "intellij idea": ["intellij idea community edition", "intellij idea ultimate", "idea64"],
+    "pycharm": ["pycharm community edition", "pycharm professional", "pycharm64"],
+    "git": ["git for windows"],
+    "node.js": ["node", "nodejs"],
+    "epic games launcher": ["epicgameslauncher"],
+    "gog galaxy": ["gog galaxy 2.0", "galaxyclient"],
+    "obs studio": ["obs", "obs64"],
+    "vlc": ["vlc media player"],
+    "adobe reader": ["adobe acrobat reader dc", "adobe acrobat reader", "acrord32"],
+    "paint.net": ["paintdotnet"],
+    "total commander": ["total commander 64-bit", "totalcmd64", "totalcmd"],
+    "keepassxc": ["keepassxc password manager"],
+    "battle.net": ["battle net"],
+}
+
+# Компоненты, названные по программе, но программой не являющиеся:
+# "Microsoft Edge WebView2 Runtime", "Microsoft Edge Update", "... Redistributable"
+EXCLUDED_WORDS = {"runtime", "redistributable", "redist", "webview2", "update", "updater", "sdk"}
+
+_NOISE = re.compile(r"\((?:[^)]*)\)|\b(?:x64|x86|64-bit|32-bit|amd64|version)\b|\bv?\d+(?:\.\d+)+\b|[®™©]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(name):
+    name = _NOISE.sub(" ", name.lower())
+    return _SPACES.sub(" ", name).strip(" -_")
+
+
+def _candidates(key):
+    # → [(основное имя группы, вариант)] для нормализованного имени плагина
+    for canonical, aliases in ALIASES.items():
+        if key == canonical or key in aliases:
+            return [(canonical, name) for name in [canonical] + aliases]
+    return [(key, key)]
+
+
+class WinregBackend:
+    def __init__(self):
+        import winreg
+        self.winreg = winreg
+
+    def _open(self, hive, path):
+        return self.winreg.OpenKey(getattr(self.winreg, hive), path)
+
+    def last_write(self, hive, path):
+        with self._open(hive, path) as key:
+            return self.winreg.QueryInfoKey(key)[2]
+
+    def display_names(self, hive, path):
+        names = []
+        with self._open(hive, path) as main:
+            for i in range(self.winreg.QueryInfoKey(main)[0]):
+                try:
+                    sub = self.winreg.EnumKey(main, i)
+                    with self.winreg.OpenKey(main, sub) as k:
+                        names.append(self.winreg.QueryValueEx(k, "DisplayName")[0])
+                except OSError:
+                    # У многих подключей нет DisplayName — это не ошибка
+                    continue
+        return names
+
+    def subkeys(self, hive, path):
+        with self._open(hive, path) as key:
+            return [self.winreg.EnumKey(key, i) for i in range(self.winreg.QueryInfoKey(key)[0])]
+
+
+class FileRegistryBackend:
+    # Фальшивый реестр из JSON для Linux, тестов и бенчмарков:
+    # {"HKEY_CURRENT_USER\\SOFTWARE\\...\\Uninstall": {"last_write": 1, "keys": {"sub": {"DisplayName": "..."}}}}
+    def __init__(self, path):
+        self.path = path
+        with open(path, "r", encoding="utf-8") as f:
+            self.data = json.load(f)
+
+    def _key(self, hive, path):
+        try:
+            return self.data[f"{hive}\\{path}"]
+        except KeyError:
+            raise FileNotFoundError(f"{hive}\\{path}")
+
+    def last_write(self, hive, path):
+        return self._key(hive, path).get("last_write", os.stat(self.path).st_mtime_ns)
+
+    def display_names(self, hive, path):
+        return [v["DisplayName"] for v in self._key(hive, path).get("keys", {}).values() if "DisplayName" in v]
+
+    def subkeys(self, hive, path):
+        return list(self._key(hive, path).get("keys", {}))
+
+
+def default_backend():
+    try:
+        return WinregBackend()
+    except ImportError:
+        path = os.environ.get("BACKUPAPP_REGISTRY")
+        return FileRegistryBackend(path) if path else None
+
+
+class InstalledAppIndex:
+    def __init__(self, backend=None, cache_path=CACHE_PATH):
+        self.backend = backend if backend is not None else default_backend()
+        self.cache_path = cache_path
+        self.names = set()
+        self.errors = []
+        self._lookup = None
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, cache):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            tmp = self.cache_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            self.errors.append(f"cache: {e}")
+
+    def load(self):
+        # Куст перечитывается только если изменилось его время последней записи
+        self.names, self.errors, self._lookup = set(), [], None
+        if self.backend is None:
+            return self
+        cache = self._read_cache()
+        fresh = {}
+        for hive, path in UNINSTALL_KEYS + [APP_PATHS_KEY]:
+            key = f"{hive}\\{path}"
+            try:
+                stamp = self.backend.last_write(hive, path)
+                hit = cache.get(key)
+                if hit and hit["last_write"] == stamp:
+                    names = hit["names"]
+                elif (hive, path) == APP_PATHS_KEY:
+                    names = [os.path.splitext(s)[0] for s in self.backend.subkeys(hive, path)]
+                else:
+                    names = self.backend.display_names(hive, path)
+                fresh[key] = {"last_write": stamp, "names": names}
+                self.names.update(names)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                self.errors.append(f"{key}: {e}")
+        if fresh != cache:
+            self._write_cache(fresh)
+        return self
+
+    def _build_lookup(self):
+        # → (имена целиком, префиксы из целых слов): "mozilla firefox esr" даёт префиксы
+        # "mozilla", "mozilla firefox", "mozilla firefox esr"; служебные компоненты пропускаются
+        exact, prefixes = set(), set()
+        for name in self.names:
+            words = normalize(name).split(" ")
+            if EXCLUDED_WORDS.intersection(words):
+                continue
+            exact.add(" ".join(words))
+            for i in range(1, len(words) + 1):
+                prefixes.add(" ".join(words[:i]))
+        return exact, prefixes
+
+    def is_installed(self, plugin_name):
+        # Имена из нескольких слов сравниваются по префиксу из целых слов ("sublime text" —
+        # "Sublime Text Build 4169"), однословные синонимы вроде "code" или "edge" — только целиком
+        if self._lookup is None:
+            self._lookup = self._build_lookup()
+        exact, prefixes = self._lookup
+        return any(name in (prefixes if " " in name or name == canonical else exact)
+                   for canonical, name in _candidates(normalize(plugin_name)))
+
+    def match(self, plugin_names):
+        return {name for name in plugin_names if self.is_installed(name)}
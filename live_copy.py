@@ -0,0 +1,219 @@
+import os, time, shutil, sqlite3, threading, urllib.request
+from contextlib import closing
+from types import SimpleNamespace
+
+# Согласованные копии баз, открытых работающими программами.
+# SQLite копируется через online backup API (страницы читаются порциями, писатель
+# не блокируется надолго); если база заблокирована эксклюзивно — файлы копируются
+# вместе с -wal/-journal до стабильного состояния, и WAL сливается в копию.
+# Каталог LevelDB (CURRENT + MANIFEST-*) копируется целиком с повтором, пока
+# набор файлов не перестанет меняться между началом и концом прохода.
+STAGING_DIR = os.path.join("Backup", ".staging")
+SQLITE_HEADER = b"SQLite format 3\x00"
+SQLITE_EXTENSIONS = {"", ".db", ".db3", ".sqlite", ".sqlite3", ".sqlitedb"}
+SIDECARS = ("-wal", "-shm", "-journal")
+SQLITE_PAGES = 1024
+SQLITE_TIMEOUT = 1  # эксклюзивная блокировка не снимется, ждать её дольше бессмысленно
+RETRIES = 5
+
+
+def is_sqlite(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(16) == SQLITE_HEADER
+    except OSError:
+        return False
+
+
+def is_sqlite_candidate(name):
+    return os.path.splitext(name)[1].lower() in SQLITE_EXTENSIONS
+
+
+def sidecar_of(name):
+    # "History-wal" → "History"; None, если это не служебный файл SQLite
+    for suffix in SIDECARS:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return None
+
+
+def is_leveldb(names):
+    return "CURRENT" in names and any(n.startswith("MANIFEST-") for n in names)
+
+
+def drop_sidecars(path):
+    # Перед заменой базы восстановленной копией: чужой -wal испортил бы её при открытии
+    for suffix in SIDECARS:
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _stable_copy(pairs, errors=None):
+    # Копирует (src, dst) до тех пор, пока метаданные источников не совпадут до и после прохода.
+    # Неизменившиеся с прошлой попытки файлы повторно не копируются. True — копия согласована.
+    # errors — словарь src → ошибка: нечитаемые файлы пропускаются (без него ошибка прерывает копирование)
+    copied = {}
+    for _ in range(RETRIES):
+        before = {src: _stat_key(src) for src, _ in pairs}
+        for src, dst in pairs:
+            if before[src] is None:
+                copied.pop(src, None)
+                if os.path.exists(dst):
+                    os.remove(dst)
+            elif copied.get(src) != before[src]:
+                try:
+                    shutil.copy2(src, dst)
+                except OSError as e:
+                    if errors is None:
+                        raise
+                    errors[src] = e
+                    copied.pop(src, None)
+                    if os.path.exists(dst):
+                        os.remove(dst)
+                    continue
+                if errors is not None:
+                    errors.pop(src, None)
+                copied[src] = before[src]
+        if before == {src: _stat_key(src) for src, _ in pairs}:
+            return True
+    return False
+
+
+def _staged_stat(staged, source_st, source_size):
+    # stat копии, но с inode источника: для инкрементального индекса это тот же файл;
+    # st_source — размер источника, по нему следующий запуск решает, нужна ли новая копия
+    st = os.stat(staged)
+    return SimpleNamespace(st_size=st.st_size, st_mtime=st.st_mtime, st_mtime_ns=st.st_mtime_ns,
+                           st_mode=st.st_mode, st_ino=source_st.st_ino, st_dev=source_st.st_dev,
+                           st_source=source_size)
+
+
+def _source_stat(path, st):
+    # База вместе с WAL: размер и mtime, которые станут mtime согласованной копии
+    size, mtime_ns = st.st_size, st.st_mtime_ns
+    try:
+        wal = os.stat(path + "-wal")
+        size += wal.st_size
+        mtime_ns = max(mtime_ns, wal.st_mtime_ns)
+    except FileNotFoundError:
+        pass
+    return SimpleNamespace(st_size=size, st_mtime_ns=mtime_ns, st_ino=st.st_ino)
+
+
+class LiveStaging:
+    # Временный каталог для согласованных копий одного задания; удаляется в cleanup()
+    def __init__(self, app, root=STAGING_DIR):
+        self.path = os.path.join(root, f"{app}.{os.getpid()}.{threading.get_ident()}")
+        self.warnings = []
+        self.sqlite = 0
+        self.leveldb = 0
+        self.unchanged = 0
+        self._n = 0
+
+    def _new_dir(self):
+        self._n += 1
+        path = os.path.join(self.path, str(self._n))
+        os.makedirs(path)
+        return path
+
+    def prepare_file(self, path, st, key=None, unchanged=None):
+        # → (путь, stat) для копирования: база SQLite заменяется согласованной копией.
+        # unchanged(key, stat источника) → stat прошлой копии, если потребитель файл пропустит;
+        # тогда база не копируется вовсе
+        name = os.path.basename(path)
+        if not (is_sqlite_candidate(name) and st.st_size >= 100 and is_sqlite(path)):
+            return path, st
+        source = _source_stat(path, st)
+        if unchanged is not None:
+            prev = unchanged(key, source)
+            if prev is not None:
+                self.unchanged += 1
+                return path, prev
+        staged = os.path.join(self._new_dir(), name)
+        try:
+            try:
+                self._sqlite_backup(path, staged)
+            except sqlite3.Error:
+                for suffix in SIDECARS:
+                    if os.path.exists(staged + suffix):
+                        os.remove(staged + suffix)
+                self._sqlite_raw(path, staged)
+        except (OSError, sqlite3.Error) as e:
+            self.warnings.append(f"[WARN] Не удалось снять согласованную копию {path}: {e}")
+            return path, st
+        # mtime копии — самый поздний из базы и её WAL, чтобы инкрементальный индекс видел изменения в WAL
+        os.utime(staged, ns=(source.st_mtime_ns, source.st_mtime_ns))
+        self.sqlite += 1
+        return staged, _staged_stat(staged, st, source.st_size)
+
+    @staticmethod
+    def _sqlite_backup(src, dst):
+        # sqlite3.backup сам повторяет шаг при SQLITE_BUSY бесконечно — ограничиваем через progress
+        uri = "file:" + urllib.request.pathname2url(os.path.abspath(src)) + "?mode=ro"
+        deadline = time.monotonic() + SQLITE_TIMEOUT
+
+        def progress(status, remaining, total):
+            if status in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED) and time.monotonic() > deadline:
+                raise sqlite3.OperationalError("database is locked")
+
+        with closing(sqlite3.connect(uri, uri=True, timeout=SQLITE_TIMEOUT)) as source, \
+                closing(sqlite3.connect(dst)) as target:
+            source.backup(target, pages=SQLITE_PAGES, progress=progress, sleep=0.005)
+
+    def _sqlite_raw(self, src, dst):
+        pairs = [(src, dst)] + [(src + s, dst + s) for s in ("-wal", "-journal") if os.path.exists(src + s)]
+        if not _stable_copy(pairs):
+            self.warnings.append(f"[WARN] База менялась во время копирования: {src}")
+        # Открытие копии откатывает горячий журнал, checkpoint переносит WAL в основной файл
+        with closing(sqlite3.connect(dst)) as db:
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        for suffix in SIDECARS:
+            if os.path.exists(dst + suffix):
+                os.remove(dst + suffix)
+
+    def stage_leveldb(self, folder, entries, key=None, unchanged=None):
+        # entries — DirEntry файлов каталога; → [(путь копии, имя, stat)].
+        # Если все файлы потребитель пропустит (см. prepare_file), каталог не копируется.
+        # LOCK — файл блокировки работающей программы (в Windows открыт эксклюзивно), в копии он не нужен
+        entries = [e for e in entries if e.name != "LOCK"]
+        if unchanged is not None and entries:
+            prev = [unchanged(f"{key}/{e.name}", e.stat()) for e in entries]
+            if all(p is not None for p in prev):
+                self.unchanged += 1
+                return [(e.path, e.name, p) for e, p in zip(entries, prev)]
+        staged_dir = self._new_dir()
+        pairs = [(e.path, os.path.join(staged_dir, e.name)) for e in entries]
+        errors = {}
+        if not _stable_copy(pairs, errors):
+            self.warnings.append(f"[WARN] LevelDB менялась во время копирования: {folder}")
+        for src, e in errors.items():
+            self.warnings.append(f"[WARN] Файл LevelDB не скопирован {src}: {e}")
+        self.leveldb += 1
+        out = []
+        for entry, (src, dst) in zip(entries, pairs):
+            if os.path.exists(dst):
+                out.append((dst, entry.name, _staged_stat(dst, entry.stat(), entry.stat().st_size)))
+        return out
+
+    def summary(self):
+        return f"SQLite {self.sqlite}, LevelDB {self.leveldb}, без изменений {self.unchanged}"
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+        return False
@@ -0,0 +1,83 @@
+import os, json, time, hashlib
+
+# Манифест резервной копии: путь внутри копии → размер, mtime_ns и хеш содержимого.
+# Хеши считаются во время копирования/сжатия, без отдельного прохода чтения.
+HASH_ALGO = "blake2b"
+BUF_SIZE = 1024 * 1024
+
+
+def new_hash(algo=HASH_ALGO):
+    if algo == "blake2b":
+        return hashlib.blake2b(digest_size=32)
+    return hashlib.new(algo)
+
+
+def hash_file(path, algo=HASH_ALGO):
+    h = new_hash(algo)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BUF_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def manifest_path(target):
+    # Backup/<app> → Backup/<app>.manifest.json, Backup/<app>_backup.zip → ...zip.manifest.json
+    return target.rstrip("/\\") + ".manifest.json"
+
+
+def load_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def latest_copy(app, root="Backup"):
+    # Распакованная копия Backup/<app> и архив могут лежать рядом (режим копирования менялся):
+    # действует та, чей манифест новее; без манифеста — по времени изменения
+    candidates = []
+    for target in (os.path.join(root, app), os.path.join(root, f"{app}_backup.zip")):
+        if os.path.exists(target):
+            manifest = load_manifest(manifest_path(target))
+            created = manifest.get("created") if manifest else None
+            candidates.append((created if created is not None else os.path.getmtime(target), target))
+    return max(candidates)[1] if candidates else None
+
+
+class BackupManifest:
+    def __init__(self, target, algo=HASH_ALGO):
+        self.path = manifest_path(target)
+        self.algo = algo
+        self.files = {}
+        previous = load_manifest(self.path)
+        self.previous = previous["files"] if previous and previous.get("algo") == algo else {}
+
+    def add(self, key, size, mtime_ns, digest):
+        # digest=None — содержимое не хешируется (зашифрованный архив): сверяются только размер и mtime
+        entry = {"size": size, "mtime_ns": mtime_ns}
+        if digest is not None:
+            entry["digest"] = digest
+        self.files[key] = entry
+
+    def carry(self, key, st, existing):
+        # Файл не копировался: берём хеш из прошлого манифеста, иначе читаем готовую копию
+        prev = self.previous.get(key)
+        if prev and prev["size"] == st.st_size and prev["mtime_ns"] == st.st_mtime_ns:
+            self.files[key] = prev
+        else:
+            self.add(key, st.st_size, st.st_mtime_ns, hash_file(existing, self.algo))
+
+    def retain(self, key):
+        # key — файл или каталог, тогда переносится всё под ним
+        prefix = key + "/"
+        for k, v in self.previous.items():
+            if k == key or k.startswith(prefix):
+                self.files[k] = v
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"algo": self.algo, "created": time.time(), "files": self.files}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
@@ -0,0 +1,144 @@
+import os, json, time, heapq, threading
+from collections import Counter
+from contextlib import contextmanager
+
+# Метрики операций: файлы, байты, время по фазам и самые медленные файлы.
+# Активная операция хранится в thread-local; пулы потоков движков получают её явно.
+# Время фаз суммируется по всем потокам, поэтому может быть больше общего времени.
+REPORT_DIR = "Logs"
+PHASES = ("stat", "read", "write", "copy", "compress", "encrypt", "hash", "upload")
+SLOWEST = 10
+
+_current = threading.local()
+
+
+class OpMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.files = 0
+        self.bytes = 0
+        self.phases = Counter()
+        self.slowest = []
+        self.started = time.perf_counter()
+        self.wall = None
+        self._lock = threading.Lock()
+
+    def add_phase(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] += seconds
+
+    def add_file(self, path, size, seconds):
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+            item = (seconds, size, path)
+            if len(self.slowest) < SLOWEST:
+                heapq.heappush(self.slowest, item)
+            elif item > self.slowest[0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def finish(self):
+        self.wall = time.perf_counter() - self.started
+
+    def throughput(self):
+        wall = self.wall if self.wall is not None else time.perf_counter() - self.started
+        return self.bytes / wall / 1e6 if wall > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "files": self.files,
+            "bytes": self.bytes,
+            "wall_s": round(self.wall or 0.0, 4),
+            "throughput_mb_s": round(self.throughput(), 2),
+            "phases_s": {p: round(self.phases[p], 4) for p in PHASES if p in self.phases},
+            "slowest": [{"path": p, "size": s, "seconds": round(t, 4)} for t, s, p in sorted(self.slowest, reverse=True)],
+        }
+
+
+def current():
+    return getattr(_current, "op", None)
+
+
+@contextmanager
+def track(op):
+    # Делает op текущей операцией потока на время блока
+    previous = current()
+    _current.op = op
+    try:
+        yield op
+    finally:
+        _current.op = previous
+
+
+@contextmanager
+def phase(name, op=None):
+    op = op or current()
+    if op is None:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        op.add_phase(name, time.perf_counter() - t)
+
+
+def record_file(path, size, seconds, op=None):
+    op = op or current()
+    if op is not None:
+        op.add_file(path, size, seconds)
+
+
+class RunReport:
+    def __init__(self, mode):
+        self.mode = mode
+        self.created = time.time()
+        self.ops = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self, name):
+        op = OpMetrics(name)
+        with self._lock:
+            self.ops.append(op)
+        try:
+            with track(op):
+                yield op
+        finally:
+            op.finish()
+
+    def call(self, name, fn, *args, **kwargs):
+        with self.track(name):
+            return fn(*args, **kwargs)
+
+    def as_dict(self):
+        ops = [op.as_dict() for op in self.ops]
+        wall = max((op["wall_s"] for op in ops), default=0.0)
+        return {
+            "mode": self.mode,
+            "created": self.created,
+            "files": sum(op["files"] for op in ops),
+            "bytes": sum(op["bytes"] for op in ops),
+            "ops": ops,
+            "max_wall_s": wall,
+        }
+
+    def save(self, folder=REPORT_DIR):
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"run-{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.created))}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.as_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+        return path
+
+
+def format_op(op):
+    d = op if isinstance(op, dict) else op.as_dict()
+    phases = ", ".join(f"{p} {s:.2f} s" for p, s in d["phases_s"].items())
+    lines = [f"[STATS] {d['name']}: {d['files']} файлов, {d['bytes'] / 1e6:.1f} MB за {d['wall_s']:.2f} s "
+             f"({d['throughput_mb_s']:.1f} MB/s)" + (f"; {phases}" if phases else "")]
+    for item in d["slowest"][:3]:
+        lines.append(f"[STATS]   {item['path']} — {item['size'] / 1e6:.1f} MB, {item['seconds']:.2f} s")
+    return lines
@@ -0,0 +1,77 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import progress
+
+# Конвейер копирования дерева на asyncio. Обход (scandir + stat) идёт в своём потоке и
+# складывает пачки файлов в ограниченную очередь; несколько обработчиков забирают пачки
+# и выполняют блокирующие чтение, хеширование и запись в пуле потоков. Полная очередь
+# приостанавливает обход, поэтому чтение следующих файлов перекрывается с записью
+# предыдущих, а память не растёт. Итоги пачек собираются в потоке цикла событий.
+# Мелкие файлы идут пачками: переход в пул на каждый файл стоил бы дороже копирования.
+WORKERS = 4
+DEPTH = 8
+BATCH_FILES = 64
+BATCH_BYTES = 16 * 1024 * 1024
+
+
+def _batches(files):
+    batch, size = [], 0
+    for item in files:
+        batch.append(item)
+        size += item[2].st_size
+        if len(batch) >= BATCH_FILES or size >= BATCH_BYTES:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def _bind(fn):
+    # Метрики и прогресс привязаны к потоку задания — переносим их в потоки пула
+    op, tracker = metrics.current(), progress.current()
+
+    def run(*args):
+        with metrics.track(op), progress.track(tracker):
+            return fn(*args)
+    return run
+
+
+async def run_files(files, stage, sink, workers=WORKERS, depth=DEPTH):
+    # files — блокирующий итератор (путь, ключ, stat), например iter_tree;
+    # stage(пачка) → результат выполняется в пуле, sink(пачка, результат) — в цикле событий
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=depth)
+    batches = _batches(files)
+    take = _bind(lambda: next(batches, None))
+    stage = _bind(stage)
+
+    with ThreadPoolExecutor(max_workers=workers + 1, thread_name_prefix="pipeline") as pool:
+        async def produce():
+            while True:
+                batch = await loop.run_in_executor(pool, take)
+                if batch is None:
+                    break
+                await queue.put(batch)
+            for _ in range(workers):
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return
+                sink(batch, await loop.run_in_executor(pool, stage, batch))
+
+        tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(consume()) for _ in range(workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run(coro):
+    # Синхронная обёртка для движков, которые вызываются из обычных потоков заданий
+    return asyncio.run(coro)
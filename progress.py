@@ -0,0 +1,134 @@
+import time, threading
+from contextlib import contextmanager
+
+# Прогресс задания в байтах: общий объём считается заранее обходом источников,
+# движки сообщают о записанных байтах изнутри циклов копирования и сжатия.
+# Обработчик on_update вызывается не чаще раза в INTERVAL секунд.
+# Отмена кооперативная: каждая точка advance()/check() бросает Cancelled после cancel().
+INTERVAL = 0.25
+
+_current = threading.local()
+
+
+class Cancelled(BaseException):
+    # Не Exception: движки логируют и проглатывают Exception, а отмена должна дойти до задания
+    pass
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled()
+
+    def wait(self, timeout):
+        # Пауза, которую прерывает отмена; True — отменено
+        return self._event.wait(timeout)
+
+
+class Progress:
+    def __init__(self, on_update=None, token=None, interval=INTERVAL):
+        self.total = 0
+        self.total_files = 0
+        self.done = 0
+        self.files = 0
+        self.token = token or CancelToken()
+        self.on_update = on_update
+        self.interval = interval
+        self.started = time.monotonic()
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def add_total(self, size, files=0):
+        with self._lock:
+            self.total += size
+            self.total_files += files
+
+    def start(self):
+        # Отсчёт скорости — с начала копирования, а не с предварительного обхода
+        self.started = time.monotonic()
+        self.update(force=True)
+
+    def advance(self, size, files=0):
+        with self._lock:
+            self.done += size
+            self.files += files
+        self.update()
+        self.token.check()
+
+    def update(self, force=False):
+        if self.on_update is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last < self.interval:
+                return
+            self._last = now
+        self.on_update(self)
+
+    def percent(self):
+        if not self.total:
+            return 0
+        return min(100, self.done * 100 // self.total)
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        rate = self.rate()
+        if not rate or self.done >= self.total:
+            return None
+        return (self.total - self.done) / rate
+
+    def call(self, fn, *args, **kwargs):
+        with track(self):
+            return fn(*args, **kwargs)
+
+
+def current():
+    return getattr(_current, "progress", None)
+
+
+@contextmanager
+def track(progress):
+    previous = current()
+    _current.progress = progress
+    try:
+        yield progress
+    finally:
+        _current.progress = previous
+
+
+def advance(size, files=0, progress=None):
+    progress = progress or current()
+    if progress is not None:
+        progress.advance(size, files)
+
+
+def check(progress=None):
+    progress = progress or current()
+    if progress is not None:
+        progress.token.check()
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "—"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}" if seconds >= 3600 \
+        else f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def format_progress(p):
+    return (f"{p.percent()}% — {p.done / 1e6:.1f} из {p.total / 1e6:.1f} MB, файлов {p.files}/{p.total_files}, "
+            f"{p.rate() / 1e6:.1f} MB/s, осталось {format_eta(p.eta())}")
@@ -0,0 +1,316 @@
+import os, time, zlib, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from backup_engine import log, expand, restore_from_snapshot, restore_from_archive, restore_registry_key
+from archive_index import ArchiveIndex, is_encrypted
+from encryption import PassphraseError
+from chunk_store import iter_chunks, chunk_digest
+from tree_walk import iter_tree
+from live_copy import is_sqlite, drop_sidecars
+from manifest import latest_copy, hash_file
+import metrics
+
+DEFAULT_WORKERS = min(8, (os.cpu_count() or 2) * 2)
+BUF_SIZE = 1024 * 1024
+TMP_SUFFIX = ".restore-tmp"
+
+
+def _file_hash(path, algo="blake2b"):
+    h = hashlib.new(algo)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BUF_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _file_crc(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BUF_SIZE), b""):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def _chunk_list(path):
+    with open(path, "rb") as f:
+        return [chunk_digest(c) for c in iter_chunks(f)]
+
+
+class _Task:
+    # size — ожидаемый размер; matches(dst) — совпадает ли содержимое dst с источником;
+    # open() — поток с исходными данными
+    def __init__(self, dst, size, mtime_ns, open, matches):
+        self.dst = dst
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.open = open
+        self.matches = matches
+
+
+class RestoreEngine:
+    # Восстановление на пуле потоков: запись во временный файл рядом с целью,
+    # проверка хеша записанного и атомарная замена через os.replace.
+    # Файлы, уже совпадающие с источником по размеру и хешу, пропускаются,
+    # поэтому прерванное восстановление можно просто запустить заново.
+    def __init__(self, workers=DEFAULT_WORKERS, verify=True, secret=None):
+        self.workers = workers
+        self.verify = verify
+        self.secret = secret
+        self.tasks = []
+        self.restored = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+        self._lock = threading.Lock()
+        self._archives = {}
+        self.metrics = None
+
+    def add_path(self, src, dst):
+        if os.path.isdir(src):
+            name = os.path.basename(src)
+            for path, key, st in iter_tree(src, name):
+                self._add_plain(path, os.path.join(dst, *key.split("/")[1:]), st)
+        else:
+            self._add_plain(src, dst, os.stat(src))
+
+    def _add_plain(self, src, dst, st):
+        digest = {}
+
+        def source_hash():
+            if "v" not in digest:
+                digest["v"] = _file_hash(src)
+            return digest["v"]
+
+        self.tasks.append(_Task(dst, st.st_size, st.st_mtime_ns, lambda: open(src, "rb"),
+                                lambda path: _file_hash(path) == source_hash()))
+
+    def add_snapshot(self, store, manifest, name, dst):
+        prefix = name + "/"
+        for entry in manifest["files"]:
+            path = entry["path"]
+            if path == name:
+                target = dst
+            elif path.startswith(prefix):
+                target = os.path.join(dst, *path[len(prefix):].split("/"))
+            else:
+                continue
+            chunks = entry["chunks"]
+            if "digest" in entry:
+                # Хеш всего файла из снимка: совпадение проверяется одним чтением, без нарезки на чанки
+                matches = lambda p, digest=entry["digest"]: hash_file(p, manifest["algo"]) == digest
+            else:
+                matches = lambda p, chunks=chunks: _chunk_list(p) == chunks
+            self.tasks.append(_Task(target, entry["size"], entry["mtime_ns"],
+                                    lambda chunks=chunks: _ChunkReader(store, chunks), matches))
+
+    def add_archive(self, zip_path, name, dst):
+        # Отдельный файл находится по индексу архива сразу, остальные члены не читаются
+        index = self._archives.get(zip_path)
+        if index is None:
+            index = self._archives[zip_path] = ArchiveIndex(zip_path, self.secret)
+        if index.encrypted and index.key is None:
+            raise PassphraseError("архив зашифрован, нужен пароль или ключевой файл")
+        for entry, rel in index.select(name):
+            target = os.path.join(dst, *rel.split("/")) if rel else dst
+            # У зашифрованного члена CRC открытых данных нет — сравнить нечем, файл пишется заново
+            matches = (lambda p: False) if index.encrypted else (lambda p, crc=entry.crc: _file_crc(p) == crc)
+            self.tasks.append(_Task(target, entry.size, entry.mtime_ns, lambda entry=entry: index.open(entry),
+                                    matches))
+
+    def _restore_one(self, task):
+        try:
+            if os.path.isfile(task.dst) and os.path.getsize(task.dst) == task.size and task.matches(task.dst):
+                with self._lock:
+                    self.skipped += 1
+                return
+            folder = os.path.dirname(task.dst) or "."
+            os.makedirs(folder, exist_ok=True)
+            tmp = os.path.join(folder, "." + os.path.basename(task.dst) + TMP_SUFFIX)
+            h = hashlib.blake2b()
+            op = self.metrics
+            started = time.perf_counter()
+            try:
+                with task.open() as src, open(tmp, "wb") as out:
+                    while True:
+                        with metrics.phase("read", op):
+                            block = src.read(BUF_SIZE)
+                        if not block:
+                            break
+                        h.update(block)
+                        with metrics.phase("write", op):
+                            out.write(block)
+                    with metrics.phase("write", op):
+                        out.flush()
+                        os.fsync(out.fileno())
+                with metrics.phase("hash", op):
+                    ok = not self.verify or _file_hash(tmp) == h.hexdigest()
+                if not ok:
+                    raise OSError("контрольная сумма записанного файла не совпала")
+                os.utime(tmp, ns=(task.mtime_ns, task.mtime_ns))
+                if is_sqlite(tmp):
+                    # Копия базы самодостаточна; старые -wal/-journal цели применились бы поверх неё
+                    drop_sidecars(task.dst)
+                os.replace(tmp, task.dst)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            metrics.record_file(task.dst, task.size, time.perf_counter() - started, op)
+            with self._lock:
+                self.restored += 1
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+                self.errors.append(f"[ERROR] Restore: {task.dst} — {e}")
+
+    def run(self):
+        # Потоки пула пишут в метрики операции, запустившей восстановление
+        self.metrics = metrics.current()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+                list(pool.map(self._restore_one, self.tasks))
+        finally:
+            for index in self._archives.values():
+                index.close()
+            self._archives.clear()
+            self.tasks = []
+        # Логируем из вызывающего потока, чтобы сообщения попали в буфер задания
+        for msg in self.errors:
+            log(msg)
+        self.errors = []
+        return self.restored, self.skipped, self.failed
+
+
+class _ChunkReader:
+    def __init__(self, store, chunks):
+        self.store = store
+        self.chunks = iter(chunks)
+        self.buf = b""
+
+    def read(self, n=-1):
+        while n < 0 or len(self.buf) < n:
+            digest = next(self.chunks, None)
+            if digest is None:
+                break
+            self.buf += self.store.get(digest)
+        if n < 0:
+            n = len(self.buf)
+        out, self.buf = self.buf[:n], self.buf[n:]
+        return out
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def browse_app(app, store=None, snapshot_id=None):
+    # Содержимое копии, из которой restore_app будет восстанавливать: [(путь, размер, mtime_ns)].
+    # Для архива список берётся из его индекса, члены не распаковываются
+    if store:
+        manifest = store.load_manifest(app, snapshot_id)
+        return [(e["path"], e["size"], e["mtime_ns"]) for e in manifest["files"]] if manifest else []
+    out_dir = os.path.join("Backup", app)
+    zip_path = os.path.join("Backup", f"{app}_backup.zip")
+    source = latest_copy(app)
+    if source == out_dir:
+        items = []
+        for name in sorted(os.listdir(out_dir)):
+            path = os.path.join(out_dir, name)
+            if os.path.isdir(path):
+                items += [(key, st.st_size, st.st_mtime_ns) for _, key, st in iter_tree(path, name)]
+            else:
+                st = os.stat(path)
+                items.append((name, st.st_size, st.st_mtime_ns))
+        return items
+    if source == zip_path:
+        with ArchiveIndex(zip_path) as index:
+            return [(e.name, e.size, e.mtime_ns) for e in index.entries()]
+    return []
+
+
+def _selected(name, paths):
+    # → [(путь в копии, путь внутри источника name)]; paths=None — источник целиком
+    if paths is None:
+        return [(name, "")]
+    out = []
+    for key in paths:
+        key = key.strip("/")
+        if key == name:
+            out.append((key, ""))
+        elif key.startswith(name + "/"):
+            out.append((key, key[len(name) + 1:]))
+    return out
+
+
+def fetch_archive(app, target, root):
+    # Архив и манифест из цели хранения → root (отдельный каталог, не Backup/: локальную копию
+    # и её манифест скачанное не затирает); восстановление и проверка читают их оттуда
+    for name in (f"{app}_backup.zip", f"{app}_backup.zip.manifest.json"):
+        try:
+            target.fetch(name, os.path.join(root, name))
+        except Exception as e:
+            log(f"[ERROR] Fetch: {target.path(name)} — {e}")
+            return False
+    return True
+
+
+def needs_secret(app, store=None, root="Backup"):
+    # Восстановление пойдёт из зашифрованного архива: снимков нет, архив новее распакованной копии
+    zip_path = os.path.join(root, f"{app}_backup.zip")
+    return not store and latest_copy(app, root) == zip_path and is_encrypted(zip_path)
+
+
+def restore_app(app, data, store=None, target_dir=None, workers=DEFAULT_WORKERS, snapshot_id=None, paths=None,
+                secret=None, root="Backup"):
+    # target_dir=None — в оригинальные места (с импортом реестра), иначе в выбранный каталог;
+    # snapshot_id=None — последний снимок; paths — только выбранные файлы и папки копии
+    # ("User/settings.json"), реестр при этом не импортируется; secret — ключ зашифрованного архива;
+    # root — где лежат копия и архив (скачанный из цели хранения — во временном каталоге)
+    out_dir = os.path.join(root, app)
+    zip_path = os.path.join(root, f"{app}_backup.zip")
+    try:
+        manifest = store.load_manifest(app, snapshot_id) if store else None
+    except FileNotFoundError:
+        log(f"[SKIP] Нет снимка {snapshot_id} для: {app}")
+        return False
+    if store and not manifest:
+        log(f"[SKIP] Нет снимков для: {app}")
+        return False
+    # Рядом могут лежать и распакованная копия, и архив — берётся более свежая
+    use_zip = not manifest and latest_copy(app, root) == zip_path
+
+    engine = RestoreEngine(workers, secret=secret)
+    for p in data.get("files", []) + data.get("folders", []):
+        name = os.path.basename(expand(p))
+        dst = expand(p) if target_dir is None else os.path.join(target_dir, name)
+        for key, rel in _selected(name, paths):
+            target = os.path.join(dst, *rel.split("/")) if rel else dst
+            src = os.path.join(out_dir, *key.split("/"))
+            try:
+                if manifest:
+                    engine.add_snapshot(store, manifest, key, target)
+                elif use_zip:
+                    engine.add_archive(zip_path, key, target)
+                elif os.path.exists(src):
+                    engine.add_path(src, target)
+            except Exception as e:
+                log(f"[ERROR] Restore: {p} — {e}")
+    restored, skipped, failed = engine.run()
+    log(f"[RESTORE] {app}: восстановлено {restored}, уже совпадало {skipped}, ошибок {failed}")
+
+    if data.get("registry") and target_dir is None and paths is None:
+        # Импортируется только целиком извлечённый экспорт: обрезанный .reg испортил бы реестр
+        regfile = os.path.join(out_dir, f"{app}_reg.reg")
+        if manifest:
+            extracted = restore_from_snapshot(store, manifest, os.path.basename(regfile), regfile)
+        elif use_zip:
+            # Экспорт из архива распаковывается рядом, а не поверх устаревшей копии Backup/<app>
+            regfile = os.path.join(root, f".{app}_reg.reg")
+            extracted = restore_from_archive(zip_path, f"{app}_reg.reg", regfile, secret)
+        else:
+            extracted = os.path.exists(regfile)
+        if extracted:
+            restore_registry_key(regfile)
+        if use_zip and os.path.exists(regfile):
+            os.remove(regfile)
+    return failed == 0
@@ -0,0 +1,35 @@
+import time
+
+# Политика хранения снимков: последние N, по одному на каждый из N последних
+# дней/недель/месяцев. Время берётся из идентификатора снимка (YYYYmmdd-HHMMSS[-n]),
+# поэтому манифесты для выбора читать не нужно.
+PERIODS = {
+    "daily": "%Y-%m-%d",
+    "weekly": "%G-%V",
+    "monthly": "%Y-%m",
+}
+
+
+def snapshot_time(snapshot_id):
+    return time.strptime(snapshot_id[:15], "%Y%m%d-%H%M%S")
+
+
+def select_snapshots(ids, keep_last=0, keep_daily=0, keep_weekly=0, keep_monthly=0):
+    # → (оставить, удалить); самый новый снимок не удаляется никогда
+    ids = sorted(ids, reverse=True)
+    keep = set(ids[:max(1, keep_last)])
+    limits = {"daily": keep_daily, "weekly": keep_weekly, "monthly": keep_monthly}
+    for period, limit in limits.items():
+        seen = set()
+        for sid in ids:
+            if len(seen) >= limit:
+                break
+            bucket = time.strftime(PERIODS[period], snapshot_time(sid))
+            if bucket not in seen:
+                seen.add(bucket)
+                keep.add(sid)
+    return sorted(keep), sorted(set(ids) - keep)
+
+
+def has_policy(keep_last=0, keep_daily=0, keep_weekly=0, keep_monthly=0):
+    return any((keep_last, keep_daily, keep_weekly, keep_monthly))
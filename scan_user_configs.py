@@ -1,6 +1,16 @@
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
-EXTENSIONS = [".ini", ".json", ".cfg", ".xml"]
+EXTENSIONS = {".ini", ".json", ".cfg", ".xml"}
+MAX_SIZE = 5_000_000  # до 5 МБ
+
+# Каталоги кэшей, в которые не спускаемся (сравнение без учёта регистра)
+PRUNE_DIRS = {
+    "cache", "code cache", "gpucache", "dawncache", "grshadercache", "shadercache",
+    "cachestorage", "service worker", "crashpad", "crash reports", "blob_storage",
+    "node_modules", "__pycache__", ".git", "temp", "tmp", "logs",
+}
 
 BASE_DIRS = [
     os.path.expandvars("%APPDATA%"),
@@ -8,14 +18,123 @@ BASE_DIRS = [
     os.path.expandvars("%USERPROFILE%\\Documents")
 ]
 
-def scan_user_configs():
-    found = []
-    for base in BASE_DIRS:
-        for root, _, files in os.walk(base):
-            for file in files:
-                if os.path.splitext(file)[1].lower() in EXTENSIONS:
-                    path = os.path.join(root, file)
-                    if os.path.isfile(path) and os.path.getsize(path) < 5_000_000:  # до 5 МБ
-                        found.append(path)
-    return found
+WORKERS = 8
+
+def _scan_dir(path, extensions, max_size, prune):
+    # Один каталог: размер и тип берутся из DirEntry, без отдельных isfile/getsize
+    files, subdirs = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name.lower() not in prune:
+                            subdirs.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file():
+                        if entry.stat().st_size < max_size:
+                            files.append(entry.path)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return files, subdirs
+
+def iter_user_configs(bases=None, extensions=EXTENSIONS, max_size=MAX_SIZE, prune=PRUNE_DIRS, workers=WORKERS):
+    # Генератор: подкаталоги обходятся параллельно, найденное отдаётся сразу
+    bases = BASE_DIRS if bases is None else bases
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending = {pool.submit(_scan_dir, b, extensions, max_size, prune) for b in bases if os.path.isdir(b)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for d in subdirs:
+                    pending.add(pool.submit(_scan_dir, d, extensions, max_size, prune))
+                yield from files
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def scan_user_configs(bases=None):
+    return sorted(iter_user_configs(bases))
+
+# Индекс обнаружения: каталог → (mtime_ns, найденные файлы, подкаталоги).
+# Каталог с неизменным mtime не перечитывается: добавление, удаление и
+# переименование записей всегда меняют mtime родительского каталога.
+# Хранится в JSON (не pickle): загрузка индекса не должна выполнять код из файла.
+INDEX_PATH = os.path.join("Config", "discovery.idx")
+INDEX_VERSION = 2
+
+def _scan_dir_cached(path, previous, extensions, max_size, prune):
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    if previous is not None and previous[0] == mtime_ns:
+        return previous
+    files, subdirs = _scan_dir(path, extensions, max_size, prune)
+    return mtime_ns, files, subdirs
+
+def _signature(extensions, max_size, prune):
+    return [sorted(extensions), max_size, sorted(prune)]
+
+class DiscoveryIndex:
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.signature = None
+        self.dirs = self._load()
+        self.previous_files = {f for _, files, _ in self.dirs.values() for f in files} if self.dirs else None
+        self.new_files = []
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION and isinstance(data.get("dirs"), dict):
+                self.signature = data["signature"]
+                return data["dirs"]
+        except Exception:
+            pass
+        return {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "signature": self.signature, "dirs": self.dirs}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def scan(self, bases=None, extensions=EXTENSIONS, max_size=MAX_SIZE, prune=PRUNE_DIRS, workers=WORKERS):
+        # Генератор, как iter_user_configs; по завершении индекс обновлён и сохранён
+        bases = BASE_DIRS if bases is None else bases
+        signature = _signature(extensions, max_size, prune)
+        # При смене фильтров сохранённые списки файлов недействительны
+        previous = self.dirs if signature == self.signature else {}
+        current, new_files = {}, []
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            pending = {pool.submit(_scan_dir_cached, b, previous.get(b), extensions, max_size, prune): b
+                       for b in bases if os.path.isdir(b)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    entry = future.result()
+                    if entry is None:
+                        continue
+                    current[path] = entry
+                    _, files, subdirs = entry
+                    for d in subdirs:
+                        pending[pool.submit(_scan_dir_cached, d, previous.get(d), extensions, max_size, prune)] = d
+                    if self.previous_files is not None:
+                        new_files += [f for f in files if f not in self.previous_files]
+                    yield from files
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.dirs = current
+        self.signature = signature
+        self.new_files = new_files
+        self.save()
 
+    def new_since_last_scan(self):
+        return list(self.new_files)
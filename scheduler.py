@@ -0,0 +1,76 @@
+import os, threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from backup_engine import log, expand, capture_log
+from progress import Cancelled
+
+DEFAULT_WORKERS = min(8, os.cpu_count() or 2)
+# Одновременных копирований с одного устройства: HDD — 1, SSD/NVMe — PER_DEVICE
+PER_DEVICE = 4
+
+
+def _is_rotational(dev):
+    if not hasattr(os, "major"):
+        return False
+    base = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    for path in (os.path.join(base, "queue", "rotational"), os.path.join(base, "..", "queue", "rotational")):
+        try:
+            with open(path) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return False
+
+
+class IOLimiter:
+    def __init__(self, per_device=PER_DEVICE):
+        self.per_device = per_device
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def _semaphore(self, path):
+        try:
+            dev = os.stat(expand(path)).st_dev
+        except OSError:
+            dev = None
+        with self._lock:
+            sem = self._slots.get(dev)
+            if sem is None:
+                limit = 1 if dev is not None and _is_rotational(dev) else self.per_device
+                sem = self._slots[dev] = threading.BoundedSemaphore(max(1, limit))
+            return sem
+
+    @contextmanager
+    def slot(self, path):
+        with self._semaphore(path):
+            yield
+
+
+def run_jobs(items, job, workers=DEFAULT_WORKERS, on_done=None, cancel=None):
+    # Задания выполняются параллельно, но логи и on_done выдаются строго в порядке items.
+    # cancel — CancelToken: после отмены оставшиеся задания не запускаются
+    def wrapped(item):
+        with capture_log() as lines:
+            result = None
+            if cancel is not None and cancel.cancelled:
+                log(f"[CANCEL] {item}: пропущено")
+                return result, lines
+            try:
+                result = job(item)
+            except Cancelled:
+                log(f"[CANCEL] {item}: остановлено")
+            except Exception as e:
+                log(f"[ERROR] {item}: {e}")
+        return result, lines
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(wrapped, item) for item in items]
+        for i, (item, future) in enumerate(zip(items, futures)):
+            result, lines = future.result()
+            for line in lines:
+                log(line)
+            if on_done:
+                on_done(i, item, result, lines)
+            results.append(result)
+    return results
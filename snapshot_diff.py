@@ -0,0 +1,134 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from backup_engine import expand
+from chunk_store import iter_chunks, chunk_digest
+from manifest import manifest_path, load_manifest, hash_file, latest_copy
+from tree_walk import iter_tree, TreeFilter
+
+DEFAULT_WORKERS = min(8, (os.cpu_count() or 2) * 2)
+LIVE = "live"
+
+# Листинг: путь внутри копии → {"size", "mtime_ns"} и то, чем можно сравнить содержимое:
+# "chunks" (снимок хранилища, у новых снимков ещё и "digest"), "digest" + "algo" (манифест копии)
+# или "path" (живой файл).
+
+
+def snapshot_listing(manifest):
+    # Снимки новых версий хранят и хеш всего файла — им сравнивается содержимое вместо нарезки на чанки
+    if "algo" in manifest:
+        return {e["path"]: dict(e, algo=manifest["algo"]) for e in manifest["files"]}
+    return {e["path"]: e for e in manifest["files"]}
+
+
+def manifest_listing(manifest):
+    return {key: dict(entry, algo=manifest["algo"]) for key, entry in manifest["files"].items()}
+
+
+def live_listing(data):
+    listing = {}
+    tree_filter = TreeFilter.from_plugin(data)
+    for p in data.get("files", []):
+        src = expand(p)
+        try:
+            st = os.stat(src)
+        except OSError:
+            continue
+        listing[os.path.basename(src)] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "path": src}
+    for p in data.get("folders", []):
+        src = expand(p)
+        if os.path.isdir(src):
+            for path, key, st in iter_tree(src, os.path.basename(src), tree_filter):
+                listing[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "path": path}
+    return listing
+
+
+def _file_chunks(path):
+    with open(path, "rb") as f:
+        return [chunk_digest(c) for c in iter_chunks(f)]
+
+
+def same_content(a, b):
+    # Сравнение содержимого в том виде, который есть у обеих сторон; живой файл читается один раз
+    if "path" in a and "path" not in b:
+        a, b = b, a
+    if "chunks" in a and "chunks" in b:
+        return a["chunks"] == b["chunks"]
+    if "digest" in a and "digest" in b and a["algo"] == b["algo"]:
+        return a["digest"] == b["digest"]
+    if "path" in b:
+        if "digest" in a:
+            return hash_file(b["path"], a["algo"]) == a["digest"]
+        if "chunks" in a:
+            return _file_chunks(b["path"]) == a["chunks"]
+        if "path" in a:
+            return hash_file(a["path"]) == hash_file(b["path"])
+    return False
+
+
+class DiffResult:
+    def __init__(self, added, removed, modified, hashed):
+        self.added = added
+        self.removed = removed
+        self.modified = modified
+        self.hashed = hashed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified)
+
+
+def diff_listings(old, new, workers=DEFAULT_WORKERS):
+    # Сначала метаданные: другой размер — изменён, тот же размер и mtime — не изменён.
+    # Содержимое сравнивается только при совпадающем размере и разном mtime.
+    added = sorted(new.keys() - old.keys())
+    removed = sorted(old.keys() - new.keys())
+    modified, ambiguous = [], []
+    for key in old.keys() & new.keys():
+        a, b = old[key], new[key]
+        if a["size"] != b["size"]:
+            modified.append(key)
+        elif a["mtime_ns"] != b["mtime_ns"]:
+            ambiguous.append(key)
+    if ambiguous:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            same = list(pool.map(lambda k: same_content(old[k], new[k]), ambiguous))
+        modified += [k for k, s in zip(ambiguous, same) if not s]
+    return DiffResult(added, removed, sorted(modified), len(ambiguous))
+
+
+def backup_listing(app, store=None, snapshot_id=None):
+    # Снимок из хранилища (последний или snapshot_id), иначе манифест более свежей из копии Backup/<app> и архива
+    if store:
+        manifest = store.load_manifest(app, snapshot_id)
+        return snapshot_listing(manifest) if manifest else None
+    if snapshot_id:
+        return None
+    target = latest_copy(app)
+    manifest = load_manifest(manifest_path(target)) if target else None
+    return manifest_listing(manifest) if manifest else None
+
+
+def diff_app(app, data, store=None, old=None, new=LIVE, workers=DEFAULT_WORKERS):
+    # old/new — идентификаторы снимков или LIVE; old=None — последняя копия
+    listings = []
+    for side in (old, new):
+        if side == LIVE:
+            listings.append(live_listing(data))
+        else:
+            listing = backup_listing(app, store, side)
+            if listing is None:
+                raise FileNotFoundError(f"нет снимка {side} для {app}" if side else f"нет копии для {app}")
+            listings.append(listing)
+    if LIVE in (old, new):
+        # Экспорт реестра в живых путях не участвует
+        for listing in listings:
+            listing.pop(f"{app}_reg.reg", None)
+    return diff_listings(*listings, workers=workers)
+
+
+def format_diff(app, result):
+    lines = [f"[DIFF] {app}: добавлено {len(result.added)}, удалено {len(result.removed)}, "
+             f"изменено {len(result.modified)}"]
+    lines += [f"  + {k}" for k in result.added]
+    lines += [f"  - {k}" for k in result.removed]
+    lines += [f"  ~ {k}" for k in result.modified]
+    return lines
@@ -0,0 +1,90 @@
+import os, struct
+from types import SimpleNamespace
+
+INDEX_DIR = os.path.join("Backup", ".index")
+
+# Формат: заголовок, затем записи (длина пути, флаги, size, mtime_ns, inode, source) + путь в UTF-8.
+# source — размер источника согласованной копии (база вместе с WAL), для обычных файлов -1
+_HEADER = b"BKIDX\x02"
+_HEADER_V1 = b"BKIDX\x01"
+_REC = struct.Struct("<HBqqQq")
+_REC_V1 = struct.Struct("<HBqqQ")
+TOMBSTONE = 1
+
+
+class SnapshotIndex:
+    def __init__(self, app, root=INDEX_DIR):
+        self.path = os.path.join(root, f"{app}.idx")
+        self.previous = self._read()
+        self.current = {}
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return {}
+        if data.startswith(_HEADER):
+            rec = _REC
+        elif data.startswith(_HEADER_V1):
+            rec = _REC_V1
+        else:
+            return {}
+        out, pos = {}, len(_HEADER)
+        while pos + rec.size <= len(data):
+            n, flags, size, mtime_ns, inode, *source = rec.unpack_from(data, pos)
+            pos += rec.size
+            out[data[pos:pos + n].decode("utf-8")] = (size, mtime_ns, inode, flags, source[0] if source else -1)
+            pos += n
+        return out
+
+    def unchanged(self, key, st):
+        old = self.previous.get(key)
+        return (old is not None and not old[3] & TOMBSTONE
+                and old[0] == st.st_size and old[1] == st.st_mtime_ns and old[2] == st.st_ino)
+
+    def keep(self, key, st):
+        self.current[key] = (st.st_size, st.st_mtime_ns, st.st_ino, 0, getattr(st, "st_source", -1))
+
+    def staged(self, key, source_st):
+        # Согласованная копия из LiveStaging: сверяется источник (размер с WAL, mtime, inode).
+        # → stat прошлой копии, если источник не менялся, иначе None
+        old = self.previous.get(key)
+        if (old is None or old[3] & TOMBSTONE or old[4] != source_st.st_size
+                or old[1] != source_st.st_mtime_ns or old[2] != source_st.st_ino):
+            return None
+        return SimpleNamespace(st_size=old[0], st_mtime=old[1] / 1e9, st_mtime_ns=old[1], st_ino=old[2],
+                               st_source=old[4])
+
+    def retain(self, key):
+        # Файл (или каталог — тогда всё под ним) не удалось прочитать: прошлые записи переносятся
+        # как есть, копии не считаются удалёнными
+        prefix = key + "/"
+        for k, v in self.previous.items():
+            if k == key or k.startswith(prefix):
+                self.current[k] = v
+
+    def deleted(self, name):
+        # Всё, что было под name в прошлый раз и не встретилось сейчас, — надгробия
+        prefix = name + "/"
+        gone = [k for k, v in self.previous.items()
+                if (k == name or k.startswith(prefix)) and not v[3] & TOMBSTONE and k not in self.current]
+        for k in gone:
+            size, mtime_ns, inode, _, source = self.previous[k]
+            self.current[k] = (size, mtime_ns, inode, TOMBSTONE, source)
+        return gone
+
+    def tombstones(self):
+        return [k for k, v in self.current.items() if v[3] & TOMBSTONE]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        parts = [_HEADER]
+        for key, (size, mtime_ns, inode, flags, source) in sorted(self.current.items()):
+            raw = key.encode("utf-8")
+            parts.append(_REC.pack(len(raw), flags, size, mtime_ns, inode, source))
+            parts.append(raw)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(b"".join(parts))
+        os.replace(tmp, self.path)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# storage_server.py — простой сервер хранилища для загрузки архивов частями (HttpTarget).
+# Подходит для NAS в домашней сети и для проверки без настоящего сервера:
+#   python storage_server.py --root /srv/backups --port 8765
+#   python backup_console.py --mode backup --apps Git --zip --target http://nas:8765/backups
+# Части пишутся в <root>/.uploads/<сессия>/<номер> и собираются в файл при завершении;
+# незавершённая сессия переживает перезапуск сервера, клиент досылает недостающие части.
+import os, sys, json, shutil, hashlib, secrets, argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+BUF_SIZE = 1024 * 1024
+
+
+class StorageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    root = "."
+    # Отказ на каждом N-м запросе части — для проверки повторов клиента (0 — выключено)
+    fail_every = 0
+    _requests = 0
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        name = unquote(parts.path).strip("/")
+        if not name or ".." in name.split("/") or name.startswith(".uploads"):
+            raise ValueError("недопустимое имя")
+        return name, {k: v[-1] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+
+    def _session(self, query):
+        upload = query.get("upload", "")
+        if not upload.isalnum():
+            raise ValueError("недопустимая сессия")
+        return os.path.join(self.root, ".uploads", upload)
+
+    def _reply(self, status, payload=None):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length)
+
+    def _handle(self, fn):
+        # Тело читается сразу: иначе ответ с ошибкой оставил бы его в keep-alive соединении
+        self.body = self._body()
+        try:
+            fn()
+        except (ValueError, KeyError) as e:
+            self._reply(400, {"error": str(e)})
+        except FileNotFoundError as e:
+            self._reply(404, {"error": str(e)})
+        except OSError as e:
+            self._reply(500, {"error": str(e)})
+
+    def do_POST(self):
+        self._handle(self._post)
+
+    def _post(self):
+        name, query = self._parse()
+        if "uploads" in query:
+            upload = secrets.token_hex(16)
+            os.makedirs(os.path.join(self.root, ".uploads", upload))
+            with open(os.path.join(self.root, ".uploads", upload, "name"), "w", encoding="utf-8") as f:
+                f.write(name)
+            self._reply(200, {"upload": upload})
+        elif "complete" in query:
+            session = self._session(query)
+            request = json.loads(self.body or b"{}")
+            count, size = int(request["parts"]), int(request["size"])
+            dst = os.path.join(self.root, *name.split("/"))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            written = 0
+            with open(dst + ".part", "wb") as out:
+                for n in range(count):
+                    with open(os.path.join(session, str(n)), "rb") as f:
+                        shutil.copyfileobj(f, out, BUF_SIZE)
+                written = out.tell()
+            if written != size:
+                os.remove(dst + ".part")
+                raise ValueError(f"собрано {written} байт вместо {size}")
+            os.replace(dst + ".part", dst)
+            shutil.rmtree(session, ignore_errors=True)
+            self._reply(200, {"size": written})
+        else:
+            raise ValueError("неизвестный запрос")
+
+    def do_PUT(self):
+        self._handle(self._put)
+
+    def _put(self):
+        name, query = self._parse()
+        session = self._session(query)
+        number = int(query["part"])
+        data = self.body
+        cls = type(self)
+        cls._requests += 1
+        if cls.fail_every and cls._requests % cls.fail_every == 0:
+            self._reply(503, {"error": "тестовый отказ"})
+            return
+        if not os.path.isdir(session):
+            raise FileNotFoundError("сессия не найдена")
+        digest = hashlib.sha256(data).hexdigest()
+        expected = self.headers.get("X-Content-SHA256")
+        if expected and expected != digest:
+            raise ValueError("контрольная сумма части не совпала")
+        path = os.path.join(session, str(number))
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        self._reply(200, {"part": number, "sha256": digest})
+
+    def do_GET(self):
+        self._handle(self._get)
+
+    def _get(self):
+        name, query = self._parse()
+        if "upload" in query:
+            session = self._session(query)
+            if not os.path.isdir(session):
+                raise FileNotFoundError("сессия не найдена")
+            parts = {}
+            for entry in os.listdir(session):
+                if entry.isdigit():
+                    with open(os.path.join(session, entry), "rb") as f:
+                        data = f.read()
+                    parts[entry] = [len(data), hashlib.sha256(data).hexdigest()]
+            self._reply(200, {"parts": parts})
+            return
+        path = os.path.join(self.root, *name.split("/"))
+        with open(path, "rb") as f:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, BUF_SIZE)
+
+    def do_DELETE(self):
+        self._handle(self._delete)
+
+    def _delete(self):
+        name, query = self._parse()
+        shutil.rmtree(self._session(query), ignore_errors=True)
+        self._reply(200, {})
+
+
+def make_server(root, host="127.0.0.1", port=8765, verbose=False, fail_every=0):
+    # port=0 — свободный порт (см. server.server_address)
+    handler = type("Handler", (StorageHandler,), {"root": os.path.abspath(root), "fail_every": fail_every})
+    os.makedirs(os.path.join(handler.root, ".uploads"), exist_ok=True)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сервер хранилища архивов BackupApp")
+    parser.add_argument("--root", required=True, help="каталог для архивов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    server = make_server(args.root, args.host, args.port, args.verbose)
+    print(f"Хранилище {os.path.abspath(args.root)} на http://{args.host}:{server.server_address[1]}/", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+import os, json, time, hashlib, threading, http.client
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit, quote
+import metrics
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+# Куда пишутся архивы. Цель отдаёт писателя (write/tell/commit/abort): StreamingZip пишет
+# в него последовательно, а цель сама решает, как данные попадут на место — локальный
+# .part с переименованием или загрузка частями на сервер прямо во время сжатия, без
+# промежуточной копии на диске. Готовые файлы (манифест, ранее созданный архив)
+# отправляются put_file с возобновлением прерванной загрузки.
+#
+# Спецификация цели: путь к каталогу, http(s)://хост:порт/префикс (storage_server.py
+# или совместимый сервер) или sftp://пользователь@хост/путь (нужен пакет paramiko).
+DEFAULT_ROOT = "Backup"
+PART_SIZE = 8 * 1024 * 1024
+WORKERS = 4
+RETRIES = 5
+BACKOFF = 0.5
+TIMEOUT = 60
+STATE_DIR = os.path.join("Backup", ".uploads")
+
+
+def open_target(spec=None):
+    if not spec:
+        return LocalTarget()
+    scheme = urlsplit(spec).scheme.lower()
+    if scheme in ("http", "https"):
+        return HttpTarget(spec)
+    if scheme == "sftp":
+        return SftpTarget(spec)
+    return LocalTarget(spec)
+
+
+def _retry(fn, what):
+    # Сетевые сбои и 5xx повторяются с растущей паузой; ошибки запроса (4xx) — сразу наверх
+    for attempt in range(RETRIES):
+        try:
+            return fn()
+        except _Fatal as e:
+            raise OSError(str(e)) from None
+        except (OSError, http.client.HTTPException) as e:
+            if attempt == RETRIES - 1:
+                raise OSError(f"{what}: {e}") from e
+            time.sleep(BACKOFF * 2 ** attempt)
+
+
+class _Fatal(Exception):
+    pass
+
+
+def _state_path(target, name):
+    return os.path.join(STATE_DIR, hashlib.sha1(f"{target.describe()}|{name}".encode("utf-8")).hexdigest() + ".json")
+
+
+def _load_state(target, name, st):
+    try:
+        with open(_state_path(target, name), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Сессия годится, только если исходный файл с тех пор не менялся
+    if state.get("size") != st.st_size or state.get("mtime_ns") != st.st_mtime_ns:
+        return None
+    return state
+
+
+def _save_state(target, name, state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    path = _state_path(target, name)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def _drop_state(target, name):
+    try:
+        os.remove(_state_path(target, name))
+    except OSError:
+        pass
+
+
+class LocalTarget:
+    remote = False
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+
+    def describe(self):
+        return self.root
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def open_write(self, name):
+        return _LocalWriter(self.path(name))
+
+    def put_file(self, src, name):
+        if os.path.abspath(src) != os.path.abspath(self.path(name)):
+            _copy(src, self.path(name))
+
+    def fetch(self, name, dst):
+        if os.path.abspath(self.path(name)) != os.path.abspath(dst):
+            _copy(self.path(name), dst)
+
+
+def _copy(src, dst):
+    with open(src, "rb") as f, _LocalWriter(dst) as out:
+        while True:
+            data = f.read(PART_SIZE)
+            if not data:
+                break
+            out.write(data)
+
+
+class _Writer:
+    # Общее для писателей: в with фиксируется при успехе и отменяется при ошибке
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                self.commit()
+            except BaseException:
+                self.abort()
+                raise
+        else:
+            self.abort()
+
+
+class _LocalWriter(_Writer):
+    # Временный .part рядом с целью; готовый файл появляется только после commit()
+    def __init__(self, path):
+        self.path = path
+        self.part_path = path + ".part"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._f = open(self.part_path, "wb")
+
+    def write(self, data):
+        return self._f.write(data)
+
+    def tell(self):
+        return self._f.tell()
+
+    def commit(self):
+        self._f.close()
+        os.replace(self.part_path, self.path)
+
+    def abort(self):
+        self._f.close()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+
+class HttpTarget:
+    # Протокол загрузки частями (см. storage_server.py):
+    #   POST   <префикс>/<имя>?uploads                  → {"upload": id}
+    #   PUT    <префикс>/<имя>?upload=id&part=N          тело части, X-Content-SHA256
+    #   GET    <префикс>/<имя>?upload=id                 → {"parts": {"N": [размер, sha256]}}
+    #   POST   <префикс>/<имя>?upload=id&complete        {"parts": N, "size": байт}
+    #   DELETE <префикс>/<имя>?upload=id
+    #   GET    <префикс>/<имя>                           содержимое файла
+    remote = True
+
+    def __init__(self, url, part_size=PART_SIZE, workers=WORKERS):
+        parts = urlsplit(url)
+        self.url = url.rstrip("/")
+        self.https = parts.scheme.lower() == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip("/")
+        self.part_size = part_size
+        self.workers = workers
+        self._local = threading.local()
+
+    def describe(self):
+        return self.url
+
+    def path(self, name):
+        return f"{self.url}/{name}"
+
+    def _connection(self):
+        # Соединение на поток: части идут параллельно по своим keep-alive соединениям
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, self.port, timeout=TIMEOUT)
+        return conn
+
+    def _request(self, method, name, query="", body=None, headers=None, raw=False):
+        url = f"{self.prefix}/{quote(name)}" + (f"?{query}" if query else "")
+        conn = self._connection()
+        try:
+            conn.request(method, url, body=body, headers=headers or {})
+            response = conn.getresponse()
+            data = response.read() if not raw else response
+        except BaseException:
+            conn.close()
+            self._local.conn = None
+            raise
+        if response.status >= 500:
+            raise OSError(f"HTTP {response.status} {method} {name}")
+        if response.status >= 400:
+            body = data.decode("utf-8", "replace") if not raw else response.read().decode("utf-8", "replace")
+            raise _Fatal(f"HTTP {response.status} {method} {name}: {body.strip()}")
+        if raw:
+            return response
+        return json.loads(data) if data else {}
+
+    def _call(self, what, *args, **kwargs):
+        return _retry(lambda: self._request(*args, **kwargs), what)
+
+    def start(self, name):
+        return self._call(f"начало загрузки {name}", "POST", name, "uploads")["upload"]
+
+    def upload_part(self, name, upload, number, data):
+        digest = hashlib.sha256(data).hexdigest()
+        with metrics.phase("upload"):
+            reply = self._call(f"часть {number} {name}", "PUT", name, f"upload={upload}&part={number}", data,
+                               {"X-Content-SHA256": digest, "Content-Length": str(len(data))})
+        if reply.get("sha256") != digest:
+            raise OSError(f"сервер получил часть {number} {name} с ошибкой")
+        return number, len(data)
+
+    def uploaded(self, name, upload):
+        parts = self._call(f"состояние загрузки {name}", "GET", name, f"upload={upload}")["parts"]
+        return {int(n): tuple(v) for n, v in parts.items()}
+
+    def complete(self, name, upload, count, size):
+        body = json.dumps({"parts": count, "size": size}).encode("utf-8")
+        self._call(f"завершение {name}", "POST", name, f"upload={upload}&complete", body,
+                   {"Content-Type": "application/json"})
+
+    def cancel(self, name, upload):
+        try:
+            self._request("DELETE", name, f"upload={upload}")
+        except (OSError, http.client.HTTPException, _Fatal):
+            pass
+
+    def open_write(self, name):
+        return _MultipartWriter(self, name)
+
+    def put_file(self, src, name):
+        # Прерванная загрузка продолжается с недостающих частей той же сессии
+        st = os.stat(src)
+        state = _load_state(self, name, st)
+        done = {}
+        if state and state.get("part_size") == self.part_size:
+            try:
+                done = self.uploaded(name, state["upload"])
+            except OSError:
+                state = None
+        else:
+            state = None
+        if state is None:
+            state = {"upload": self.start(name), "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                     "part_size": self.part_size}
+            _save_state(self, name, state)
+        upload = state["upload"]
+        count = max(1, -(-st.st_size // self.part_size))
+
+        def send(number):
+            with open(src, "rb") as f:
+                f.seek(number * self.part_size)
+                data = f.read(self.part_size)
+            known = done.get(number)
+            if known and known[0] == len(data) and known[1] == hashlib.sha256(data).hexdigest():
+                return number, 0
+            return self.upload_part(name, upload, number, data)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="upload") as pool:
+            for _ in pool.map(_bind(send), range(count)):
+                pass
+        self.complete(name, upload, count, st.st_size)
+        _drop_state(self, name)
+
+    def fetch(self, name, dst):
+        def get():
+            response = self._request("GET", name, raw=True)
+            with _LocalWriter(dst) as out:
+                while True:
+                    data = response.read(PART_SIZE)
+                    if not data:
+                        break
+                    out.write(data)
+            # Тело прочитано целиком, соединение можно переиспользовать
+        _retry(get, f"скачивание {name}")
+
+
+def _bind(fn):
+    # Метрики задания переносим в потоки загрузки
+    op = metrics.current()
+
+    def run(*args):
+        with metrics.track(op):
+            return fn(*args)
+    return run
+
+
+class _MultipartWriter(_Writer):
+    # Буферизует part_size байт и отправляет части параллельно, пока архив пишется дальше.
+    # В полёте не больше workers частей: память ограничена (workers + 1) * part_size,
+    # а медленная сеть притормаживает сжатие, а не копит данные.
+    def __init__(self, target, name):
+        self.target = target
+        self.name = name
+        self.upload = target.start(name)
+        self._pool = ThreadPoolExecutor(max_workers=target.workers, thread_name_prefix="upload")
+        self._send = _bind(lambda number, data: target.upload_part(name, self.upload, number, data))
+        self._pending = set()
+        self._buf = bytearray()
+        self._parts = 0
+        self._size = 0
+
+    def write(self, data):
+        self._buf += data
+        self._size += len(data)
+        while len(self._buf) >= self.target.part_size:
+            self._flush(bytes(self._buf[:self.target.part_size]))
+            del self._buf[:self.target.part_size]
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def _flush(self, data):
+        while len(self._pending) >= self.target.workers:
+            done, self._pending = wait(self._pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        self._pending.add(self._pool.submit(self._send, self._parts, data))
+        self._parts += 1
+
+    def commit(self):
+        if self._buf or not self._parts:
+            self._flush(bytes(self._buf))
+            self._buf.clear()
+        for future in self._pending:
+            future.result()
+        self._pool.shutdown()
+        self.target.complete(self.name, self.upload, self._parts, self._size)
+
+    def abort(self):
+        for future in self._pending:
+            future.cancel()
+        self._pool.shutdown()
+        if self.upload is not None:
+            self.target.cancel(self.name, self.upload)
+            self.upload = None
+
+
+class SftpTarget:
+    # Запись в name.part на сервере и атомарное переименование; paramiko конвейеризует
+    # запросы записи сам, поэтому данные идут без ожидания ответа на каждый блок
+    remote = True
+
+    def __init__(self, url):
+        if paramiko is None:
+            raise RuntimeError("Для sftp:// нужен пакет paramiko")
+        parts = urlsplit(url)
+        self.url = url.rstrip("/")
+        self.host = parts.hostname
+        self.port = parts.port or 22
+        self.user = parts.username
+        self.password = parts.password
+        self.root = parts.path.rstrip("/") or "."
+        self._local = threading.local()
+
+    def describe(self):
+        return self.url
+
+    def path(self, name):
+        return f"{self.url}/{name}"
+
+    def _sftp(self):
+        sftp = getattr(self._local, "sftp", None)
+        if sftp is None:
+            client = paramiko.SSHClient()
+            client.load_system_host_keys()
+            client.connect(self.host, self.port, self.user, self.password, timeout=TIMEOUT)
+            sftp = self._local.sftp = client.open_sftp()
+            self._local.client = client
+        return sftp
+
+    def _reset(self):
+        client = getattr(self._local, "client", None)
+        if client is not None:
+            client.close()
+        self._local.sftp = self._local.client = None
+
+    def _remote(self, name):
+        return f"{self.root}/{name}"
+
+    def open_write(self, name):
+        return _SftpWriter(self, name)
+
+    def put_file(self, src, name):
+        # Возобновление: дописываем name.part с того места, где остановились
+        st = os.stat(src)
+        remote = self._remote(name)
+
+        def send():
+            try:
+                sftp = self._sftp()
+                state = _load_state(self, name, st)
+                try:
+                    offset = sftp.stat(remote + ".part").st_size if state else 0
+                except OSError:
+                    offset = 0
+                _save_state(self, name, {"size": st.st_size, "mtime_ns": st.st_mtime_ns})
+                with open(src, "rb") as f, sftp.open(remote + ".part", "ab" if offset else "wb") as out:
+                    out.set_pipelined(True)
+                    f.seek(offset)
+                    while True:
+                        data = f.read(PART_SIZE)
+                        if not data:
+                            break
+                        with metrics.phase("upload"):
+                            out.write(data)
+                sftp.posix_rename(remote + ".part", remote)
+            except (OSError, paramiko.SSHException):
+                self._reset()
+                raise
+        _retry(send, f"загрузка {name}")
+        _drop_state(self, name)
+
+    def fetch(self, name, dst):
+        def get():
+            with self._sftp().open(self._remote(name), "rb") as f, _LocalWriter(dst) as out:
+                f.prefetch()
+                while True:
+                    data = f.read(PART_SIZE)
+                    if not data:
+                        break
+                    out.write(data)
+        _retry(get, f"скачивание {name}")
+
+
+class _SftpWriter(_Writer):
+    def __init__(self, target, name):
+        self.target = target
+        self.remote = target._remote(name)
+        self._f = target._sftp().open(self.remote + ".part", "wb")
+        self._f.set_pipelined(True)
+        self._size = 0
+
+    def write(self, data):
+        with metrics.phase("upload"):
+            self._f.write(data)
+        self._size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def commit(self):
+        self._f.close()
+        self.target._sftp().posix_rename(self.remote + ".part", self.remote)
+
+    def abort(self):
+        try:
+            self._f.close()
+            self.target._sftp().remove(self.remote + ".part")
+        except (OSError, paramiko.SSHException):
+            pass
@@ -0,0 +1,43 @@
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def work(tmp_path, monkeypatch):
+    # Движок пишет в относительный Backup/ — каждый тест в своём каталоге
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def write_tree(root, files):
+    for rel, data in files.items():
+        path = os.path.join(root, *rel.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def read_tree(root):
+    out = {}
+    for folder, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(folder, name)
+            with open(path, "rb") as f:
+                out[os.path.relpath(path, root).replace(os.sep, "/")] = f.read()
+    return out
+
+
+def touch_later(path, data):
+    # Новое содержимое с гарантированно другим mtime_ns
+    st = os.stat(path)
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+def make_app(root, files):
+    # Приложение с одной папкой src/Data
+    write_tree(root / "src" / "Data", files)
+    return {"files": [], "folders": [str(root / "src" / "Data")]}
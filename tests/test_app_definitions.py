@@ -0,0 +1,70 @@
+import os, json
+import app_definitions
+from app_definitions import load_plugin_files, load_plugins, find_duplicate_plugins, CACHE_NAME
+
+
+def write_plugin(folder, name, data, mtime_ns=None):
+    path = folder / name
+    path.write_text(json.dumps(data), encoding="utf-8")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def count_loads(monkeypatch):
+    loaded = []
+    load = json.load
+
+    def counting(f, *args, **kwargs):
+        loaded.append(os.path.basename(f.name))
+        return load(f, *args, **kwargs)
+    monkeypatch.setattr(app_definitions.json, "load", counting)
+    return loaded
+
+
+def test_cache_skips_unchanged_plugins(work, monkeypatch):
+    plugins = work / "Plugins"
+    plugins.mkdir()
+    write_plugin(plugins, "a.json", {"AppA": {"folders": ["%APPDATA%/A"]}})
+    write_plugin(plugins, "b.json", {"AppB": {"files": []}})
+    first = load_plugin_files(str(plugins))
+    assert (plugins / CACHE_NAME).exists()
+    loaded = count_loads(monkeypatch)
+    assert load_plugin_files(str(plugins)) == first
+    # Второй запуск читает только кэш
+    assert loaded == [CACHE_NAME]
+
+
+def test_cache_invalidated_by_change_and_removal(work, monkeypatch):
+    plugins = work / "Plugins"
+    plugins.mkdir()
+    write_plugin(plugins, "a.json", {"AppA": {"v": 1}}, mtime_ns=1_000_000_000)
+    write_plugin(plugins, "b.json", {"AppB": {}})
+    load_plugin_files(str(plugins))
+    write_plugin(plugins, "a.json", {"AppA": {"v": 2}}, mtime_ns=2_000_000_000)
+    (plugins / "b.json").unlink()
+    write_plugin(plugins, "c.json", {"AppC": {}})
+    loaded = count_loads(monkeypatch)
+    assert load_plugin_files(str(plugins)) == {"a.json": {"AppA": {"v": 2}}, "c.json": {"AppC": {}}}
+    assert sorted(loaded) == [CACHE_NAME, "a.json", "c.json"]
+    cache = json.loads((plugins / CACHE_NAME).read_text(encoding="utf-8"))
+    assert sorted(cache["files"]) == ["a.json", "c.json"]
+
+
+def test_broken_cache_is_ignored(work):
+    plugins = work / "Plugins"
+    plugins.mkdir()
+    write_plugin(plugins, "a.json", {"AppA": {}})
+    # Старый pickle-кэш или мусор не читаются как данные
+    (plugins / CACHE_NAME).write_bytes(b"\x80\x05garbage")
+    assert load_plugin_files(str(plugins)) == {"a.json": {"AppA": {}}}
+    assert json.loads((plugins / CACHE_NAME).read_text(encoding="utf-8"))["version"] == app_definitions.CACHE_VERSION
+
+
+def test_duplicate_app_first_plugin_wins(work, capsys):
+    plugins = work / "Plugins"
+    plugins.mkdir()
+    write_plugin(plugins, "a.json", {"App": {"from": "a"}})
+    write_plugin(plugins, "b.json", {"App": {"from": "b"}, "Other": {}})
+    assert load_plugins(str(plugins)) == {"App": {"from": "a"}, "Other": {}}
+    assert find_duplicate_plugins(str(plugins)) == {"App": ["a.json", "b.json"]}
+    assert "[WARN]" in capsys.readouterr().out
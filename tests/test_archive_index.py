@@ -0,0 +1,33 @@
+import os
+from conftest import make_app, read_tree, write_tree
+from backup_engine import backup_app, restore_from_archive
+from restore_engine import restore_app, browse_app
+from archive_index import ArchiveIndex
+
+
+def test_single_file_restore(work):
+    files = {f"f{i}.txt": f"file {i}".encode() * 100 for i in range(50)}
+    data = make_app(work, files)
+    backup_app("App", data, zip_enabled=True)
+    zip_path = os.path.join("Backup", "App_backup.zip")
+    with ArchiveIndex(zip_path) as index:
+        assert index.indexed
+        assert index.lookup("Data/f7.txt").size == len(files["f7.txt"])
+        assert index.lookup("Data/missing.txt") is None
+    assert len(browse_app("App")) == 50
+    assert restore_app("App", data, target_dir=str(work / "out"), paths=["Data/f7.txt"])
+    assert read_tree(work / "out") == {"Data/f7.txt": files["f7.txt"]}
+
+
+def test_corrupt_member_leaves_target_untouched(work):
+    write_tree(work / "src", {"App_reg.reg": os.urandom(200_000)})
+    data = {"files": [str(work / "src" / "App_reg.reg")], "folders": []}
+    backup_app("App", data, zip_enabled=True)
+    zip_path = os.path.join("Backup", "App_backup.zip")
+    raw = bytearray(open(zip_path, "rb").read())
+    raw[1000] ^= 0xFF
+    open(zip_path, "wb").write(raw)
+    (work / "old.reg").write_bytes(b"old")
+    assert restore_from_archive(zip_path, "App_reg.reg", str(work / "old.reg")) == 0
+    assert (work / "old.reg").read_bytes() == b"old"
+    assert sorted(os.listdir(work)) == ["Backup", "old.reg", "src"]
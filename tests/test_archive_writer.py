@@ -0,0 +1,195 @@
+import os, io, zipfile, threading
+import pytest
+import archive_writer
+import tree_walk
+from archive_writer import StreamingZip, BLOCK_SIZE
+from archive_index import ArchiveIndex
+
+try:
+    import cryptography
+except ImportError:
+    cryptography = None
+
+SECRETS = [None, pytest.param(b"pw", marks=pytest.mark.skipif(cryptography is None, reason="нет cryptography"))]
+
+
+class BrokenReader(io.FileIO):
+    # Отдаёт первый блок, затем «диск отвалился»
+    def read(self, n=-1):
+        if self.tell():
+            raise OSError(5, "Input/output error", self.name)
+        return super().read(n)
+
+
+class FailingReader(io.FileIO):
+    def read(self, n=-1):
+        raise OSError(5, "Input/output error", self.name)
+
+
+def opener(locked=(), broken=(), failing=()):
+    def fake(path, mode="r", *args, **kwargs):
+        name = os.path.basename(path)
+        if name in locked:
+            raise PermissionError(13, "Permission denied", path)
+        if name in broken:
+            return BrokenReader(path, "rb")
+        if name in failing:
+            return FailingReader(path, "rb")
+        return open(path, mode, *args, **kwargs)
+    return fake
+
+
+def read_back(path, secret):
+    with ArchiveIndex(path, secret) as index:
+        out = {}
+        for entry in index.entries():
+            with index.open(entry) as f:
+                out[entry.name] = f.read()
+        return out
+
+
+@pytest.fixture
+def tree(work):
+    src = work / "src"
+    src.mkdir()
+    files = {
+        "a.txt": b"a" * 1000,
+        "big.bin": os.urandom(3 * BLOCK_SIZE + 5),
+        "c.txt": b"c" * 1000,
+        "d.bin": os.urandom(2 * BLOCK_SIZE),
+    }
+    for name, data in files.items():
+        (src / name).write_bytes(data)
+    return src, files
+
+
+@pytest.mark.parametrize("level", [None, 0, 1, 9])
+def test_roundtrip(tree, level):
+    src, files = tree
+    with StreamingZip("x.zip", level=level, max_pending=2) as z:
+        z.add_tree(str(src), "src")
+    with zipfile.ZipFile("x.zip") as zf:
+        assert zf.testzip() is None
+        assert {n: zf.read(n) for n in zf.namelist() if n.startswith("src/")} == \
+            {f"src/{n}": d for n, d in files.items()}
+
+
+def test_members_compress_in_pool(work, monkeypatch):
+    src = work / "many"
+    src.mkdir()
+    files = {f"f{i}.txt": (f"line {i}\n" * 5000).encode() for i in range(40)}
+    files["photo.jpg"] = os.urandom(10_000)
+    for name, data in files.items():
+        (src / name).write_bytes(data)
+    threads = set()
+    compress = archive_writer._read_and_compress
+
+    def tracking(*args):
+        threads.add(threading.current_thread().name)
+        return compress(*args)
+    monkeypatch.setattr(archive_writer, "_read_and_compress", tracking)
+    with StreamingZip("x.zip") as z:
+        z.add_tree(str(src), "many")
+    # Сжатие идёт в пуле, а не в потоке, который пишет архив
+    assert threads and all(name.startswith("compress") for name in threads)
+    with zipfile.ZipFile("x.zip") as zf:
+        assert zf.getinfo("many/photo.jpg").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("many/f0.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert {n[5:]: zf.read(n) for n in zf.namelist() if n.startswith("many/")} == files
+
+
+@pytest.mark.skipif("zstd" not in archive_writer.CODECS, reason="нет zstandard")
+def test_zstd_roundtrip(tree):
+    src, files = tree
+    with StreamingZip("x.zip", codec="zstd", level="fast") as z:
+        z.add_tree(str(src), "src")
+    assert read_back("x.zip", None) == {f"src/{n}": d for n, d in files.items()}
+
+
+@pytest.mark.parametrize("secret", SECRETS)
+def test_unreadable_and_vanished_files_are_skipped(tree, monkeypatch, secret):
+    src, files = tree
+    walk = archive_writer.iter_tree
+
+    def vanishing(*args, **kwargs):
+        # big.bin удаляется между обходом и открытием
+        for path, key, st in walk(*args, **kwargs):
+            if key.endswith("big.bin"):
+                os.remove(path)
+            yield path, key, st
+    monkeypatch.setattr(archive_writer, "iter_tree", vanishing)
+    monkeypatch.setattr(archive_writer, "open", opener(locked={"c.txt"}), raising=False)
+    with StreamingZip("x.zip", secret=secret) as z:
+        z.add_tree(str(src), "src")
+    assert sorted(name for name, _ in z.failed) == ["src/big.bin", "src/c.txt"]
+    assert read_back("x.zip", secret) == {"src/a.txt": files["a.txt"], "src/d.bin": files["d.bin"]}
+
+
+@pytest.mark.parametrize("secret", SECRETS)
+def test_read_errors_drop_only_that_member(tree, monkeypatch, secret):
+    src, files = tree
+    # big.bin ломается после первого блока, a.txt не читается в пуле сжатия
+    monkeypatch.setattr(archive_writer, "open", opener(broken={"big.bin"}, failing={"a.txt"}), raising=False)
+    with StreamingZip("x.zip", secret=secret, max_pending=1) as z:
+        z.add_tree(str(src), "src")
+    assert sorted(name for name, _ in z.failed) == ["src/a.txt", "src/big.bin"]
+    assert z.count == 2
+    assert read_back("x.zip", secret) == {"src/c.txt": files["c.txt"], "src/d.bin": files["d.bin"]}
+    if secret is None:
+        with zipfile.ZipFile("x.zip") as zf:
+            assert zf.testzip() is None
+
+
+def test_unreadable_folder_is_skipped(tree, monkeypatch):
+    src, files = tree
+    (src / "Sub").mkdir()
+    (src / "Sub" / "x.txt").write_bytes(b"x")
+    scandir = os.scandir
+
+    def failing_scandir(path="."):
+        if str(path).endswith("Sub"):
+            raise PermissionError(13, "Permission denied", path)
+        return scandir(path)
+
+    with monkeypatch.context() as m:
+        m.setattr(tree_walk.os, "scandir", failing_scandir)
+        with StreamingZip("x.zip") as z:
+            z.add_tree(str(src), "src")
+    assert [name for name, _ in z.failed] == ["src/Sub/"]
+    assert read_back("x.zip", None) == {f"src/{n}": d for n, d in files.items()}
+
+
+def test_nothing_readable_leaves_no_archive(tree, monkeypatch):
+    src, _ = tree
+    monkeypatch.setattr(archive_writer, "open", opener(locked={"a.txt", "big.bin", "c.txt", "d.bin"}),
+                        raising=False)
+    with StreamingZip("x.zip") as z:
+        z.add_tree(str(src), "src")
+    assert len(z.failed) == 4
+    assert not os.path.exists("x.zip")
+
+
+def test_backup_logs_skipped_member(tree, monkeypatch):
+    src, files = tree
+    import backup_engine
+    monkeypatch.setattr(archive_writer, "open", opener(locked={"c.txt"}), raising=False)
+    with backup_engine.capture_log() as lines:
+        assert backup_engine.backup_app("App", {"files": [], "folders": [str(src)]}, zip_enabled=True)
+    assert any(line.startswith("[ERROR] ZIP file: src/c.txt") for line in lines)
+    assert sorted(read_back(os.path.join("Backup", "App_backup.zip"), None)) == ["src/a.txt", "src/big.bin", "src/d.bin"]
+
+
+def test_registry_export_does_not_need_backup_dir(work, monkeypatch):
+    import backup_engine
+    exported = []
+
+    def fake_run(cmd, check):
+        exported.append(cmd[3])
+        with open(cmd[3], "wb") as f:
+            f.write(b"Windows Registry Editor Version 5.00\r\n")
+    monkeypatch.setattr(backup_engine.subprocess, "run", fake_run)
+    with StreamingZip("x.zip") as z:
+        backup_engine.archive_registry_key(r"HKCU\Software\App", z, "App_reg.reg")
+    assert not os.path.exists("Backup")
+    assert not os.path.exists(exported[0])
+    assert read_back("x.zip", None) == {"App_reg.reg": b"Windows Registry Editor Version 5.00\r\n"}
@@ -0,0 +1,106 @@
+import os
+import pytest
+from conftest import make_app, read_tree, touch_later
+import backup_engine
+import tree_walk
+import copy_engine
+from backup_engine import backup_app
+from restore_engine import restore_app
+from chunk_store import ChunkStore
+from manifest import load_manifest, manifest_path, hash_file
+
+FILES = {
+    "settings.json": b'{"theme": "dark"}',
+    "Profile/notes.txt": b"hello\n" * 1000,
+    "Profile/big.bin": os.urandom(3 * 1024 * 1024 + 7),
+    "Profile/empty": b"",
+}
+
+
+@pytest.fixture
+def app(work):
+    return make_app(work, {f"f{i}.txt": f"v1 {i}".encode() for i in range(20)})
+
+
+def failing(fn, name):
+    def wrapper(src, *args, **kwargs):
+        if src.endswith(name):
+            raise PermissionError(13, "Permission denied", src)
+        return fn(src, *args, **kwargs)
+    return wrapper
+
+
+def test_roundtrip(work):
+    data = make_app(work, FILES)
+    assert backup_app("App", data)
+    assert restore_app("App", data, target_dir=str(work / "out"))
+    assert read_tree(work / "out" / "Data") == FILES
+
+
+def test_mirror_after_dedup_copies_changed_file(work, app):
+    # Индекс снимков не должен заставлять зеркало пропустить изменённый файл
+    path = work / "src" / "Data" / "f1.txt"
+    backup_app("App", app)
+    touch_later(path, b"v2")
+    backup_app("App", app, store=ChunkStore())
+    backup_app("App", app)
+    mirror = os.path.join("Backup", "App", "Data", "f1.txt")
+    assert open(mirror, "rb").read() == b"v2"
+    manifest = load_manifest(manifest_path(os.path.join("Backup", "App")))
+    assert manifest["files"]["Data/f1.txt"]["digest"] == hash_file(mirror)
+
+
+def test_mirror_recopies_when_copy_differs(work, app):
+    backup_app("App", app)
+    with open(os.path.join("Backup", "App", "Data", "f2.txt"), "wb") as f:
+        f.write(b"damaged")
+    backup_app("App", app)
+    assert open(os.path.join("Backup", "App", "Data", "f2.txt"), "rb").read() == b"v1 2"
+
+
+def test_unreadable_file_does_not_abort_mirror(work, app, monkeypatch):
+    backup_app("App", app)
+    for i in range(20):
+        touch_later(work / "src" / "Data" / f"f{i}.txt", f"v2 {i}".encode())
+    mirror = os.path.join("Backup", "App", "Data")
+    with monkeypatch.context() as m:
+        m.setattr(copy_engine, "copy2_hashed", failing(copy_engine.copy2_hashed, "f7.txt"))
+        with backup_engine.capture_log() as lines:
+            backup_app("App", app)
+    assert any(line.startswith("[ERROR] File:") and "f7.txt" in line for line in lines)
+    # Прошлая копия нечитаемого файла осталась, остальные обновлены
+    assert open(os.path.join(mirror, "f7.txt"), "rb").read() == b"v1 7"
+    assert open(os.path.join(mirror, "f8.txt"), "rb").read() == b"v2 8"
+    manifest = load_manifest(manifest_path(os.path.join("Backup", "App")))
+    assert len(manifest["files"]) == 20
+
+    backup_app("App", app)
+    assert open(os.path.join(mirror, "f7.txt"), "rb").read() == b"v2 7"
+
+
+def test_unreadable_folder_keeps_previous_copies(work, monkeypatch):
+    data = make_app(work, {"top.txt": b"v1", "Sub/a.txt": b"v1 a", "Sub/Deep/b.txt": b"v1 b"})
+    backup_app("App", data)
+    for rel in ("top.txt", "Sub/a.txt", "Sub/Deep/b.txt"):
+        touch_later(work / "src" / "Data" / rel, b"v2")
+    scandir = os.scandir
+    locked = str(work / "src" / "Data" / "Sub")
+
+    def failing_scandir(path="."):
+        if str(path) == locked:
+            raise PermissionError(13, "Permission denied", path)
+        return scandir(path)
+
+    with monkeypatch.context() as m:
+        m.setattr(tree_walk.os, "scandir", failing_scandir)
+        with backup_engine.capture_log() as lines:
+            backup_app("App", data)
+    assert any(line.startswith("[ERROR] Folder:") and locked in line for line in lines)
+    # Обход дошёл до остальных файлов, а поддерево с прошлого раза не удалено из зеркала
+    mirror = work / "Backup" / "App" / "Data"
+    assert read_tree(mirror) == {"top.txt": b"v2", "Sub/a.txt": b"v1 a", "Sub/Deep/b.txt": b"v1 b"}
+    manifest = load_manifest(manifest_path(os.path.join("Backup", "App")))
+    assert set(manifest["files"]) == {"Data/top.txt", "Data/Sub/a.txt", "Data/Sub/Deep/b.txt"}
+
+    backup_app("App", data)
+    assert read_tree(mirror) == {"top.txt": b"v2", "Sub/a.txt": b"v2", "Sub/Deep/b.txt": b"v2"}
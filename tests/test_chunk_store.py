@@ -0,0 +1,127 @@
+import os, io
+import pytest
+from conftest import make_app, read_tree, touch_later
+import chunk_store
+import backup_engine
+from backup_engine import backup_app
+from restore_engine import restore_app
+from chunk_store import ChunkStore
+
+FILES = {
+    "settings.json": b'{"theme": "dark"}',
+    "Profile/notes.txt": b"hello\n" * 1000,
+    "Profile/big.bin": os.urandom(3 * 1024 * 1024 + 7),
+    "Profile/empty": b"",
+}
+
+
+@pytest.fixture
+def app(work):
+    return make_app(work, {f"f{i}.txt": f"v1 {i}".encode() for i in range(20)})
+
+
+def test_roundtrip(work):
+    data = make_app(work, FILES)
+    store = ChunkStore()
+    assert backup_app("App", data, store=store)
+    assert backup_app("App", data, store=store)
+    assert len(store.list_snapshots("App")) == 2
+    assert restore_app("App", data, target_dir=str(work / "out"), store=store)
+    assert read_tree(work / "out" / "Data") == FILES
+
+
+def test_unreadable_file_marks_snapshot_incomplete(work, app, monkeypatch):
+    store = ChunkStore()
+    backup_app("App", app, store=store)
+    touch_later(work / "src" / "Data" / "f3.txt", b"v2")
+    put_file = ChunkStore.put_file
+
+    def flaky(self, path):
+        if path.endswith("f3.txt"):
+            raise PermissionError(13, "Permission denied", path)
+        return put_file(self, path)
+    monkeypatch.setattr(ChunkStore, "put_file", flaky)
+    backup_app("App", app, store=store)
+    manifest = store.load_manifest("App")
+    assert manifest["failed"] == ["Data/f3.txt"]
+    assert store.list_incomplete("App") == store.list_snapshots("App")[1:]
+    # В снимок попала прошлая версия файла
+    assert len(manifest["files"]) == 20
+    keep, drop, _ = store.prune("App", keep_last=1)
+    assert len(keep) == 2 and not drop
+
+
+def test_aborted_walk_is_not_committed(work, app, monkeypatch):
+    store = ChunkStore()
+    backup_app("App", app, store=store)
+    good = store.list_snapshots("App")
+
+    def broken(*args, **kwargs):
+        raise OSError("обход сломан")
+        yield
+    monkeypatch.setattr(chunk_store, "iter_tree", broken)
+    backup_app("App", app, store=store)
+    assert store.list_snapshots("App") == good
+    store.prune("App", keep_last=1)
+    assert store.list_snapshots("App") == good
+
+
+def test_prune_and_history_do_not_read_manifests(work, app, monkeypatch):
+    store = ChunkStore()
+    for i in range(5):
+        backup_app("App", app, store=store)
+    sids = store.list_snapshots("App")
+    open(os.path.join(store.manifests_dir, "App", sids[4] + chunk_store.INCOMPLETE), "wb").close()
+    loaded = []
+    load = ChunkStore.load_manifest
+    monkeypatch.setattr(ChunkStore, "load_manifest", lambda self, *a: loaded.append(a) or load(self, *a))
+    assert store.list_incomplete("App") == [sids[4]]
+    keep, drop, _ = store.prune("App", keep_last=5)
+    assert (keep, drop) == (sids, []) and not loaded
+    keep, drop, _ = store.prune("App", keep_last=2)
+    # Удаляемые снимки читаются (их чанки освобождаются), остальные — нет
+    assert keep == [sids[2], sids[3], sids[4]] and drop == sids[:2]
+    assert sorted(loaded) == [("App", sid) for sid in sids[:2]]
+
+
+def chunk_sizes(data):
+    return [len(c) for c in chunk_store.iter_chunks(io.BytesIO(data))]
+
+
+@pytest.mark.parametrize("kind", ["random", "text", "zeros"])
+def test_chunks_are_bounded_and_survive_insertions(kind):
+    if kind == "random":
+        data = os.urandom(24 * 1024 * 1024)
+    elif kind == "text":
+        data = b"".join(f"{i:08d} name=user{i % 977} value={i * 7919 % 100003}\n".encode() for i in range(600_000))
+    else:
+        data = bytes(12 * 1024 * 1024)
+    chunks = list(chunk_store.iter_chunks(io.BytesIO(data)))
+    assert b"".join(chunks) == data
+    assert all(chunk_store.MIN_CHUNK <= len(c) <= chunk_store.MAX_CHUNK for c in chunks[:-1])
+    # Вставка в начало сдвигает данные, но границы определяются содержимым и совпадают дальше
+    shifted = data[:1000] + b"inserted" + data[1000:]
+    before = {chunk_store.chunk_digest(c) for c in chunks}
+    after = [chunk_store.chunk_digest(c) for c in chunk_store.iter_chunks(io.BytesIO(shifted))]
+    assert sum(d not in before for d in after) <= 2
+
+
+def test_restore_and_diff_use_file_digest(work, monkeypatch):
+    import restore_engine, snapshot_diff
+    from snapshot_diff import diff_app
+    data = make_app(work, FILES)
+    store = ChunkStore()
+    backup_app("App", data, store=store)
+    assert all("digest" in e for e in store.load_manifest("App")["files"])
+    assert restore_app("App", data, target_dir=str(work / "out"), store=store)
+
+    def no_chunking(path):
+        raise AssertionError(f"файл нарезается заново: {path}")
+    monkeypatch.setattr(restore_engine, "_chunk_list", no_chunking)
+    monkeypatch.setattr(snapshot_diff, "_file_chunks", no_chunking)
+    with backup_engine.capture_log() as lines:
+        assert restore_app("App", data, target_dir=str(work / "out"), store=store)
+    assert f"восстановлено 0, уже совпадало {len(FILES)}, ошибок 0" in lines[-1]
+    path = work / "src" / "Data" / "Profile" / "big.bin"
+    os.utime(path, ns=(0, 0))
+    assert not diff_app("App", data, store)
@@ -0,0 +1,35 @@
+import os, errno
+import pytest
+import copy_engine
+from manifest import new_hash
+
+
+def expected(data):
+    h = new_hash()
+    h.update(data)
+    return h.hexdigest()
+
+
+@pytest.mark.parametrize("size", [0, 5, 9 * 1024 * 1024 + 3])
+def test_copy2_hashed(work, size):
+    data = os.urandom(size)
+    (work / "src").write_bytes(data)
+    h = new_hash()
+    strategy = copy_engine.copy2_hashed("src", "dst", h)
+    assert (work / "dst").read_bytes() == data
+    assert h.hexdigest() == expected(data)
+    if copy_engine._HASHED_STRATEGIES and strategy != "reflink+hash":
+        assert strategy == copy_engine._HASHED_STRATEGIES[0][0] + "+hash"
+
+
+def test_copy2_hashed_falls_back(work, monkeypatch):
+    def unsupported(fin, fout, offset, n):
+        raise OSError(errno.EXDEV, "другое устройство")
+    monkeypatch.setattr(copy_engine, "_HASHED_STRATEGIES", [("test-range", unsupported)])
+    monkeypatch.setattr(copy_engine, "fcntl", None)
+    data = os.urandom(100_000)
+    (work / "src").write_bytes(data)
+    h = new_hash()
+    assert copy_engine.copy2_hashed("src", "dst", h) == "copy+hash"
+    assert (work / "dst").read_bytes() == data
+    assert h.hexdigest() == expected(data)
@@ -0,0 +1,33 @@
+import os, threading, time
+from conftest import write_tree
+from daemon import BackupDaemon
+from backup_engine import backup_app
+from progress import Progress, CancelToken
+from scheduler import run_jobs
+
+
+def test_failed_run_keeps_app_pending(work):
+    write_tree(work / "src", {"a.txt": b"1"})
+    apps = {"App": {"files": [], "folders": [str(work / "src")]}}
+    daemon = BackupDaemon(apps, lambda todo: [None] * len(todo), state_path="state.json", watch=False)
+    daemon.start()
+    daemon.run(["App"])
+    assert "App" in daemon.pending
+    assert "fingerprint" not in daemon.state["App"]
+
+    daemon.run_backup = lambda todo: [True] * len(todo)
+    daemon.run(["App"])
+    assert "App" not in daemon.pending
+    assert daemon.state["App"]["fingerprint"]
+
+
+def test_cancel_stops_running_job(work):
+    write_tree(work / "src", {f"f{i}.bin": os.urandom(4 * 1024 * 1024) for i in range(40)})
+    data = {"files": [], "folders": [str(work / "src")]}
+    token = CancelToken()
+    tracker = Progress(None, token)
+    threading.Timer(0.1, token.cancel).start()
+    started = time.monotonic()
+    assert run_jobs(["App"], lambda app: tracker.call(backup_app, app, data), cancel=token) == [None]
+    assert time.monotonic() - started < 5
+    assert len(os.listdir(os.path.join("Backup", "App", "src"))) < 40
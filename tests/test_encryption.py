@@ -0,0 +1,52 @@
+import os, zipfile
+import pytest
+from conftest import make_app, read_tree
+from archive_writer import StreamingZip
+from archive_index import ArchiveIndex, ZIP_ENCRYPTED, _method
+from backup_engine import backup_app
+from restore_engine import restore_app
+from encryption import PassphraseError
+
+pytest.importorskip("cryptography")
+
+FILES = {
+    "settings.json": b'{"theme": "dark"}',
+    "Profile/notes.txt": b"hello\n" * 1000,
+    "Profile/big.bin": os.urandom(3 * 1024 * 1024 + 7),
+    "Profile/empty": b"",
+}
+
+
+def test_roundtrip(work):
+    data = make_app(work, FILES)
+    assert backup_app("App", data, zip_enabled=True, zip_options={"secret": b"secret"})
+    assert restore_app("App", data, target_dir=str(work / "out"), secret=b"secret")
+    assert read_tree(work / "out" / "Data") == FILES
+
+
+def test_wrong_secret(work):
+    (work / "a.txt").write_bytes(b"text")
+    with StreamingZip("x.zip", secret=b"pw") as z:
+        z.add_file("a.txt", "a.txt")
+    with pytest.raises(PassphraseError):
+        ArchiveIndex("x.zip", b"other")
+
+
+def test_encrypted_members_hide_crc_and_use_private_method(work):
+    (work / "a.txt").write_bytes(b"secret text " * 1000)
+    (work / "b.bin").write_bytes(os.urandom(3 * 1024 * 1024))
+    with StreamingZip("x.zip", secret=b"pw") as z:
+        z.add_file("a.txt", "a.txt")
+        z.add_file("b.bin", "b.bin")
+    with zipfile.ZipFile("x.zip") as zf:
+        members = {i.filename: i for i in zf.infolist()}
+    for name in ("a.txt", "b.bin"):
+        info = members[name]
+        assert info.CRC == 0
+        assert not info.flag_bits & 0x01
+        assert info.compress_type == ZIP_ENCRYPTED
+        assert _method(info) == zipfile.ZIP_DEFLATED
+    with ArchiveIndex("x.zip", b"pw") as index:
+        assert {e.name: e.crc for e in index.entries()} == {"a.txt": 0, "b.bin": 0}
+        with index.open(index.lookup("a.txt")) as f:
+            assert f.read() == b"secret text " * 1000
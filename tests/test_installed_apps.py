@@ -0,0 +1,36 @@
+import json, itertools
+import pytest
+from installed_apps import InstalledAppIndex, FileRegistryBackend, UNINSTALL_KEYS, APP_PATHS_KEY
+
+
+@pytest.fixture
+def index(tmp_path):
+    # Свой файл реестра и кэш на каждый вызов: кэш с тем же last_write вернул бы прошлые имена
+    counter = itertools.count()
+
+    def make(display_names, app_paths=()):
+        registry = {
+            "\\".join(UNINSTALL_KEYS[0]): {"last_write": 1, "keys": {
+                str(i): {"DisplayName": name} for i, name in enumerate(display_names)}},
+            "\\".join(APP_PATHS_KEY): {"last_write": 1, "keys": {name: {} for name in app_paths}},
+        }
+        n = next(counter)
+        path = tmp_path / f"registry{n}.json"
+        path.write_text(json.dumps(registry), encoding="utf-8")
+        return InstalledAppIndex(FileRegistryBackend(str(path)), str(tmp_path / f"cache{n}")).load()
+    return make
+
+
+def test_aliases_work_both_ways(index):
+    assert index(["Google Chrome"]).is_installed("Chrome")
+    assert index(["Google Chrome"]).is_installed("Google Chrome")
+    assert index([], ["chrome.exe"]).is_installed("Google Chrome")
+    assert index(["Telegram Desktop version 4.8.4"]).is_installed("Telegram")
+    assert index(["Sublime Text Build 4169"]).is_installed("Sublime Text 3")
+
+
+def test_runtimes_and_partial_words_do_not_match(index):
+    assert not index(["Microsoft Edge WebView2 Runtime", "Microsoft Edge Update"]).is_installed("Microsoft Edge")
+    assert not index(["Code Composer Studio 12.1.0"]).is_installed("Visual Studio Code")
+    assert not index(["GitHub Desktop"]).is_installed("Git")
+    assert index([], ["Code.exe"]).is_installed("Visual Studio Code")
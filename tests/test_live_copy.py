@@ -0,0 +1,63 @@
+import os, shutil, sqlite3
+import pytest
+import live_copy
+from backup_engine import backup_app
+from chunk_store import ChunkStore
+from live_copy import LiveStaging
+
+
+@pytest.fixture
+def app(work):
+    folder = work / "src" / "Data"
+    (folder / "ldb").mkdir(parents=True)
+    for name in ("CURRENT", "MANIFEST-000001", "000003.log", "LOCK"):
+        (folder / "ldb" / name).write_bytes(name.encode())
+    db = sqlite3.connect(folder / "History")
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE t (x)")
+    db.execute("INSERT INTO t VALUES (1)")
+    db.commit()
+    yield {"files": [], "folders": [str(folder)]}, db
+    db.close()
+
+
+class Counting(LiveStaging):
+    runs = []
+
+    def __exit__(self, *exc):
+        Counting.runs.append((self.sqlite, self.leveldb, self.unchanged))
+        return super().__exit__(*exc)
+
+
+@pytest.mark.parametrize("dedup", [False, True])
+def test_unchanged_databases_are_not_restaged(work, app, monkeypatch, dedup):
+    data, db = app
+    store = ChunkStore() if dedup else None
+    Counting.runs = []
+    monkeypatch.setattr("backup_engine.LiveStaging", Counting)
+    backup_app("App", data, store=store)
+    backup_app("App", data, store=store)
+    db.execute("INSERT INTO t VALUES (2)")
+    db.commit()
+    backup_app("App", data, store=store)
+    assert Counting.runs == [(1, 1, 0), (0, 0, 2), (1, 0, 1)]
+    if not dedup:
+        copy = sqlite3.connect(os.path.join("Backup", "App", "Data", "History"))
+        assert copy.execute("SELECT COUNT(*) FROM t").fetchone() == (2,)
+        copy.close()
+
+
+def test_leveldb_skips_lock_and_unreadable_files(work, app, monkeypatch):
+    data, _ = app
+    copy2 = shutil.copy2
+
+    def locked(src, dst, **kwargs):
+        if src.endswith(".log"):
+            raise PermissionError(13, "locked", src)
+        return copy2(src, dst, **kwargs)
+    monkeypatch.setattr(live_copy.shutil, "copy2", locked)
+    with LiveStaging("App") as live:
+        entries = list(os.scandir(data["folders"][0] + "/ldb"))
+        staged = live.stage_leveldb("ldb", entries)
+        assert sorted(name for _, name, _ in staged) == ["CURRENT", "MANIFEST-000001"]
+        assert any("000003.log" in w for w in live.warnings)
@@ -0,0 +1,43 @@
+import os, json, threading
+from conftest import make_app
+import metrics
+from backup_engine import backup_app
+from metrics import RunReport, OpMetrics, format_op
+
+
+def test_slowest_keeps_top_files():
+    op = OpMetrics("App")
+    for i in range(metrics.SLOWEST + 5):
+        op.add_file(f"f{i}", 10, i / 100)
+    d = op.as_dict()
+    assert d["files"] == metrics.SLOWEST + 5 and d["bytes"] == 10 * (metrics.SLOWEST + 5)
+    assert [item["path"] for item in d["slowest"]][:2] == [f"f{metrics.SLOWEST + 4}", f"f{metrics.SLOWEST + 3}"]
+    assert len(d["slowest"]) == metrics.SLOWEST
+
+
+def test_current_op_is_per_thread():
+    report = RunReport("backup")
+    seen = []
+    with report.track("A"):
+        metrics.record_file("a", 5, 0.1)
+        # Другие потоки операцию не наследуют — пулы движков передают её явно
+        t = threading.Thread(target=lambda: seen.append(metrics.current()))
+        t.start()
+        t.join()
+        with metrics.phase("read"):
+            pass
+    assert metrics.current() is None
+    assert seen == [None]
+    op = report.ops[0]
+    assert op.files == 1 and "read" in op.phases and op.wall is not None
+
+
+def test_report_for_backup_run(work):
+    data = make_app(work, {"a.bin": os.urandom(100_000), "b.txt": b"b"})
+    report = RunReport("backup")
+    assert report.call("App", backup_app, "App", data, zip_enabled=True)
+    path = report.save(str(work / "Logs"))
+    saved = json.loads(open(path, encoding="utf-8").read())
+    assert saved["mode"] == "backup" and saved["files"] == 2 and saved["bytes"] == 100_001
+    assert {"read", "compress"} <= set(saved["ops"][0]["phases_s"])
+    assert format_op(saved["ops"][0])[0].startswith("[STATS] App: 2 файлов")
@@ -0,0 +1,71 @@
+import os, threading
+from types import SimpleNamespace
+import pytest
+from conftest import make_app, read_tree, touch_later
+import pipeline
+import tree_walk
+import backup_engine
+from backup_engine import backup_app
+from restore_engine import restore_app
+from chunk_store import ChunkStore
+
+
+def items(n, size=10):
+    return [(f"/src/{i}", f"src/{i}", SimpleNamespace(st_size=size)) for i in range(n)]
+
+
+def test_every_file_reaches_sink_once():
+    files = items(500)
+    seen, sink_threads = [], set()
+
+    def sink(batch, results):
+        sink_threads.add(threading.get_ident())
+        assert results == [key.upper() for _, key, _ in batch]
+        seen.extend(key for _, key, _ in batch)
+
+    pipeline.run(pipeline.run_files(iter(files), lambda batch: [key.upper() for _, key, _ in batch], sink))
+    assert sorted(seen) == sorted(key for _, key, _ in files)
+    # Итоги собираются в одном потоке — том, где крутится цикл событий
+    assert sink_threads == {threading.get_ident()}
+
+
+def test_batches_split_by_count_and_bytes():
+    sizes = [len(b) for b in pipeline._batches(iter(items(pipeline.BATCH_FILES * 2 + 1)))]
+    assert sizes == [pipeline.BATCH_FILES, pipeline.BATCH_FILES, 1]
+    big = items(3, pipeline.BATCH_BYTES)
+    assert [len(b) for b in pipeline._batches(iter(big))] == [1, 1, 1]
+
+
+def test_stage_error_stops_pipeline():
+    def stage(batch):
+        raise RuntimeError("сбой обработчика")
+
+    with pytest.raises(RuntimeError):
+        pipeline.run(pipeline.run_files(iter(items(200)), stage, lambda batch, results: None))
+
+
+def test_unreadable_folder_marks_snapshot_incomplete(work, monkeypatch):
+    data = make_app(work, {"top.txt": b"v1", "Sub/a.txt": b"v1 a", "Sub/Deep/b.txt": b"v1 b"})
+    store = ChunkStore()
+    backup_app("App", data, store=store)
+    touch_later(work / "src" / "Data" / "top.txt", b"v2")
+    scandir = os.scandir
+    locked = str(work / "src" / "Data" / "Sub")
+
+    def failing_scandir(path="."):
+        if str(path) == locked:
+            raise PermissionError(13, "Permission denied", path)
+        return scandir(path)
+
+    with monkeypatch.context() as m:
+        m.setattr(tree_walk.os, "scandir", failing_scandir)
+        with backup_engine.capture_log() as lines:
+            backup_app("App", data, store=store)
+    assert any(line.startswith("[ERROR] Folder:") and locked in line for line in lines)
+    # Снимок сохранён, но неполный: поддерево взято из прошлого снимка, остальное — свежее
+    assert len(store.list_snapshots("App")) == 2
+    assert store.list_incomplete("App") == store.list_snapshots("App")[1:]
+    manifest = store.load_manifest("App")
+    assert manifest["failed"] == ["Data/Sub"]
+    assert restore_app("App", data, target_dir=str(work / "out"), store=store)
+    assert read_tree(work / "out" / "Data") == {"top.txt": b"v2", "Sub/a.txt": b"v1 a", "Sub/Deep/b.txt": b"v1 b"}
@@ -0,0 +1,44 @@
+import os
+import pytest
+from conftest import make_app
+from backup_engine import backup_app, prescan
+from chunk_store import ChunkStore
+from progress import Progress, CancelToken, Cancelled, format_eta, format_progress
+
+FILES = {f"f{i}.bin": os.urandom(50_000) for i in range(30)}
+
+
+@pytest.mark.parametrize("mode", ["mirror", "zip", "dedup"])
+def test_progress_reaches_total(work, mode):
+    data = make_app(work, FILES)
+    updates = []
+    tracker = Progress(lambda p: updates.append(p.done), interval=0)
+    prescan(tracker, [data])
+    assert (tracker.total, tracker.total_files) == (30 * 50_000, 30)
+    kwargs = {"zip_enabled": True} if mode == "zip" else {"store": ChunkStore()} if mode == "dedup" else {}
+    assert tracker.call(backup_app, "App", data, **kwargs)
+    assert tracker.done == tracker.total and tracker.files == 30
+    assert updates == sorted(updates) and updates[-1] == tracker.total
+    assert format_progress(tracker).startswith("100% — 1.5 из 1.5 MB, файлов 30/30")
+
+
+def test_cancel_stops_backup(work):
+    data = make_app(work, FILES)
+    token = CancelToken()
+
+    def on_update(p):
+        if p.files >= 3:
+            token.cancel()
+    tracker = Progress(on_update, token, interval=0)
+    prescan(tracker, [data])
+    with pytest.raises(Cancelled):
+        tracker.call(backup_app, "App", data, store=ChunkStore())
+    assert tracker.files < 30
+    # Прерванный снимок не сохраняется
+    assert ChunkStore().list_snapshots("App") == []
+
+
+def test_format_eta():
+    assert format_eta(None) == "—"
+    assert format_eta(75) == "1:15"
+    assert format_eta(3725) == "1:02:05"
@@ -0,0 +1,51 @@
+import os
+import pytest
+from conftest import make_app, read_tree, touch_later
+from backup_engine import backup_app
+from restore_engine import restore_app, browse_app, needs_secret
+
+FILES = {
+    "settings.json": b'{"theme": "dark"}',
+    "Profile/notes.txt": b"hello\n" * 1000,
+    "Profile/big.bin": os.urandom(3 * 1024 * 1024 + 7),
+    "Profile/empty": b"",
+}
+
+
+@pytest.fixture
+def app(work):
+    return make_app(work, {"a.txt": b"v1"})
+
+
+def test_zip_roundtrip(work):
+    data = make_app(work, FILES)
+    assert backup_app("App", data, zip_enabled=True)
+    assert restore_app("App", data, target_dir=str(work / "out"))
+    assert read_tree(work / "out" / "Data") == FILES
+
+
+def test_newer_archive_wins_over_mirror(work, app):
+    backup_app("App", app)
+    touch_later(work / "src" / "Data" / "a.txt", b"v2")
+    backup_app("App", app, zip_enabled=True)
+    assert browse_app("App")[0][:2] == ("Data/a.txt", 2)
+    assert restore_app("App", app, target_dir=str(work / "out"))
+    assert read_tree(work / "out") == {"Data/a.txt": b"v2"}
+
+
+def test_newer_mirror_wins_over_archive(work, app):
+    backup_app("App", app, zip_enabled=True)
+    touch_later(work / "src" / "Data" / "a.txt", b"v2")
+    backup_app("App", app)
+    assert restore_app("App", app, target_dir=str(work / "out"))
+    assert read_tree(work / "out") == {"Data/a.txt": b"v2"}
+
+
+def test_needs_secret_follows_newer_copy(work, app):
+    pytest.importorskip("cryptography")
+    backup_app("App", app)
+    backup_app("App", app, zip_enabled=True, zip_options={"secret": b"pw"})
+    assert needs_secret("App")
+    touch_later(work / "src" / "Data" / "a.txt", b"v2")
+    backup_app("App", app)
+    assert not needs_secret("App")
@@ -0,0 +1,42 @@
+import os
+from conftest import make_app, read_tree, touch_later
+from backup_engine import backup_app
+from restore_engine import restore_app
+from chunk_store import ChunkStore
+from retention import select_snapshots, has_policy
+
+
+def test_keep_last_and_periods():
+    ids = ["20240101-120000", "20240101-180000", "20240102-090000", "20240115-090000",
+           "20240201-090000", "20240201-090000-2"]
+    assert select_snapshots(ids, keep_last=2) == (ids[4:], ids[:4])
+    # По одному на день: берётся самый новый снимок дня
+    keep, drop = select_snapshots(ids, keep_daily=3)
+    assert keep == ["20240102-090000", "20240115-090000", "20240201-090000-2"]
+    keep, _ = select_snapshots(ids, keep_monthly=2)
+    assert keep == ["20240115-090000", "20240201-090000-2"]
+    keep, _ = select_snapshots(ids, keep_weekly=1, keep_daily=1)
+    assert keep == ["20240201-090000-2"]
+
+
+def test_newest_is_always_kept():
+    assert select_snapshots(["20240101-000000", "20240102-000000"]) == (["20240102-000000"], ["20240101-000000"])
+    assert not has_policy() and has_policy(keep_monthly=1)
+
+
+def test_prune_frees_only_unreferenced_chunks(work):
+    data = make_app(work, {"shared.bin": os.urandom(200_000), "own.bin": os.urandom(200_000)})
+    store = ChunkStore()
+    backup_app("App", data, store=store)
+    touch_later(work / "src" / "Data" / "own.bin", os.urandom(200_000))
+    backup_app("App", data, store=store)
+    old, new = store.list_snapshots("App")
+    keep, drop, freed = store.prune("App", keep_last=1)
+    assert (keep, drop) == ([new], [old]) and freed > 0
+    # Чанки, общие с оставшимся снимком, на месте
+    for entry in store.load_manifest("App")["files"]:
+        for digest in entry["chunks"]:
+            store.get(digest)
+    assert restore_app("App", data, target_dir=str(work / "out"), store=store)
+    assert read_tree(work / "out" / "Data") == read_tree(work / "src" / "Data")
+    assert store.prune("App", keep_last=1) == ([new], [], 0)
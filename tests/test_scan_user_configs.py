@@ -0,0 +1,73 @@
+import os
+import scan_user_configs as scan_user_configs_module
+from scan_user_configs import scan_user_configs, iter_user_configs, DiscoveryIndex
+
+
+def make_tree(root, files):
+    for rel, data in files.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+
+def test_finds_configs_and_prunes_caches(work):
+    make_tree(work / "base", {
+        "App/settings.json": b"{}",
+        "App/Sub/app.ini": b"[a]",
+        "App/readme.txt": b"no",
+        "App/Cache/cached.json": b"{}",
+        "Other/NODE_MODULES/pkg.json": b"{}",
+        "Other/conf.XML": b"<a/>",
+    })
+    found = scan_user_configs([str(work / "base")])
+    assert found == sorted(str(work / "base" / p) for p in ("App/settings.json", "App/Sub/app.ini", "Other/conf.XML"))
+
+
+def test_size_limit_and_missing_bases(work):
+    make_tree(work / "base", {"small.cfg": b"x", "huge.cfg": b"x" * 100})
+    found = list(iter_user_configs([str(work / "base"), str(work / "missing")], max_size=50, workers=2))
+    assert found == [os.path.join(str(work / "base"), "small.cfg")]
+
+
+def freeze(root):
+    # Старый mtime у всех каталогов: любое изменение после сканирования его сдвинет
+    for folder, dirs, _ in os.walk(root):
+        os.utime(folder, ns=(10**18, 10**18))
+
+
+def test_index_rescans_only_changed_dirs(work, monkeypatch):
+    make_tree(work / "base", {"A/a.json": b"{}", "B/b.ini": b"", "B/C/c.cfg": b""})
+    freeze(work / "base")
+    index_path = str(work / "discovery.idx")
+    first = sorted(DiscoveryIndex(index_path).scan([str(work / "base")]))
+    assert len(first) == 3
+
+    make_tree(work / "base", {"B/new.json": b"{}"})
+    scanned = []
+    scan_dir = scan_user_configs_module._scan_dir
+
+    def counting(path, *args):
+        scanned.append(os.path.relpath(path, work / "base"))
+        return scan_dir(path, *args)
+    monkeypatch.setattr(scan_user_configs_module, "_scan_dir", counting)
+    index = DiscoveryIndex(index_path)
+    assert sorted(index.scan([str(work / "base")])) == sorted(first + [str(work / "base" / "B" / "new.json")])
+    assert scanned == ["B"]
+    assert index.new_since_last_scan() == [str(work / "base" / "B" / "new.json")]
+
+
+def test_index_filter_change_forces_rescan(work):
+    make_tree(work / "base", {"a.json": b"{}", "b.ini": b""})
+    index_path = str(work / "discovery.idx")
+    DiscoveryIndex(index_path).scan([str(work / "base")])
+    assert list(DiscoveryIndex(index_path).scan([str(work / "base")], extensions={".ini"})) == \
+        [str(work / "base" / "b.ini")]
+
+
+def test_broken_index_is_ignored(work):
+    make_tree(work / "base", {"a.json": b"{}"})
+    index_path = work / "discovery.idx"
+    index_path.write_bytes(b"\x80\x05garbage")
+    index = DiscoveryIndex(str(index_path))
+    assert list(index.scan([str(work / "base")])) == [str(work / "base" / "a.json")]
+    assert DiscoveryIndex(str(index_path)).dirs
@@ -0,0 +1,68 @@
+import threading, time
+from backup_engine import capture_log, log
+from progress import CancelToken, Cancelled
+from scheduler import run_jobs, IOLimiter
+
+
+def test_logs_and_results_follow_input_order():
+    def job(n):
+        # Первые задания заканчиваются последними
+        time.sleep((5 - n) * 0.01)
+        log(f"job {n}")
+        return n * n
+
+    done = []
+    with capture_log() as lines:
+        results = run_jobs(range(5), job, workers=5, on_done=lambda i, item, result, out: done.append(i))
+    assert results == [0, 1, 4, 9, 16]
+    assert lines == [f"job {n}" for n in range(5)]
+    assert done == list(range(5))
+
+
+def test_job_error_does_not_stop_others():
+    def job(n):
+        if n == 1:
+            raise ValueError("сломалось")
+        return n
+
+    with capture_log() as lines:
+        assert run_jobs([0, 1, 2], job, workers=2) == [0, None, 2]
+    assert lines == ["[ERROR] 1: сломалось"]
+
+
+def test_cancel_skips_pending_jobs():
+    token = CancelToken()
+
+    def job(n):
+        if n == 0:
+            token.cancel()
+            raise Cancelled()
+        return n
+
+    with capture_log() as lines:
+        assert run_jobs([0, 1, 2], job, workers=1, cancel=token) == [None, None, None]
+    assert lines == ["[CANCEL] 0: остановлено", "[CANCEL] 1: пропущено", "[CANCEL] 2: пропущено"]
+
+
+def test_io_limiter_bounds_copies_per_device(work):
+    limiter = IOLimiter(per_device=2)
+    (work / "a").mkdir()
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def copy():
+        with limiter.slot(str(work / "a")):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=copy) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # tmp на SSD/tmpfs — до двух одновременно; на HDD — по одному
+    assert 1 <= peak[0] <= 2
+    assert limiter._semaphore(str(work / "a")) is limiter._semaphore(str(work))
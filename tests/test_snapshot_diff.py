@@ -0,0 +1,66 @@
+import os
+import pytest
+from conftest import make_app, touch_later
+from backup_engine import backup_app
+from chunk_store import ChunkStore
+from snapshot_diff import diff_app, diff_listings, format_diff
+
+
+@pytest.fixture
+def app(work):
+    return make_app(work, {"same.txt": b"same", "touched.txt": b"touched", "edited.txt": b"aaaa",
+                           "grown.txt": b"x", "gone.txt": b"gone"})
+
+
+def change(work):
+    data = work / "src" / "Data"
+    touch_later(data / "touched.txt", b"touched")
+    touch_later(data / "edited.txt", b"bbbb")
+    touch_later(data / "grown.txt", b"xx")
+    (data / "gone.txt").unlink()
+    (data / "new.txt").write_bytes(b"new")
+
+
+def check(result):
+    assert result.added == ["Data/new.txt"]
+    assert result.removed == ["Data/gone.txt"]
+    # Тот же размер и новый mtime — решает содержимое; другой размер — изменён без чтения
+    assert result.modified == ["Data/edited.txt", "Data/grown.txt"]
+    assert result.hashed == 2
+
+
+def test_live_against_mirror(work, app):
+    backup_app("App", app)
+    assert not diff_app("App", app)
+    change(work)
+    check(diff_app("App", app))
+
+
+def test_live_against_snapshot(work, app):
+    store = ChunkStore()
+    backup_app("App", app, store=store)
+    change(work)
+    check(diff_app("App", app, store=store))
+
+
+def test_between_snapshots(work, app):
+    store = ChunkStore()
+    backup_app("App", app, store=store)
+    change(work)
+    backup_app("App", app, store=store)
+    old, new = store.list_snapshots("App")
+    result = diff_app("App", app, store=store, old=old, new=new)
+    check(result)
+    assert format_diff("App", result)[0] == "[DIFF] App: добавлено 1, удалено 1, изменено 2"
+
+
+def test_missing_copy_raises(work, app):
+    with pytest.raises(FileNotFoundError):
+        diff_app("App", app)
+
+
+def test_metadata_only_when_sizes_differ():
+    old = {"a": {"size": 1, "mtime_ns": 1, "path": "/nonexistent"}}
+    new = {"a": {"size": 2, "mtime_ns": 2, "path": "/nonexistent"}}
+    result = diff_listings(old, new)
+    assert result.modified == ["a"] and result.hashed == 0
@@ -0,0 +1,191 @@
+import os, threading
+from types import SimpleNamespace
+import pytest
+from conftest import make_app, read_tree, touch_later
+import storage_targets
+import storage_server
+from backup_engine import backup_app
+from restore_engine import restore_app, fetch_archive
+from verify_backup import verify_app
+from snapshot_diff import diff_app
+from storage_targets import open_target, HttpTarget, SftpTarget
+
+
+PART = 64 * 1024
+
+
+@pytest.fixture
+def app(work):
+    return make_app(work, {"a.txt": b"v1"})
+
+
+@pytest.fixture
+def server(work, monkeypatch):
+    monkeypatch.setattr(storage_targets, "BACKOFF", 0)
+    servers = []
+
+    def start(fail_every=0):
+        srv = storage_server.make_server(str(work / "srv"), port=0, fail_every=fail_every)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        servers.append(srv)
+        return f"http://127.0.0.1:{srv.server_address[1]}/backups"
+    yield start
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
+
+
+def test_remote_backup_leaves_local_archive_consistent(work, app):
+    backup_app("App", app, zip_enabled=True)
+    local = sorted(os.listdir("Backup"))
+    touch_later(work / "src" / "Data" / "a.txt", b"v2")
+    target = open_target(str(work / "remote"))
+    assert backup_app("App", app, zip_enabled=True, target=target)
+    # Манифест нового архива ушёл в цель, в Backup/ — прежние архив и манифест
+    assert sorted(os.listdir(work / "remote")) == ["App_backup.zip", "App_backup.zip.manifest.json"]
+    assert sorted(os.listdir("Backup")) == local
+    assert verify_app("App")
+    assert diff_app("App", app).modified == ["Data/a.txt"]
+    assert restore_app("App", app, target_dir=str(work / "out"))
+    assert read_tree(work / "out") == {"Data/a.txt": b"v1"}
+
+
+def test_fetch_does_not_touch_local_archive(work, app):
+    backup_app("App", app, zip_enabled=True)
+    before = read_tree("Backup")
+    touch_later(work / "src" / "Data" / "a.txt", b"v2")
+    target = open_target(str(work / "remote"))
+    backup_app("App", app, zip_enabled=True, target=target)
+    os.makedirs("fetched")
+    assert fetch_archive("App", target, "fetched")
+    assert read_tree("Backup") == before
+    assert verify_app("App", root="fetched")
+    assert restore_app("App", app, target_dir=str(work / "out"), root="fetched")
+    assert read_tree(work / "out") == {"Data/a.txt": b"v2"}
+
+
+def test_http_backup_with_retries(work, server):
+    data = make_app(work, {"big.bin": os.urandom(5 * PART + 3), "a.txt": b"v1"})
+    # Каждый третий запрос части сервер отклоняет: клиент повторяет её
+    target = HttpTarget(server(fail_every=3), part_size=PART)
+    assert open_target(target.url).__class__ is HttpTarget
+    assert backup_app("App", data, zip_enabled=True, target=target)
+    assert sorted(os.listdir(work / "srv" / "backups")) == ["App_backup.zip", "App_backup.zip.manifest.json"]
+    assert not os.listdir(work / "srv" / ".uploads")
+    os.makedirs("fetched")
+    assert fetch_archive("App", target, "fetched")
+    assert verify_app("App", root="fetched")
+    assert restore_app("App", data, target_dir=str(work / "out"), root="fetched")
+    assert read_tree(work / "out" / "Data") == read_tree(work / "src" / "Data")
+
+
+def test_http_put_file_resumes_missing_parts(work, server, monkeypatch):
+    src = work / "file.bin"
+    src.write_bytes(os.urandom(6 * PART + 1))
+    target = HttpTarget(server(), part_size=PART, workers=1)
+    upload_part = HttpTarget.upload_part
+    sent, stored, broken = [], set(), {2}
+
+    def flaky(self, name, upload, number, data):
+        sent.append(number)
+        if number in broken:
+            broken.discard(number)
+            raise OSError("соединение разорвано")
+        result = upload_part(self, name, upload, number, data)
+        stored.add(number)
+        return result
+    monkeypatch.setattr(HttpTarget, "upload_part", flaky)
+    with pytest.raises(OSError):
+        target.put_file(str(src), "file.bin")
+    assert not (work / "srv" / "backups" / "file.bin").exists()
+    first = set(stored)
+    assert first and 2 not in first
+    del sent[:]
+    target.put_file(str(src), "file.bin")
+    # Вторая попытка досылает в ту же сессию только части, которых нет на сервере
+    assert sorted(sent) == sorted(set(range(7)) - first)
+    assert (work / "srv" / "backups" / "file.bin").read_bytes() == src.read_bytes()
+    assert not os.listdir(storage_targets.STATE_DIR)
+
+
+class LocalSftp:
+    # Подмена клиента paramiko поверх локальной ФС; fail_after — сбой на N-й записи
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.written = 0
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def open(self, path, mode):
+        f = open(path, mode)
+        sftp = self
+
+        class Remote:
+            def set_pipelined(self, flag):
+                pass
+
+            def prefetch(self):
+                pass
+
+            def write(self, data):
+                if sftp.fail_after is not None and sftp.written >= sftp.fail_after:
+                    sftp.fail_after = None
+                    raise OSError("обрыв SFTP")
+                sftp.written += len(data)
+                f.write(data)
+
+            def read(self, n):
+                return f.read(n)
+
+            def close(self):
+                f.close()
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                f.close()
+        return Remote()
+
+    def posix_rename(self, src, dst):
+        os.replace(src, dst)
+
+    def remove(self, path):
+        os.remove(path)
+
+
+@pytest.fixture
+def sftp(work, monkeypatch):
+    monkeypatch.setattr(storage_targets, "BACKOFF", 0)
+    if storage_targets.paramiko is None:
+        monkeypatch.setattr(storage_targets, "paramiko", SimpleNamespace(SSHException=type("SSHException", (Exception,), {})))
+    (work / "remote").mkdir()
+    client = LocalSftp()
+    target = SftpTarget(f"sftp://user@nas{work / 'remote'}")
+    monkeypatch.setattr(target, "_sftp", lambda: client)
+    monkeypatch.setattr(target, "_reset", lambda: None)
+    return target, client
+
+
+def test_sftp_backup_roundtrip(work, app, sftp):
+    target, _ = sftp
+    assert backup_app("App", app, zip_enabled=True, target=target)
+    assert sorted(os.listdir(work / "remote")) == ["App_backup.zip", "App_backup.zip.manifest.json"]
+    os.makedirs("fetched")
+    assert fetch_archive("App", target, "fetched")
+    assert restore_app("App", app, target_dir=str(work / "out"), root="fetched")
+    assert read_tree(work / "out") == {"Data/a.txt": b"v1"}
+
+
+def test_sftp_put_file_resumes_after_drop(work, sftp, monkeypatch):
+    target, client = sftp
+    monkeypatch.setattr(storage_targets, "PART_SIZE", PART)
+    src = work / "file.bin"
+    src.write_bytes(os.urandom(4 * PART + 5))
+    client.fail_after = 2 * PART
+    target.put_file(str(src), "file.bin")
+    # После обрыва дописан только хвост, а не весь файл заново
+    assert client.written == src.stat().st_size
+    assert (work / "remote" / "file.bin").read_bytes() == src.read_bytes()
+    assert not (work / "remote" / "file.bin.part").exists()
@@ -0,0 +1,45 @@
+import os
+from conftest import make_app, read_tree
+from backup_engine import backup_app
+from tree_walk import iter_tree, TreeFilter
+
+
+def make_tree(root, files):
+    for rel in files:
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * (100 if rel.endswith(".big") else 1))
+
+
+def keys(src, tree_filter=None):
+    return sorted(key for _, key, _ in iter_tree(str(src), "src", tree_filter))
+
+
+def test_exclude_anywhere_and_from_root(work):
+    make_tree(work / "src", ["Cache/a", "Sub/Cache/b", "Sub/keep", "logs/c", "Sub/logs/d", "x.tmp"])
+    f = TreeFilter(exclude=["cache", "/logs", "*.tmp"])
+    # Без ведущего "/" — на любой глубине и без учёта регистра, с "/" — только от корня
+    assert keys(work / "src", f) == ["src/Sub/keep", "src/Sub/logs/d"]
+    assert f.skipped_dirs == 3 and f.skipped_files == 1
+
+
+def test_include_and_max_size(work):
+    make_tree(work / "src", ["a.json", "b.txt", "Sub/c.json", "d.big"])
+    f = TreeFilter(include=["*.json", "*.big"], max_size=10)
+    assert keys(work / "src", f) == ["src/Sub/c.json", "src/a.json"]
+    assert f.skipped_files == 2 and f.skipped_bytes == 101
+    assert f.summary() == "пропущено файлов 2 (101 B), каталогов 0"
+
+
+def test_from_plugin_presets():
+    assert TreeFilter.from_plugin({"folders": []}) is None
+    f = TreeFilter.from_plugin({"preset": "browser", "exclude": ["Extra"], "max_file_size": 5})
+    assert f.skip_dir("Default/Code Cache") and f.skip_dir("extra") and not f.skip_dir("Default")
+    assert f.skip_file("big.bin", 6)
+
+
+def test_backup_skips_excluded(work):
+    data = make_app(work, {"Prefs": b"p", "Cache/data_0": b"c", "Default/GPUCache/x": b"g"})
+    data["preset"] = "browser"
+    assert backup_app("App", data)
+    assert read_tree(os.path.join("Backup", "App", "Data")) == {"Prefs": b"p"}
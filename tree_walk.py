@@ -0,0 +1,120 @@
+import os, re, fnmatch
+from live_copy import is_leveldb, is_sqlite, sidecar_of
+import metrics
+import progress
+
+# Наборы исключений по умолчанию: кэши, которые занимают большую часть профиля
+# и не нужны при восстановлении. Подключаются в плагине через "preset".
+_CHROMIUM_CACHES = [
+    "Cache", "Code Cache", "GPUCache", "DawnCache", "DawnGraphiteCache", "DawnWebGPUCache",
+    "GrShaderCache", "GraphiteDawnCache", "ShaderCache", "Service Worker/CacheStorage",
+    "Service Worker/ScriptCache", "Crashpad", "Crash Reports", "blob_storage", "*.tmp",
+]
+PRESETS = {
+    "browser": _CHROMIUM_CACHES + [
+        "Media Cache", "Application Cache", "optimization_guide_model_store", "component_crx_cache",
+        "Safe Browsing", "cache2", "startupCache", "thumbnails",
+    ],
+    "electron": _CHROMIUM_CACHES + ["logs", "CachedData", "CachedExtensionVSIXs", "CachedExtensions"],
+}
+
+
+def _compile(patterns):
+    # Шаблон без ведущего "/" совпадает на любой глубине ("Cache" — любой каталог Cache),
+    # с ведущим "/" — только от корня папки. Регистр не учитывается, как в Windows.
+    parts = []
+    for p in patterns:
+        p = p.replace("\\", "/").rstrip("/")
+        parts.append(fnmatch.translate(p[1:]) if p.startswith("/") else "(?:.*/)?" + fnmatch.translate(p))
+    return re.compile("|".join(parts), re.IGNORECASE).match if parts else None
+
+
+class TreeFilter:
+    # Фильтр обхода: exclude отсекает файлы и целые каталоги, include (если задан) оставляет
+    # только подходящие файлы, max_size — предельный размер файла. Шаблоны компилируются один раз.
+    def __init__(self, include=(), exclude=(), max_size=None):
+        self.include = _compile(include)
+        self.exclude = _compile(exclude)
+        self.max_size = max_size
+        self.skipped_files = 0
+        self.skipped_bytes = 0
+        self.skipped_dirs = 0
+
+    @classmethod
+    def from_plugin(cls, data):
+        # None, если плагин ничего не фильтрует — тогда обход идёт без проверок
+        exclude = list(data.get("exclude", []))
+        presets = data.get("preset", [])
+        for preset in [presets] if isinstance(presets, str) else presets:
+            exclude += PRESETS[preset]
+        include = data.get("include", [])
+        max_size = data.get("max_file_size")
+        if not (exclude or include or max_size):
+            return None
+        return cls(include, exclude, max_size)
+
+    def skip_dir(self, rel):
+        if self.exclude and self.exclude(rel):
+            self.skipped_dirs += 1
+            return True
+        return False
+
+    def skip_file(self, rel, size):
+        if ((self.exclude and self.exclude(rel)) or (self.include and not self.include(rel))
+                or (self.max_size is not None and size > self.max_size)):
+            self.skipped_files += 1
+            self.skipped_bytes += size
+            return True
+        return False
+
+    def summary(self):
+        return f"пропущено файлов {self.skipped_files} ({self.skipped_bytes} B), каталогов {self.skipped_dirs}"
+
+
+def iter_tree(src, name, tree_filter=None, live=None, unchanged=None, on_error=None):
+    # Обход через os.scandir: stat берётся из DirEntry без лишних системных вызовов.
+    # Выдаёт (полный путь, ключ вида "<name>/sub/file", stat).
+    # live (LiveStaging) — базы SQLite и каталоги LevelDB отдаются согласованными копиями;
+    # unchanged — проверка по индексу до копирования (см. LiveStaging.prepare_file);
+    # on_error(путь, ключ, ошибка) — каталог не прочитался: обход идёт дальше без него
+    # (без on_error ошибка прерывает обход).
+    stack = [(src, name, "")]
+    op = metrics.current()
+    while stack:
+        progress.check()
+        folder, key, rel = stack.pop()
+        with metrics.phase("stat", op):
+            try:
+                with os.scandir(folder) as it:
+                    entries = list(it)
+            except OSError as e:
+                if on_error is None:
+                    raise
+                on_error(folder, key, e)
+                continue
+            files = []
+            for entry in entries:
+                sub = rel + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if tree_filter is None or not tree_filter.skip_dir(sub):
+                        stack.append((entry.path, key + "/" + entry.name, sub + "/"))
+                elif entry.is_file():
+                    st = entry.stat()
+                    if tree_filter is None or not tree_filter.skip_file(sub, st.st_size):
+                        files.append((entry, st))
+        if live is None:
+            for entry, st in files:
+                yield entry.path, key + "/" + entry.name, st
+            continue
+        names = {entry.name for entry in entries}
+        if is_leveldb(names):
+            for path, fname, st in live.stage_leveldb(folder, [entry for entry, _ in files], key, unchanged):
+                yield path, key + "/" + fname, st
+            continue
+        for entry, st in files:
+            base = sidecar_of(entry.name)
+            if base in names and is_sqlite(os.path.join(folder, base)):
+                # -wal/-shm/-journal уже учтены в копии основной базы
+                continue
+            path, st = live.prepare_file(entry.path, st, key + "/" + entry.name, unchanged)
+            yield path, key + "/" + entry.name, st
@@ -0,0 +1,103 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from backup_engine import log
+from archive_index import ArchiveIndex
+from chunk_store import chunk_digest
+from manifest import manifest_path, load_manifest, new_hash, BUF_SIZE
+
+DEFAULT_WORKERS = min(8, (os.cpu_count() or 2) * 2)
+
+
+def _hash_stream(f, algo):
+    h = new_hash(algo)
+    for block in iter(lambda: f.read(BUF_SIZE), b""):
+        h.update(block)
+    return h.hexdigest()
+
+
+def _check_file(path, entry, algo):
+    try:
+        if os.path.getsize(path) != entry["size"]:
+            return "размер не совпадает"
+        with open(path, "rb") as f:
+            return None if _hash_stream(f, algo) == entry["digest"] else "хеш не совпадает"
+    except OSError as e:
+        return str(e)
+
+
+def _check_member(index, name, entry, algo):
+    # Индекс архива читается через mmap и безопасен для нескольких потоков.
+    # У зашифрованного архива хешей в манифесте нет — подлинность проверяют CRC и тег GCM при чтении
+    try:
+        member = index.lookup(name)
+        if member is None:
+            return "нет в архиве"
+        if member.size != entry["size"]:
+            return "размер не совпадает"
+        with index.open(member) as f:
+            digest = _hash_stream(f, algo)
+        return None if entry.get("digest", digest) == digest else "хеш не совпадает"
+    except Exception as e:
+        return str(e)
+
+
+def _check_chunk(store, digest):
+    try:
+        return None if chunk_digest(store.get(digest)) == digest else "хеш чанка не совпадает"
+    except Exception as e:
+        return str(e)
+
+
+def verify_app(app, store=None, workers=DEFAULT_WORKERS, secret=None, root="Backup"):
+    # Перечитывает копию и сверяет с хешами из манифеста; True — всё цело.
+    # root — где лежат копия и архив (скачанный из цели хранения — во временном каталоге)
+    checks = []
+    locked = False
+    out_dir = os.path.join(root, app)
+    zip_path = os.path.join(root, f"{app}_backup.zip")
+
+    manifest = load_manifest(manifest_path(out_dir))
+    if manifest and os.path.isdir(out_dir):
+        for key, entry in manifest["files"].items():
+            path = os.path.join(out_dir, *key.split("/"))
+            checks.append((path, _check_file, (path, entry, manifest["algo"])))
+
+    index = None
+    manifest = load_manifest(manifest_path(zip_path))
+    if manifest and os.path.exists(zip_path):
+        try:
+            index = ArchiveIndex(zip_path, secret)
+        except Exception as e:
+            checks.append((zip_path, lambda error: error, (f"архив не читается: {e}",)))
+        else:
+            if index.encrypted and index.key is None:
+                log(f"[SKIP] Архив зашифрован, для проверки нужен пароль: {zip_path}")
+                index.close()
+                index, manifest, locked = None, {"files": {}}, True
+            for key, entry in manifest["files"].items():
+                checks.append((f"{zip_path}:{key}", _check_member, (index, key, entry, manifest["algo"])))
+
+    snapshot = store.load_manifest(app) if store else None
+    if snapshot:
+        digests = {d for entry in snapshot["files"] for d in entry["chunks"]}
+        for digest in sorted(digests):
+            checks.append((store.chunk_path(digest), _check_chunk, (store, digest)))
+
+    if not checks:
+        if not locked:
+            log(f"[SKIP] Нет манифеста для проверки: {app}")
+        return False
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            results = list(pool.map(lambda c: c[1](*c[2]), checks))
+    finally:
+        if index is not None:
+            index.close()
+    corrupt = 0
+    for (what, _, _), error in zip(checks, results):
+        if error:
+            corrupt += 1
+            log(f"[CORRUPT] {what} — {error}")
+    log(f"[VERIFY] {app}: проверено {len(checks)}, повреждено {corrupt}")
+    return corrupt == 0